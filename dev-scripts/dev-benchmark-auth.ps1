@@ -0,0 +1,9 @@
+# Run SSH authorization benchmark in web container
+
+# Import common functions
+. "$PSScriptRoot/common.ps1"
+
+# Extra arguments are passed to the command, e.g. --users 100 --tunnels 2000 --without-snapshot
+Write-ColorMessage $Colors.Blue "Running SSH authorization benchmark in $CONTAINER_WEB_NAME..."
+docker exec -it $CONTAINER_WEB_NAME python manage.py benchmark_auth_keys --cleanup @args
+Write-ColorMessage $Colors.Green "Benchmark results are in ./telepy-data/benchmarks."
@@ -0,0 +1,8 @@
+#!/bin/bash
+
+source "$(dirname "$0")/common.sh"
+
+# Extra arguments are passed to the command, e.g. --users 100 --tunnels 2000 --without-snapshot
+print_message "$BLUE" "Running SSH authorization benchmark in ${CONTAINER_WEB_NAME}..."
+docker exec -it ${CONTAINER_WEB_NAME} python manage.py benchmark_auth_keys --cleanup "$@"
+print_message "$GREEN" "Benchmark results are in ./telepy-data/benchmarks."
@@ -47,9 +47,16 @@ class ServiceAuthorizedKeysForm(forms.ModelForm):
 @admin.register(ReverseServerAuthorizedKeys)
 class ReverseServerAuthorizedKeysAdmin(admin.ModelAdmin):
     form = ReverseServerAuthorizedKeysForm
-    list_display = ('user', 'host_friendly_name', 'display_key', 'reverse_port', 'created_at', 'updated_at')
+    list_display = ('user', 'host_friendly_name', 'display_key', 'reverse_port', 'gateway', 'record_sessions', 'created_at', 'updated_at')
+    list_filter = ('gateway', 'record_sessions')
     search_fields = ('user', 'host_friendly_name', 'key', 'reverse_port', 'description')
 
+    def get_readonly_fields(self, request, obj=None):
+        # The allocator only learns about ports of created and deleted tunnels
+        if obj is not None:
+            return ('reverse_port',)
+        return ()
+
     def display_key(self, obj):
         key = obj.key
         if len(key) > 10:
@@ -50,7 +50,8 @@ class RemoteBrowserStartView(APIView):
             result = start_remote_browser(
                 target_username=username,
                 target_reverse_port=tunnel.reverse_port,
-                server_id=server_id
+                server_id=server_id,
+                gateway=tunnel.gateway,
             )
             return JsonResponse(result)
         except Exception as e:
@@ -0,0 +1,174 @@
+"""
+Push-mode authorized_keys files for sshd.
+
+Opt-in alternative to the per-login `AuthorizedKeysCommand` lookup: the
+backend renders the accepted key lines to a volume shared with the SSH
+container, and sshd reads them through `AuthorizedKeysFile` without any HTTP
+round trip.  Enabled by `AUTHORIZED_KEYS_PUSH_MODE`; layout under
+`AUTHORIZED_KEYS_PUSH_DIR`:
+
+    users/<user id>.keys   key lines accepted for one user (own tunnel keys,
+                           plus personal keys if the user has tunnels)
+    service.keys           service key lines
+    authorized_keys        all of the above, read by sshd
+
+All tunnels are reached through the single sshd account, so sshd reads the
+combined file; the per-user files keep regeneration incremental — only the
+affected users are re-queried after a key or sharing change (see
+`authorized_keys/signals.py`).  Every file is written to a temp file and
+renamed into place, so sshd never reads a partial file.
+"""
+import os
+import fcntl
+import logging
+import tempfile
+from pathlib import Path
+from typing import List
+
+from django.conf import settings
+
+from authorized_keys.key_snapshot import collect_owner_entries, collect_service_entry
+
+logger = logging.getLogger('authorized_keys.internal')
+
+USERS_DIR_NAME = "users"
+SERVICE_FILE_NAME = "service.keys"
+COMBINED_FILE_NAME = "authorized_keys"
+LOCK_FILE_NAME = ".lock"
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "AUTHORIZED_KEYS_PUSH_MODE", False)
+
+
+def get_push_dir() -> Path:
+    return Path(settings.AUTHORIZED_KEYS_PUSH_DIR)
+
+
+def _user_file(push_dir: Path, owner_id) -> Path:
+    return push_dir / USERS_DIR_NAME / f"{owner_id}.keys"
+
+
+def _render_lines(keys: List[str]) -> str:
+    lines = sorted(set(key.strip() for key in keys if key.strip()))
+    return "".join(f"{line}\n" for line in lines)
+
+
+def write_atomic(path: Path, content: str) -> bool:
+    """Write `content` to `path` via temp file + rename. Returns False if unchanged."""
+    try:
+        if path.read_text() == content:
+            return False
+    except OSError:
+        pass
+
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        # sshd (StrictModes) rejects key files writable by group/others
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+class _PushDirLock:
+    """Serialize writers across backend processes (flock on a lock file)."""
+
+    def __init__(self, push_dir: Path):
+        self.push_dir = push_dir
+
+    def __enter__(self):
+        (self.push_dir / USERS_DIR_NAME).mkdir(mode=0o755, parents=True, exist_ok=True)
+        self.lock_file = open(self.push_dir / LOCK_FILE_NAME, "w")
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+def _assemble(push_dir: Path) -> None:
+    """Rewrite the combined file from the per-user and service files."""
+    parts = []
+    service_file = push_dir / SERVICE_FILE_NAME
+    if service_file.exists():
+        parts.append(service_file.read_text())
+    for user_file in sorted((push_dir / USERS_DIR_NAME).glob("*.keys")):
+        parts.append(user_file.read_text())
+
+    lines = "".join(parts).splitlines()
+    write_atomic(push_dir / COMBINED_FILE_NAME, _render_lines(lines))
+
+
+def _write_owner_file(push_dir: Path, owner_id, keys: List[str]) -> bool:
+    path = _user_file(push_dir, owner_id)
+    if not keys:
+        if path.exists():
+            path.unlink()
+            return True
+        return False
+    return write_atomic(path, _render_lines(keys))
+
+
+def render_owners(owner_ids: List[int]) -> None:
+    """Rewrite the files of the given users after a key or sharing change."""
+    if not is_enabled() or not owner_ids:
+        return
+    push_dir = get_push_dir()
+    try:
+        entries = collect_owner_entries(list(set(owner_ids)))
+        with _PushDirLock(push_dir):
+            changed = False
+            for owner_id in set(owner_ids):
+                entry = entries.get(str(owner_id), {"keys": []})
+                changed |= _write_owner_file(push_dir, owner_id, entry["keys"])
+            if changed:
+                _assemble(push_dir)
+    except OSError as e:
+        logger.error("Authorized keys files: failed to render owners %s (%s)", owner_ids, e)
+
+
+def render_service_keys() -> None:
+    if not is_enabled():
+        return
+    push_dir = get_push_dir()
+    try:
+        keys = [item["key"] for item in collect_service_entry()["fingerprints"].values()]
+        with _PushDirLock(push_dir):
+            if write_atomic(push_dir / SERVICE_FILE_NAME, _render_lines(keys)):
+                _assemble(push_dir)
+    except OSError as e:
+        logger.error("Authorized keys files: failed to render service keys (%s)", e)
+
+
+def render_all() -> int:
+    """
+    Render every user's file and the service file from scratch, removing files
+    of users that no longer have keys.
+
+    Returns:
+    - int: The number of users with a key file.
+    """
+    push_dir = get_push_dir()
+    entries = collect_owner_entries()
+    service_keys = [item["key"] for item in collect_service_entry()["fingerprints"].values()]
+
+    with _PushDirLock(push_dir):
+        written = set()
+        for field, entry in entries.items():
+            if entry["keys"]:
+                write_atomic(_user_file(push_dir, field), _render_lines(entry["keys"]))
+                written.add(f"{field}.keys")
+        for user_file in (push_dir / USERS_DIR_NAME).glob("*.keys"):
+            if user_file.name not in written:
+                user_file.unlink()
+        write_atomic(push_dir / SERVICE_FILE_NAME, _render_lines(service_keys))
+        _assemble(push_dir)
+
+    logger.info("Authorized keys files rendered | users=%d | dir=%s", len(written), push_dir)
+    return len(written)
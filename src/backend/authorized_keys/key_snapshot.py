@@ -0,0 +1,362 @@
+"""
+Precomputed authorized-keys snapshot stored in Redis.
+
+`InternalKeysView` is called by sshd for every offered key, so instead of
+querying the three key tables on each login we keep a versioned key map in
+Redis and serve lookups from it:
+
+    <prefix>:version       live snapshot version (absent = no usable snapshot)
+    <prefix>:sequence      counter the versions are allocated from
+    <prefix>:fingerprints  hash  fingerprint -> {kind, owner_id, key, authorized}
+    <prefix>:owners        hash  owner id    -> {fingerprints, keys}
+    <prefix>:global        hash  fingerprint -> key line (all tunnel + service keys)
+
+The snapshot is rebuilt from scratch by `rebuild_snapshot` (startup and the
+`rebuild_authorized_keys_snapshot` command) and kept up to date per owner by
+the receivers in `authorized_keys/signals.py`.  If the snapshot is missing or
+Redis is unreachable the view falls back to the database.
+"""
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+
+from services.redis_client import get_redis
+
+logger = logging.getLogger('authorized_keys.internal')
+
+SNAPSHOT_PREFIX = "authorized_keys:snapshot"
+VERSION_KEY = f"{SNAPSHOT_PREFIX}:version"
+SEQUENCE_KEY = f"{SNAPSHOT_PREFIX}:sequence"
+FINGERPRINTS_KEY = f"{SNAPSHOT_PREFIX}:fingerprints"
+OWNERS_KEY = f"{SNAPSHOT_PREFIX}:owners"
+GLOBAL_KEYS_KEY = f"{SNAPSHOT_PREFIX}:global"
+
+# Owner entry used for service keys (they have no user)
+SERVICE_OWNER = "service"
+
+KIND_TUNNEL = "tunnel"
+KIND_USER = "user"
+KIND_SERVICE = "service"
+
+
+def is_enabled() -> bool:
+    return getattr(settings, "AUTHORIZED_KEYS_SNAPSHOT_ENABLED", True)
+
+
+def _owner_field(owner_id) -> str:
+    return str(owner_id)
+
+
+def collect_owner_entries(owner_ids: Optional[List[int]] = None) -> Dict[str, dict]:
+    """
+    Build snapshot entries for the given owners (all users if `owner_ids` is None).
+
+    Returns a mapping of owner field -> {"fingerprints": {fp: entry}, "keys": [...]}
+    where `keys` are the owner's eligible key lines (own tunnel keys, plus
+    personal keys when the owner has own or shared tunnels).
+    """
+    from authorized_keys.models import ReverseServerAuthorizedKeys, UserAuthorizedKeys
+    from tunnels.models import TunnelSharing
+
+    tunnel_rows = ReverseServerAuthorizedKeys.objects.all()
+    user_rows = UserAuthorizedKeys.objects.all()
+    sharings = TunnelSharing.objects.all()
+    if owner_ids is not None:
+        tunnel_rows = tunnel_rows.filter(user_id__in=owner_ids)
+        user_rows = user_rows.filter(user_id__in=owner_ids)
+        sharings = sharings.filter(shared_with_id__in=owner_ids)
+
+    owners = defaultdict(lambda: {"tunnel_keys": [], "user_keys": []})
+    for owner_id in owner_ids or []:
+        owners[owner_id]  # Owners without keys still get an (empty) entry
+    for owner_id, key, fingerprint in tunnel_rows.values_list('user_id', 'key', 'key_fingerprint'):
+        owners[owner_id]["tunnel_keys"].append((key, fingerprint))
+    for owner_id, key, fingerprint in user_rows.values_list('user_id', 'key', 'key_fingerprint'):
+        owners[owner_id]["user_keys"].append((key, fingerprint))
+
+    shared_owner_ids = set(sharings.values_list('shared_with_id', flat=True))
+
+    entries = {}
+    for owner_id, data in owners.items():
+        field = _owner_field(owner_id)
+        # Same rule as InternalKeysView: personal keys only if the owner has tunnels
+        eligible = bool(data["tunnel_keys"]) or owner_id in shared_owner_ids
+
+        fingerprints = {}
+        keys = []
+        for key, fingerprint in data["tunnel_keys"]:
+            fingerprints[fingerprint] = {
+                "kind": KIND_TUNNEL, "owner_id": owner_id, "key": key, "authorized": True,
+            }
+            keys.append(key)
+        for key, fingerprint in data["user_keys"]:
+            # A tunnel key registered again as a personal key keeps its tunnel entry
+            fingerprints.setdefault(fingerprint, {
+                "kind": KIND_USER, "owner_id": owner_id, "key": key, "authorized": eligible,
+            })
+            if eligible:
+                keys.append(key)
+        entries[field] = {"fingerprints": fingerprints, "keys": keys}
+    return entries
+
+
+def collect_service_entry() -> dict:
+    from authorized_keys.models import ServiceAuthorizedKeys
+
+    fingerprints = {}
+    for key, fingerprint in ServiceAuthorizedKeys.objects.values_list('key', 'key_fingerprint'):
+        fingerprints[fingerprint] = {
+            "kind": KIND_SERVICE, "owner_id": None, "key": key, "authorized": True,
+        }
+    return {"fingerprints": fingerprints, "keys": []}
+
+
+def _owner_record(entry: dict) -> str:
+    return json.dumps({"fingerprints": list(entry["fingerprints"].keys()), "keys": entry["keys"]})
+
+
+def resolve_fingerprints(fingerprints: Optional[Set[str]] = None) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Compute the stored values of `fingerprints` (all of them if None) from the three key tables.
+
+    Keys are only unique within their table, so several owners may hold the
+    same fingerprint: the entry is chosen like `lookup_offered_key` (tunnel
+    keys, then user keys, then service keys, lowest id first), and the global
+    hash has it while any tunnel or service key does.  Fingerprints no row
+    holds are in neither mapping.
+
+    Returns:
+    - Tuple[Dict[str, str], Dict[str, str]]: `(fingerprints, global_keys)`, JSON entries and key lines.
+    """
+    from authorized_keys.models import ReverseServerAuthorizedKeys, ServiceAuthorizedKeys, UserAuthorizedKeys
+    from tunnels.models import TunnelSharing
+
+    def rows(model, *fields):
+        queryset = model.objects.order_by('id')
+        if fingerprints is not None:
+            queryset = queryset.filter(key_fingerprint__in=fingerprints)
+        return list(queryset.values_list('key_fingerprint', *fields))
+
+    tunnel_rows = rows(ReverseServerAuthorizedKeys, 'user_id', 'key')
+    user_rows = rows(UserAuthorizedKeys, 'user_id', 'key')
+    service_rows = rows(ServiceAuthorizedKeys, 'key')
+
+    # Same rule as InternalKeysView: personal keys only if the owner has tunnels
+    user_owner_ids = {owner_id for _, owner_id, _ in user_rows}
+    eligible = set(
+        ReverseServerAuthorizedKeys.objects.filter(user_id__in=user_owner_ids).values_list('user_id', flat=True)
+    ) | set(
+        TunnelSharing.objects.filter(shared_with_id__in=user_owner_ids).values_list('shared_with_id', flat=True)
+    )
+
+    entries = {}
+    global_keys = {}
+    for fingerprint, owner_id, key in tunnel_rows:
+        entries.setdefault(fingerprint, {"kind": KIND_TUNNEL, "owner_id": owner_id, "key": key, "authorized": True})
+        global_keys.setdefault(fingerprint, key)
+    for fingerprint, owner_id, key in user_rows:
+        entries.setdefault(fingerprint, {
+            "kind": KIND_USER, "owner_id": owner_id, "key": key, "authorized": owner_id in eligible,
+        })
+    for fingerprint, key in service_rows:
+        entries.setdefault(fingerprint, {"kind": KIND_SERVICE, "owner_id": None, "key": key, "authorized": True})
+        global_keys.setdefault(fingerprint, key)
+    return {fingerprint: json.dumps(entry) for fingerprint, entry in entries.items()}, global_keys
+
+
+def invalidate() -> None:
+    """Drop the snapshot version so lookups fall back to the database."""
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.delete(VERSION_KEY)
+    except Exception as e:
+        logger.error("Authorized keys snapshot: failed to invalidate (%s)", e)
+
+
+def rebuild_snapshot() -> Optional[int]:
+    """
+    Rebuild the whole snapshot from the database and swap it in atomically.
+
+    The new hashes are written under staging names and then RENAMEd over the
+    live ones in a single MULTI/EXEC, so readers never see a partial snapshot.
+
+    Returns:
+    - Optional[int]: The new snapshot version, or None if Redis is unavailable.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+
+    entries = collect_owner_entries()
+    entries[SERVICE_OWNER] = collect_service_entry()
+
+    owners = {field: _owner_record(entry) for field, entry in entries.items()}
+    fingerprints, global_keys = resolve_fingerprints()
+
+    try:
+        version = client.incr(SEQUENCE_KEY)
+        staging = f"{SNAPSHOT_PREFIX}:staging:{version}"
+        staged = {
+            FINGERPRINTS_KEY: (f"{staging}:fingerprints", fingerprints),
+            OWNERS_KEY: (f"{staging}:owners", owners),
+            GLOBAL_KEYS_KEY: (f"{staging}:global", global_keys),
+        }
+
+        pipe = client.pipeline(transaction=False)
+        for staging_key, mapping in staged.values():
+            pipe.delete(staging_key)
+            if mapping:
+                pipe.hset(staging_key, mapping=mapping)
+        pipe.execute()
+
+        pipe = client.pipeline(transaction=True)
+        for live_key, (staging_key, mapping) in staged.items():
+            if mapping:
+                pipe.rename(staging_key, live_key)
+            else:
+                pipe.delete(live_key)
+        pipe.set(VERSION_KEY, version)
+        pipe.execute()
+    except Exception as e:
+        logger.error("Authorized keys snapshot: rebuild failed (%s)", e)
+        invalidate()
+        return None
+
+    logger.info(
+        "Authorized keys snapshot rebuilt | version=%s | fingerprints=%d | owners=%d",
+        version, len(fingerprints), len(owners),
+    )
+    return version
+
+
+def _replace_owner_entries(client, entries: Dict[str, dict]) -> None:
+    """Replace the stored entries of the given owners, and recompute the fingerprints they had or have."""
+    fields = list(entries.keys())
+    previous = client.hmget(OWNERS_KEY, fields)
+
+    touched = set()
+    for field, raw in zip(fields, previous):
+        if raw:
+            touched.update(json.loads(raw)["fingerprints"])
+        touched.update(entries[field]["fingerprints"].keys())
+    # Other owners may hold the same fingerprints: resolve them from all tables
+    fingerprints, global_keys = resolve_fingerprints(touched) if touched else ({}, {})
+
+    pipe = client.pipeline(transaction=True)
+    # Removed only once no row holds them any more
+    gone = touched - fingerprints.keys()
+    if gone:
+        pipe.hdel(FINGERPRINTS_KEY, *gone)
+    if fingerprints:
+        pipe.hset(FINGERPRINTS_KEY, mapping=fingerprints)
+    not_global = touched - global_keys.keys()
+    if not_global:
+        pipe.hdel(GLOBAL_KEYS_KEY, *not_global)
+    if global_keys:
+        pipe.hset(GLOBAL_KEYS_KEY, mapping=global_keys)
+    for field in fields:
+        pipe.hset(OWNERS_KEY, field, _owner_record(entries[field]))
+    # Bump the version, but never resurrect a snapshot invalidated meanwhile
+    pipe.set(VERSION_KEY, client.incr(SEQUENCE_KEY), xx=True)
+    pipe.execute()
+
+
+def refresh_owners(owner_ids: List[int]) -> None:
+    """Recompute the snapshot entries of the given users after a key or sharing change."""
+    if not is_enabled() or not owner_ids:
+        return
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        if not client.exists(VERSION_KEY):
+            # No live snapshot: nothing to patch, lookups already use the database
+            return
+        _replace_owner_entries(client, collect_owner_entries(list(set(owner_ids))))
+    except Exception as e:
+        logger.error("Authorized keys snapshot: failed to refresh owners %s (%s)", owner_ids, e)
+        invalidate()
+
+
+def refresh_service_keys() -> None:
+    """Recompute the snapshot entries of the service keys."""
+    if not is_enabled():
+        return
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        if not client.exists(VERSION_KEY):
+            return
+        _replace_owner_entries(client, {SERVICE_OWNER: collect_service_entry()})
+    except Exception as e:
+        logger.error("Authorized keys snapshot: failed to refresh service keys (%s)", e)
+        invalidate()
+
+
+def lookup_fingerprint(fingerprint: str) -> Tuple[bool, Optional[dict]]:
+    """
+    Look up a fingerprint in the snapshot with a single round trip.
+
+    Returns:
+    - Tuple[bool, Optional[dict]]: `(ready, entry)`. `ready` is False when the
+      snapshot is disabled, missing or Redis failed; the caller must then use
+      the database.  `entry` is None for unknown keys.
+    """
+    if not is_enabled():
+        return False, None
+    client = get_redis()
+    if client is None:
+        return False, None
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.get(VERSION_KEY)
+        pipe.hget(FINGERPRINTS_KEY, fingerprint)
+        version, raw = pipe.execute()
+    except Exception as e:
+        logger.warning("Authorized keys snapshot: lookup failed (%s)", e)
+        return False, None
+    if version is None:
+        return False, None
+    return True, (json.loads(raw) if raw else None)
+
+
+def get_full_key_lines(owner_id: Optional[int]) -> Optional[List[str]]:
+    """
+    Return the key lines for the full (non-minimal) response: the owner's
+    eligible keys plus all tunnel and service keys.  None if the snapshot
+    cannot be read.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        pipe = client.pipeline(transaction=False)
+        pipe.hvals(GLOBAL_KEYS_KEY)
+        if owner_id is not None:
+            pipe.hget(OWNERS_KEY, _owner_field(owner_id))
+        results = pipe.execute()
+    except Exception as e:
+        logger.warning("Authorized keys snapshot: full lookup failed (%s)", e)
+        return None
+
+    keys = set(value.decode() if isinstance(value, bytes) else value for value in results[0])
+    if owner_id is not None and results[1]:
+        keys.update(json.loads(results[1])["keys"])
+    return list(keys)
+
+
+def get_version() -> Optional[int]:
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        version = client.get(VERSION_KEY)
+    except Exception:
+        return None
+    return int(version) if version is not None else None
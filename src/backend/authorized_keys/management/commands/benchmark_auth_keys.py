@@ -0,0 +1,430 @@
+import json
+import time
+import base64
+import random
+import threading
+import http.client
+import urllib.parse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from authorized_keys import key_files
+from authorized_keys import key_snapshot
+from authorized_keys import port_index
+from authorized_keys.models import ReverseServerAuthorizedKeys, UserAuthorizedKeys
+from authorized_keys.permissions import INTERNAL_API_TOKEN
+from authorized_keys.utils import compute_key_fingerprint
+from authorized_keys.views import InternalKeysView
+from reverse_keys import port_allocator
+from tunnels.models import TunnelSharing
+
+BENCH_USER_PREFIX = "bench-user-"
+BENCH_TUNNEL_PREFIX = "bench-tunnel-"
+BENCH_PERSONAL_PREFIX = "bench-personal-"
+BENCH_KEY_TYPE = "ssh-ed25519"
+BENCH_KEY_COMMENT = "telepy-bench"
+
+# Offered key kinds, see `build_workload`
+SCENARIO_TUNNEL = "tunnel"            # tunnel key → accepted
+SCENARIO_PERSONAL = "personal"        # personal key of a tunnel owner → accepted
+SCENARIO_SHARED = "shared"            # personal key of a shared-only user → accepted
+SCENARIO_DENIED = "denied"            # personal key of a user without tunnels → rejected
+SCENARIO_UNKNOWN = "unknown"          # random key (scanner) → rejected
+
+DEFAULT_MIX = "tunnel=40,personal=15,shared=10,denied=5,unknown=30"
+
+BATCH_SIZE = 1000
+
+
+def random_key_blob(rng: random.Random) -> str:
+    # Same length and prefix as a real ed25519 public key blob
+    payload = b"\x00\x00\x00\x0bssh-ed25519\x00\x00\x00\x20" + rng.randbytes(32)
+    return base64.b64encode(payload).decode()
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples) -> dict:
+    latencies = sorted(sample["latency_ms"] for sample in samples)
+    sizes = [sample["size"] for sample in samples]
+    queries = [sample["queries"] for sample in samples if sample["queries"] is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for sample in samples if sample["error"]),
+        "accepted": sum(1 for sample in samples if sample["size"] > 0),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p95": round(percentile(latencies, 0.95), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+        "queries": {
+            "mean": round(sum(queries) / len(queries), 3) if queries else None,
+            "max": max(queries) if queries else None,
+        },
+        "response_bytes": {
+            "mean": round(sum(sizes) / len(sizes), 1) if sizes else 0.0,
+            "max": max(sizes) if sizes else 0,
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the sshd authorization path (InternalKeysView): seed synthetic users, "
+        "tunnels and sharings, replay concurrent key lookups and write latency, query "
+        "count and response size percentiles to a JSON file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--tunnels', type=int, default=20000)
+        parser.add_argument('--sharings', type=int, default=50000)
+        parser.add_argument('--personal-keys', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--mode', choices=[InternalKeysView.MODE_MINIMAL, InternalKeysView.MODE_FULL],
+                            default=InternalKeysView.MODE_MINIMAL)
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help=f"Weights of the offered key kinds (default: {DEFAULT_MIX})")
+        parser.add_argument('--target', choices=['in-process', 'http'], default='in-process',
+                            help="in-process calls the view directly and counts DB queries; "
+                                 "http replays the AuthorizedKeysCommand requests against --url")
+        parser.add_argument('--url', default="http://127.0.0.1:8000/api/reverse/internal/keys")
+        parser.add_argument('--keep-alive', action='store_true',
+                            help="http target: reuse connections like the SSH resolver daemon "
+                                 "(default: one connection per lookup like curl)")
+        parser.add_argument('--without-snapshot', action='store_true',
+                            help="Drop the Redis key snapshot during the run to measure the database path")
+        parser.add_argument('--seed', type=int, default=42, help="Random seed for data and workload")
+        parser.add_argument('--reuse-data', action='store_true', help="Skip seeding, use existing bench data")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the bench data after the run")
+        parser.add_argument('--output', help="Result file (default: DATA_DIR/benchmarks/auth-keys-<time>.json)")
+        parser.add_argument('--baseline', help="Previous result file to compare against")
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help="Allowed relative p95 latency / query count increase over --baseline")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        mix = self.parse_mix(options['mix'])
+
+        if not options['reuse_data']:
+            self.delete_bench_data()
+            self.seed(rng, options)
+        pools = self.load_pools(rng)
+
+        workload = self.build_workload(rng, pools, mix, options['requests'])
+        self.stdout.write(
+            f"Replaying {len(workload)} lookups | concurrency={options['concurrency']} | "
+            f"target={options['target']} | mode={options['mode']}"
+        )
+
+        if options['without_snapshot']:
+            key_snapshot.invalidate()
+
+        started = time.perf_counter()
+        try:
+            if options['target'] == 'http':
+                samples = self.run_http(workload, options)
+            else:
+                samples = self.run_in_process(workload, options)
+        finally:
+            wall_seconds = time.perf_counter() - started
+            if options['without_snapshot'] and key_snapshot.is_enabled():
+                key_snapshot.rebuild_snapshot()
+
+        result = {
+            "benchmark": "auth_keys",
+            "created_at": datetime.now().isoformat(timespec='seconds'),
+            "config": {
+                key: options[key] for key in (
+                    'users', 'tunnels', 'sharings', 'personal_keys', 'requests',
+                    'concurrency', 'mode', 'mix', 'target', 'keep_alive', 'without_snapshot', 'seed',
+                )
+            },
+            "snapshot_enabled": key_snapshot.is_enabled() and not options['without_snapshot'],
+            "wall_seconds": round(wall_seconds, 3),
+            "throughput_rps": round(len(samples) / wall_seconds, 1) if wall_seconds else None,
+            "overall": summarize(samples),
+            "scenarios": {
+                scenario: summarize([sample for sample in samples if sample["scenario"] == scenario])
+                for scenario in mix
+            },
+        }
+
+        output = Path(options['output']) if options['output'] else (
+            Path(settings.DATA_DIR) / "benchmarks" / f"auth-keys-{datetime.now():%Y%m%d-%H%M%S}.json"
+        )
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(result, indent=2))
+
+        overall = result["overall"]
+        self.stdout.write(
+            f"p50={overall['latency_ms']['p50']}ms p95={overall['latency_ms']['p95']}ms "
+            f"p99={overall['latency_ms']['p99']}ms | queries/lookup={overall['queries']['mean']} | "
+            f"{result['throughput_rps']} req/s | errors={overall['errors']}"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}"))
+
+        if options['cleanup']:
+            self.delete_bench_data()
+
+        if options['baseline']:
+            self.compare(result, options['baseline'], options['max_regression'])
+
+    # ------------------------------------------------------------------ data
+
+    @staticmethod
+    def parse_mix(value: str) -> dict:
+        scenarios = (SCENARIO_TUNNEL, SCENARIO_PERSONAL, SCENARIO_SHARED, SCENARIO_DENIED, SCENARIO_UNKNOWN)
+        mix = {}
+        for part in value.split(','):
+            name, _, weight = part.partition('=')
+            if name.strip() not in scenarios:
+                raise CommandError(f"Unknown scenario '{name}' in --mix (expected {', '.join(scenarios)})")
+            mix[name.strip()] = float(weight or 1)
+        return mix
+
+    def seed(self, rng: random.Random, options) -> None:
+        user_count, tunnel_count = options['users'], options['tunnels']
+        if user_count < 4:
+            raise CommandError("--users must be at least 4")
+
+        self.stdout.write(
+            f"Seeding {user_count} users, {tunnel_count} tunnels, {options['sharings']} sharings, "
+            f"{options['personal_keys']} personal keys..."
+        )
+        used_ports = set(ReverseServerAuthorizedKeys.objects.values_list('reverse_port', flat=True))
+        free_ports = [port for port in range(1024, 65536) if port not in used_ports]
+        if tunnel_count > len(free_ports):
+            raise CommandError(f"Only {len(free_ports)} free reverse ports for {tunnel_count} tunnels")
+
+        with transaction.atomic():
+            User.objects.bulk_create(
+                [User(username=f"{BENCH_USER_PREFIX}{i}") for i in range(user_count)],
+                batch_size=BATCH_SIZE,
+            )
+            users = list(User.objects.filter(username__startswith=BENCH_USER_PREFIX).values_list('id', flat=True))
+
+            # The first half of the users own all tunnels; the rest only get shared access
+            owners = users[:len(users) // 2]
+            sharees = users[len(users) // 2:]
+
+            tunnels = []
+            for i in range(tunnel_count):
+                key = f"{BENCH_KEY_TYPE} {random_key_blob(rng)} {BENCH_KEY_COMMENT}"
+                tunnels.append(ReverseServerAuthorizedKeys(
+                    user_id=owners[i % len(owners)],
+                    host_friendly_name=f"{BENCH_TUNNEL_PREFIX}{i}",
+                    key=key,
+                    key_fingerprint=compute_key_fingerprint(key),
+                    reverse_port=free_ports[i],
+                ))
+            ReverseServerAuthorizedKeys.objects.bulk_create(tunnels, batch_size=BATCH_SIZE)
+            tunnel_ids = list(
+                ReverseServerAuthorizedKeys.objects.filter(
+                    host_friendly_name__startswith=BENCH_TUNNEL_PREFIX,
+                ).values_list('id', 'user_id')
+            )
+
+            # Personal keys: spread over owners, sharees and users without any tunnel
+            personal = []
+            for i in range(options['personal_keys']):
+                key = f"{BENCH_KEY_TYPE} {random_key_blob(rng)} {BENCH_KEY_COMMENT}"
+                personal.append(UserAuthorizedKeys(
+                    user_id=users[i % len(users)],
+                    host_friendly_name=f"{BENCH_PERSONAL_PREFIX}{i}",
+                    key=key,
+                    key_fingerprint=compute_key_fingerprint(key),
+                ))
+            UserAuthorizedKeys.objects.bulk_create(personal, batch_size=BATCH_SIZE)
+
+            # Leave the last quarter of the sharees without shared tunnels (denied scenario)
+            sharing_targets = sharees[:max(1, len(sharees) * 3 // 4)]
+            pairs = set()
+            max_pairs = len(tunnel_ids) * len(sharing_targets)
+            while len(pairs) < min(options['sharings'], max_pairs):
+                tunnel_id, owner_id = rng.choice(tunnel_ids)
+                pairs.add((tunnel_id, owner_id, rng.choice(sharing_targets)))
+            TunnelSharing.objects.bulk_create(
+                [
+                    TunnelSharing(tunnel_id=tunnel_id, shared_by_id=owner_id, shared_with_id=user_id)
+                    for tunnel_id, owner_id, user_id in pairs
+                ],
+                batch_size=BATCH_SIZE,
+            )
+
+        # bulk_create skips the signals that keep these up to date
+        self.refresh_derived_state()
+
+    def load_pools(self, rng: random.Random) -> dict:
+        """Collect the offered key blobs for each scenario from the bench data."""
+        tunnel_keys = list(
+            ReverseServerAuthorizedKeys.objects.filter(
+                host_friendly_name__startswith=BENCH_TUNNEL_PREFIX,
+            ).values_list('key', flat=True)
+        )
+        if not tunnel_keys:
+            raise CommandError("No bench data found (run without --reuse-data first)")
+
+        owner_ids = set(
+            ReverseServerAuthorizedKeys.objects.filter(
+                host_friendly_name__startswith=BENCH_TUNNEL_PREFIX,
+            ).values_list('user_id', flat=True)
+        )
+        shared_ids = set(TunnelSharing.objects.values_list('shared_with_id', flat=True))
+
+        pools = {SCENARIO_TUNNEL: tunnel_keys, SCENARIO_PERSONAL: [], SCENARIO_SHARED: [], SCENARIO_DENIED: []}
+        personal = UserAuthorizedKeys.objects.filter(
+            host_friendly_name__startswith=BENCH_PERSONAL_PREFIX,
+        ).values_list('user_id', 'key')
+        for user_id, key in personal:
+            if user_id in owner_ids:
+                pools[SCENARIO_PERSONAL].append(key)
+            elif user_id in shared_ids:
+                pools[SCENARIO_SHARED].append(key)
+            else:
+                pools[SCENARIO_DENIED].append(key)
+        pools[SCENARIO_UNKNOWN] = [f"{BENCH_KEY_TYPE} {random_key_blob(rng)}" for _ in range(1000)]
+        return pools
+
+    @staticmethod
+    def build_workload(rng: random.Random, pools: dict, mix: dict, count: int) -> list:
+        scenarios = [scenario for scenario in mix if pools.get(scenario)]
+        if not scenarios:
+            raise CommandError("No offered keys available for the requested --mix")
+        weights = [mix[scenario] for scenario in scenarios]
+
+        workload = []
+        for scenario in rng.choices(scenarios, weights=weights, k=count):
+            key_type, key_blob = rng.choice(pools[scenario]).split()[:2]
+            workload.append((scenario, key_type, key_blob))
+        return workload
+
+    def refresh_derived_state(self) -> None:
+        if key_snapshot.is_enabled():
+            key_snapshot.rebuild_snapshot()
+        if key_files.is_enabled():
+            key_files.render_all()
+        # Bench tunnels are bulk-created and raw-deleted: no per-tunnel signal
+        # refreshes the port index or the allocator
+        port_index.rebuild_index()
+        try:
+            port_allocator.rebuild()
+        except Exception as e:
+            self.stderr.write(f"Failed to rebuild port allocator: {e}")
+
+    def delete_bench_data(self) -> None:
+        bench_users = User.objects.filter(username__startswith=BENCH_USER_PREFIX)
+        if not bench_users.exists():
+            return
+        self.stdout.write("Deleting previous bench data...")
+        # Raw deletes: the per-row signals (notifications, snapshot refresh) would
+        # dominate; derived state is rebuilt once at the end instead.
+        with transaction.atomic():
+            TunnelSharing.objects.filter(shared_with__in=bench_users)._raw_delete(connection.alias)
+            ReverseServerAuthorizedKeys.objects.filter(user__in=bench_users)._raw_delete(connection.alias)
+            UserAuthorizedKeys.objects.filter(user__in=bench_users)._raw_delete(connection.alias)
+            bench_users.delete()
+        self.refresh_derived_state()
+
+    # --------------------------------------------------------------- runners
+
+    def run_in_process(self, workload, options) -> list:
+        view = InternalKeysView.as_view()
+        factory = RequestFactory()
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {INTERNAL_API_TOKEN}"}
+        if not INTERNAL_API_TOKEN:
+            raise CommandError("INTERNAL_API_TOKEN is not set")
+
+        def lookup(item):
+            scenario, key_type, key_blob = item
+            request = factory.get('/api/reverse/internal/keys', {
+                'key_type': key_type, 'key': key_blob, 'mode': options['mode'],
+            }, **headers)
+            queries = CaptureQueriesContext(connection)
+            started = time.perf_counter()
+            try:
+                with queries:
+                    response = view(request)
+                error, size = response.status_code != 200, len(response.content)
+            except Exception:
+                error, size = True, 0
+            latency_ms = (time.perf_counter() - started) * 1000
+            return {
+                "scenario": scenario, "latency_ms": latency_ms, "size": size,
+                "queries": len(queries.captured_queries), "error": error,
+            }
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            return list(executor.map(lookup, workload))
+
+    def run_http(self, workload, options) -> list:
+        url = urllib.parse.urlsplit(options['url'])
+        headers = {"Authorization": f"Bearer {INTERNAL_API_TOKEN}"}
+        keep_alive = options['keep_alive']
+
+        local = threading.local()
+
+        def get_connection():
+            if keep_alive and getattr(local, 'conn', None) is not None:
+                return local.conn
+            conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=10)
+            if keep_alive:
+                local.conn = conn
+            return conn
+
+        def lookup(item):
+            scenario, key_type, key_blob = item
+            query = urllib.parse.urlencode({'key_type': key_type, 'key': key_blob, 'mode': options['mode']})
+            started = time.perf_counter()
+            conn = get_connection()
+            try:
+                conn.request("GET", f"{url.path}?{query}", headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+                error, size = response.status != 200, len(body)
+            except (OSError, http.client.HTTPException):
+                error, size = True, 0
+                conn.close()
+                local.conn = None
+            latency_ms = (time.perf_counter() - started) * 1000
+            if not keep_alive:
+                conn.close()
+            return {"scenario": scenario, "latency_ms": latency_ms, "size": size, "queries": None, "error": error}
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            return list(executor.map(lookup, workload))
+
+    # ------------------------------------------------------------ comparison
+
+    def compare(self, result: dict, baseline_path: str, max_regression: float) -> None:
+        baseline = json.loads(Path(baseline_path).read_text())
+        checks = [
+            ("p95 latency", result["overall"]["latency_ms"]["p95"], baseline["overall"]["latency_ms"]["p95"]),
+            ("queries/lookup", result["overall"]["queries"]["mean"], baseline["overall"]["queries"]["mean"]),
+        ]
+        regressions = []
+        for name, current, previous in checks:
+            if current is None or previous is None:
+                continue
+            self.stdout.write(f"{name}: {previous} → {current}")
+            if current > previous * (1 + max_regression) and current - previous > 1e-6:
+                regressions.append(f"{name} {previous} → {current}")
+        if regressions:
+            raise CommandError(f"Auth path regressed over {max_regression:.0%}: {'; '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS("No regression against baseline"))
@@ -0,0 +1,19 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from authorized_keys.port_monitor import PortMonitor
+
+class Command(BaseCommand):
+    help = "Run the long-lived tunnel port-status monitor (pushes status changes over the channel layer)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Seconds between checks (default: PORT_MONITOR_INTERVAL)")
+
+    def handle(self, *args, **options):
+        monitor = PortMonitor(interval=options['interval'])
+        try:
+            asyncio.run(monitor.run())
+        except KeyboardInterrupt:
+            pass
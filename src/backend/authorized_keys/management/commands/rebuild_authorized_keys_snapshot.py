@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from authorized_keys import key_snapshot
+from authorized_keys.utils import backfill_key_fingerprints
+
+class Command(BaseCommand):
+    help = "Rebuild the Redis authorized-keys snapshot used by the sshd AuthorizedKeysCommand endpoint."
+
+    def handle(self, *args, **options):
+        backfilled = backfill_key_fingerprints()
+        if backfilled:
+            self.stdout.write(self.style.WARNING(f"Backfilled {backfilled} key fingerprint(s)"))
+
+        version = key_snapshot.rebuild_snapshot()
+        if version is None:
+            raise CommandError("Failed to rebuild the authorized keys snapshot (is Redis reachable?)")
+
+        self.stdout.write(self.style.SUCCESS(f"Authorized keys snapshot rebuilt (version {version})"))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from authorized_keys import key_files
+
+class Command(BaseCommand):
+    help = "Render the push-mode authorized_keys files read by sshd (AUTHORIZED_KEYS_PUSH_MODE)."
+
+    def handle(self, *args, **options):
+        if not key_files.is_enabled():
+            raise CommandError("Push mode is disabled (set AUTHORIZED_KEYS_PUSH_MODE=true)")
+
+        users = key_files.render_all()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered authorized keys files for {users} user(s) in {key_files.get_push_dir()}"
+        ))
@@ -1,13 +1,37 @@
 from django.db import models
 from django.contrib.auth.models import User
 
-class ReverseServerAuthorizedKeys(models.Model):
+class KeyFingerprintModel(models.Model):
+    # Normalized SHA-256 fingerprint of the `key` field (see `compute_key_fingerprint`)
+    # 公鑰的正規化指紋（有索引，用於 AuthorizedKeysCommand 快速查詢）
+    key_fingerprint = models.CharField(
+        max_length=64, db_index=True, editable=False, blank=True, default='',
+        verbose_name='Key Fingerprint (SHA-256)'
+    )
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        from authorized_keys.utils import compute_key_fingerprint
+        self.key_fingerprint = compute_key_fingerprint(self.key)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'key' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'key_fingerprint'}
+        super().save(*args, **kwargs)
+
+class ReverseServerAuthorizedKeys(KeyFingerprintModel):
     # Reverse Server Authorized Keys for endpoint to connect with this SSH server
     # 反向通道機器的公鑰（用於連線到我們的SSH Server）
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='User')
     host_friendly_name = models.CharField(max_length=128, unique=True, verbose_name='Host Friendly Name')
     key = models.CharField(max_length=19200, unique=True, blank=False, null=False, verbose_name='SSH Key (public)')
     reverse_port = models.PositiveIntegerField(blank=False, null=False, unique=True, verbose_name='Reverse Port')
+    # SSH gateway node the tunnel connects to (see `services/gateways.py`)
+    gateway = models.CharField(max_length=64, default='default', db_index=True, verbose_name='Gateway')
+    # Record web terminal sessions for audit (see `tunnels/terminal_recording.py`)
+    # 記錄此通道的網頁終端機操作（稽核用）
+    record_sessions = models.BooleanField(default=False, verbose_name='Record Terminal Sessions')
     description = models.TextField(blank=True, null=True, verbose_name='Description')
     default_username = models.ForeignKey(
         'ReverseServerUsernames', null=True, blank=True,
@@ -43,7 +67,7 @@ class ReverseServerUsernames(models.Model):
         # 一個使用者在端點上能有多個使用者名稱
         unique_together = ('user', 'reverse_server', 'username')
 
-class ServiceAuthorizedKeys(models.Model):
+class ServiceAuthorizedKeys(KeyFingerprintModel):
     # Service Authorized Keys used to check service on the SSH server
 
     service = models.CharField(max_length=128, unique=True, verbose_name='Service Name')
@@ -59,7 +83,7 @@ class ServiceAuthorizedKeys(models.Model):
         verbose_name = 'Service Key'
         verbose_name_plural = 'Service Keys'
 
-class UserAuthorizedKeys(models.Model):
+class UserAuthorizedKeys(KeyFingerprintModel):
     # User Authorized Keys for reversed SSH tunnel (user to connect with endpoints)
     # User also can access the SSH server using the private key
     # 使用者的公鑰（用於連線到我們的SSH Server）
@@ -0,0 +1,99 @@
+"""
+Negative-lookup cache for `InternalKeysView`.
+
+Scanners on the exposed sshd offer thousands of random public keys.  When the
+Redis snapshot (`authorized_keys.key_snapshot`) cannot answer, each of them
+would scan the three key tables and find nothing, so fingerprints that matched
+no key are remembered here for `AUTHORIZED_KEYS_NEGATIVE_CACHE_TTL` seconds:
+
+    <prefix>:miss:<fingerprint>   known-miss marker (expires after the TTL)
+    <prefix>:stats:<counter>      hit/miss counters, see `get_stats`
+
+Only fingerprints unknown to every key table are cached, so storing a key only
+has to forget its own fingerprint (see `authorized_keys/signals.py`); the TTL
+bounds the window of a lookup racing with the key being added.
+"""
+import logging
+from typing import Dict
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger('authorized_keys.internal')
+
+NEGATIVE_CACHE_PREFIX = "authorized_keys:negative"
+MISS_KEY_PREFIX = f"{NEGATIVE_CACHE_PREFIX}:miss:"
+STATS_KEY_PREFIX = f"{NEGATIVE_CACHE_PREFIX}:stats:"
+
+# Offered key was a known miss, answered without the database
+COUNTER_HITS = "hits"
+# Offered key was not cached and went to the database
+COUNTER_MISSES = "misses"
+# Offered key matched no stored key (snapshot or database)
+COUNTER_UNKNOWN_KEYS = "unknown_keys"
+
+COUNTERS = (COUNTER_HITS, COUNTER_MISSES, COUNTER_UNKNOWN_KEYS)
+
+
+def get_ttl() -> int:
+    return getattr(settings, "AUTHORIZED_KEYS_NEGATIVE_CACHE_TTL", 60)
+
+
+def is_enabled() -> bool:
+    return get_ttl() > 0
+
+
+def count(counter: str) -> None:
+    key = f"{STATS_KEY_PREFIX}{counter}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        # First increment: counter does not exist yet
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+    except Exception as e:
+        logger.warning("Negative key cache: failed to count %s (%s)", counter, e)
+
+
+def is_known_miss(fingerprint: str) -> bool:
+    """Return True if the fingerprint is cached as matching no stored key."""
+    if not is_enabled():
+        return False
+    try:
+        hit = cache.get(f"{MISS_KEY_PREFIX}{fingerprint}") is not None
+    except Exception as e:
+        logger.warning("Negative key cache: lookup failed (%s)", e)
+        return False
+    count(COUNTER_HITS if hit else COUNTER_MISSES)
+    return hit
+
+
+def remember_miss(fingerprint: str) -> None:
+    if not is_enabled():
+        return
+    try:
+        cache.set(f"{MISS_KEY_PREFIX}{fingerprint}", 1, timeout=get_ttl())
+    except Exception as e:
+        logger.warning("Negative key cache: failed to store miss (%s)", e)
+
+
+def forget(fingerprint: str) -> None:
+    """Drop a cached miss, called when a key with this fingerprint is stored."""
+    if not fingerprint:
+        return
+    try:
+        cache.delete(f"{MISS_KEY_PREFIX}{fingerprint}")
+    except Exception as e:
+        logger.error("Negative key cache: failed to forget %s (%s)", fingerprint, e)
+
+
+def get_stats() -> Dict[str, int]:
+    try:
+        values = cache.get_many([f"{STATS_KEY_PREFIX}{counter}" for counter in COUNTERS])
+    except Exception as e:
+        logger.warning("Negative key cache: failed to read stats (%s)", e)
+        values = {}
+    return {
+        counter: int(values.get(f"{STATS_KEY_PREFIX}{counter}", 0))
+        for counter in COUNTERS
+    }
@@ -0,0 +1,188 @@
+"""
+Reverse port -> tunnel -> authorized users index stored in Redis.
+
+The port monitor has to know, for every tunnel port that changes, which
+tunnels use it and which users (owner + sharees) may see them.  Instead of
+querying tunnels and sharings for every change, the index is kept in Redis:
+
+    tunnel_ports:index           hash  port -> [{id, user_id, name, gateway, shared_with}]
+    tunnel_ports:index:tunnels   hash  tunnel id -> port (finds the old port on changes)
+    tunnel_ports:index:version   bumped on every change (absent = no usable index)
+    tunnel_ports:index:sequence  counter the versions are allocated from
+
+It is rebuilt by `rebuild_index` (startup, or by the monitor when missing)
+and patched per tunnel by the receivers in `authorized_keys/signals.py`, so a
+status change is resolved with one HMGET of the changed ports.
+"""
+import json
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+from services.gateways import DEFAULT_GATEWAY
+from services.redis_client import decode, get_redis
+
+logger = logging.getLogger('authorized_keys.port_monitor')
+
+INDEX_KEY = "tunnel_ports:index"
+TUNNELS_KEY = "tunnel_ports:index:tunnels"
+INDEX_VERSION_KEY = "tunnel_ports:index:version"
+INDEX_SEQUENCE_KEY = "tunnel_ports:index:sequence"
+
+
+@dataclass
+class TunnelRecord:
+    id: int
+    user_id: int
+    reverse_port: int
+    host_friendly_name: str
+    shared_with: Set[int] = field(default_factory=set)
+    gateway: str = DEFAULT_GATEWAY
+
+    @property
+    def authorized_users(self) -> Set[int]:
+        return {self.user_id} | self.shared_with
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "name": self.host_friendly_name,
+            "gateway": self.gateway,
+            "shared_with": sorted(self.shared_with),
+        }
+
+
+def parse_entry(port: int, raw) -> List[TunnelRecord]:
+    if not raw:
+        return []
+    return [
+        TunnelRecord(
+            item["id"], item["user_id"], port, item["name"], set(item["shared_with"]),
+            item.get("gateway", DEFAULT_GATEWAY),
+        )
+        for item in json.loads(raw)
+    ]
+
+
+def parse_index(raw: dict) -> Dict[int, List[TunnelRecord]]:
+    """Decode an HGETALL of the index into port -> tunnels."""
+    index = {}
+    for port, value in raw.items():
+        port = int(decode(port))
+        index[port] = parse_entry(port, value)
+    return index
+
+
+def collect_port_entries(ports: Optional[Iterable[int]] = None) -> Dict[int, List[TunnelRecord]]:
+    """Map reverse port -> tunnels with their sharees (all ports if None), in one query."""
+    from authorized_keys.models import ReverseServerAuthorizedKeys
+
+    rows = ReverseServerAuthorizedKeys.objects.all()
+    if ports is not None:
+        rows = rows.filter(reverse_port__in=list(ports))
+
+    tunnels = {}
+    # LEFT JOIN on the sharings: one row per (tunnel, sharee), sharee None if unshared
+    for tunnel_id, user_id, port, name, gateway, shared_with_id in rows.values_list(
+        'id', 'user_id', 'reverse_port', 'host_friendly_name', 'gateway', 'shared_with__shared_with_id',
+    ):
+        tunnel = tunnels.get(tunnel_id)
+        if tunnel is None:
+            tunnel = tunnels[tunnel_id] = TunnelRecord(tunnel_id, user_id, port, name, gateway=gateway)
+        if shared_with_id is not None:
+            tunnel.shared_with.add(shared_with_id)
+
+    by_port = defaultdict(list)
+    for tunnel in tunnels.values():
+        by_port[tunnel.reverse_port].append(tunnel)
+    return dict(by_port)
+
+
+def _dump(tunnels: List[TunnelRecord]) -> str:
+    return json.dumps([tunnel.to_dict() for tunnel in sorted(tunnels, key=lambda t: t.id)])
+
+
+def rebuild_index() -> Optional[int]:
+    """Rebuild the whole index from the database. Returns the new version."""
+    client = get_redis()
+    if client is None:
+        return None
+    entries = collect_port_entries()
+    try:
+        pipe = client.pipeline(transaction=True)
+        pipe.delete(INDEX_KEY, TUNNELS_KEY)
+        if entries:
+            pipe.hset(INDEX_KEY, mapping={port: _dump(tunnels) for port, tunnels in entries.items()})
+            pipe.hset(TUNNELS_KEY, mapping={
+                tunnel.id: port for port, tunnels in entries.items() for tunnel in tunnels
+            })
+        version = client.incr(INDEX_SEQUENCE_KEY)
+        pipe.set(INDEX_VERSION_KEY, version)
+        pipe.execute()
+        return version
+    except Exception as e:
+        logger.error("Port index: rebuild failed (%s)", e)
+        return None
+
+
+def invalidate() -> None:
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.delete(INDEX_VERSION_KEY)
+    except Exception as e:
+        logger.error("Port index: failed to invalidate (%s)", e)
+
+
+def refresh_tunnels(tunnel_ids: List[int]) -> None:
+    """Recompute the index entries of the ports used (now or before) by these tunnels."""
+    if not tunnel_ids:
+        return
+    from authorized_keys.models import ReverseServerAuthorizedKeys
+
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        if not client.exists(INDEX_VERSION_KEY):
+            # No index: the monitor rebuilds it from scratch
+            return
+        tunnel_ids = list(set(tunnel_ids))
+        ports = {int(port) for port in client.hmget(TUNNELS_KEY, tunnel_ids) if port is not None}
+        ports.update(ReverseServerAuthorizedKeys.objects.filter(
+            id__in=tunnel_ids,
+        ).values_list('reverse_port', flat=True))
+        if ports:
+            _replace_port_entries(client, ports)
+    except Exception as e:
+        logger.error("Port index: failed to refresh tunnels %s (%s)", tunnel_ids, e)
+        invalidate()
+
+
+def _replace_port_entries(client, ports: Set[int]) -> None:
+    ports = sorted(ports)
+    entries = collect_port_entries(ports)
+    previous = client.hmget(INDEX_KEY, ports)
+
+    old_tunnel_ids = {
+        tunnel.id for port, raw in zip(ports, previous) for tunnel in parse_entry(port, raw)
+    }
+    new_tunnels = {tunnel.id: port for port, tunnels in entries.items() for tunnel in tunnels}
+
+    pipe = client.pipeline(transaction=True)
+    removed_ports = [port for port in ports if port not in entries]
+    if removed_ports:
+        pipe.hdel(INDEX_KEY, *removed_ports)
+    if entries:
+        pipe.hset(INDEX_KEY, mapping={port: _dump(tunnels) for port, tunnels in entries.items()})
+    removed_tunnels = old_tunnel_ids - set(new_tunnels)
+    if removed_tunnels:
+        pipe.hdel(TUNNELS_KEY, *removed_tunnels)
+    if new_tunnels:
+        pipe.hset(TUNNELS_KEY, mapping=new_tunnels)
+    # Bump the version, but never resurrect an index invalidated meanwhile
+    pipe.set(INDEX_VERSION_KEY, client.incr(INDEX_SEQUENCE_KEY), xx=True)
+    pipe.execute()
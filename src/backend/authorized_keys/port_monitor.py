@@ -0,0 +1,430 @@
+"""
+Long-running tunnel port-status monitor.
+
+Replaces the `websocket_update_ports.sh` loop, which booted Django, spawned
+`redis-cli` and opened a new DB connection for every `manage.py update_ports`
+run.  A single asyncio worker keeps its pooled Redis connection
+(`services.redis_client`), the listening ports and the last port status in
+memory.
+
+Every SSH gateway node (ssh/telepy-port-events.py, `services.gateways`)
+publishes structured, versioned port state (keys in `authorized_keys.utils`):
+
+    tunnel_ports:listening:<gateway>  hash    port -> listening since
+    tunnel_ports:gateway:<gateway>    heartbeat, expires when the node is gone
+    tunnel_ports:version              counter incremented on every change (all nodes)
+    tunnel_ports:events               stream  one entry per change: gateway, port, status, ts, version
+
+The monitor reads the hashes once (resync) and afterwards only the stream
+entries newer than the version it has applied (XREAD BLOCK), pushing each
+change to users as soon as it arrives.  Every PORT_MONITOR_INTERVAL seconds
+it compares the published version with its own and resyncs on a gap (missed
+or trimmed events, Redis or gateway restart), and checks the heartbeats: a
+tunnel is connected only while its port listens on its own, live gateway.
+Per-gateway counts are stored in `tunnel_ports:gateways`.
+
+The users to notify come from the port index (`authorized_keys.port_index`),
+kept in Redis by signals: it is cached in memory, re-read when its version
+changes, and the entries of the changed ports are fetched with one HMGET per
+batch of events, so the monitor never queries the database.
+
+Each change is diffed against the previous status in memory, stored in the
+`tunnel_ports:status` hash (read by the API and consumers), logged
+under a new status version and pushed over the channel layer: every affected
+user gets one TUNNEL-STATUS-DELTA with only their changed ports (see
+`authorized_keys.port_status`), and tunnel_connection_update goes to the
+changed tunnels.  Status changes of each tunnel are also appended to its
+uptime history (`authorized_keys.uptime`), which is downsampled once per
+UPTIME_DOWNSAMPLE_INTERVAL, when expired terminal recordings are deleted too
+(`tunnels.terminal_recording`).  Connected ports are probed for latency by a
+`authorized_keys.port_probe.PortProber` running in the same worker.
+
+Run with `manage.py port_monitor` (supervisord program `port_monitor`);
+`manage.py update_ports` runs a single resync with the same code.
+"""
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+
+from django.conf import settings
+
+from authorized_keys import port_index
+from authorized_keys import port_probe
+from authorized_keys import port_status
+from authorized_keys import uptime
+from authorized_keys.port_index import TunnelRecord
+from authorized_keys.utils import PORTS_VERSION_KEY, PORT_EVENTS_STREAM, GATEWAY_STATS_KEY
+from authorized_keys.utils import PORTS_STATUS_KEY, parse_ports_status
+from authorized_keys.utils import gateway_heartbeat_key, listening_ports_key
+from services.gateways import DEFAULT_GATEWAY, get_gateways
+from services.redis_client import decode, dumps, get_async_redis
+from tunnels import terminal_recording
+
+logger = logging.getLogger('authorized_keys.port_monitor')
+
+EVENT_CONNECTED = "connected"
+# XREAD BLOCK timeout (ms); the loop just re-issues the read afterwards
+EVENTS_BLOCK_MS = 5000
+EVENTS_BATCH = 100
+UPTIME_DOWNSAMPLE_INTERVAL = 3600
+
+
+@dataclass
+class PortChanges:
+    ports: Dict[int, bool]
+    connected: Set[int]
+    disconnected: Set[int]
+
+    @property
+    def active_ports(self) -> Set[int]:
+        return {port for port, status in self.ports.items() if status}
+
+
+class PortMonitor:
+    """Diff the tunnel port status in memory and push changes to the channel layer."""
+
+    def __init__(self, interval: Optional[float] = None):
+        # Seconds between version checks against the gateway and the port index
+        self.interval = interval if interval is not None else settings.PORT_MONITOR_INTERVAL
+        self.redis = None
+        self.channel_layer = None
+        self.lock = asyncio.Lock()
+        self.previous_ports: Dict[int, bool] = {}
+        self.tunnels_by_port: Dict[int, List[TunnelRecord]] = {}
+        # Last status version sent to each user (`prev` of their next delta)
+        self.user_versions: Dict[int, int] = {}
+        self.index_version = None
+        # Gateway state as of `version`; events are read after `events_id`
+        self.listening: Dict[str, Set[int]] = {}
+        self.alive: Set[str] = set()
+        self.version = 0
+        self.events_id = "0-0"
+        self.downsampled_at = 0.0
+        self.prober = port_probe.PortProber(self) if port_probe.get_interval() > 0 else None
+
+    async def setup(self) -> None:
+        self.redis = get_async_redis()
+        self.channel_layer = get_channel_layer()
+        self.previous_ports = parse_ports_status(await self.redis.hgetall(PORTS_STATUS_KEY))
+
+    async def close(self) -> None:
+        if self.redis is not None:
+            await self.redis.aclose()
+
+    async def run(self) -> None:
+        await self.setup()
+        logger.info("Port monitor started | check interval=%ss", self.interval)
+        try:
+            await self.resync()
+        except Exception as e:
+            logger.error("Initial port resync failed: %s", e)
+        events_task = asyncio.create_task(self.consume_events())
+        probe_task = asyncio.create_task(self.prober.run()) if self.prober else None
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.tick()
+                except Exception as e:
+                    logger.error("Port monitor check failed: %s", e)
+        finally:
+            events_task.cancel()
+            if probe_task:
+                probe_task.cancel()
+            await self.close()
+
+    async def reload_index(self) -> None:
+        """Load the whole port index, rebuilding it from the database if missing."""
+        for _ in range(2):
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.get(port_index.INDEX_VERSION_KEY)
+            pipe.hgetall(port_index.INDEX_KEY)
+            version, raw = await pipe.execute()
+            if version is not None:
+                break
+            await sync_to_async(port_index.rebuild_index)()
+        self.tunnels_by_port = port_index.parse_index(raw)
+        self.index_version = int(version) if version is not None else None
+
+    async def refresh_index_ports(self, ports: Set[int]) -> None:
+        """Re-read the index entries of the given ports (one round trip)."""
+        ports = sorted(ports)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.get(port_index.INDEX_VERSION_KEY)
+        pipe.hmget(port_index.INDEX_KEY, ports)
+        version, values = await pipe.execute()
+        if version is None:
+            await self.reload_index()
+            return
+        for port, raw in zip(ports, values):
+            if raw:
+                self.tunnels_by_port[port] = port_index.parse_entry(port, raw)
+            else:
+                self.tunnels_by_port.pop(port, None)
+
+    def is_listening(self, tunnel: TunnelRecord) -> bool:
+        return tunnel.gateway in self.alive and tunnel.reverse_port in self.listening.get(tunnel.gateway, ())
+
+    def current_ports(self) -> Dict[int, bool]:
+        return {
+            port: any(self.is_listening(tunnel) for tunnel in tunnels)
+            for port, tunnels in self.tunnels_by_port.items()
+        }
+
+    async def read_alive(self) -> Set[str]:
+        gateways = list(get_gateways())
+        pipe = self.redis.pipeline(transaction=False)
+        for gateway in gateways:
+            pipe.exists(gateway_heartbeat_key(gateway))
+        return {gateway for gateway, alive in zip(gateways, await pipe.execute()) if alive}
+
+    async def resync(self) -> Optional[PortChanges]:
+        """Load the full state of every gateway (one transaction) and apply it."""
+        await self.reload_index()
+        gateways = list(get_gateways())
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.get(PORTS_VERSION_KEY)
+        pipe.xrevrange(PORT_EVENTS_STREAM, count=1)
+        for gateway in gateways:
+            pipe.exists(gateway_heartbeat_key(gateway))
+            pipe.hkeys(listening_ports_key(gateway))
+        version, latest, *results = await pipe.execute()
+
+        async with self.lock:
+            self.version = int(version or 0)
+            self.alive = {gateway for gateway, alive in zip(gateways, results[::2]) if alive}
+            self.listening = {
+                gateway: {int(port) for port in ports}
+                for gateway, ports in zip(gateways, results[1::2])
+            }
+            self.events_id = decode(latest[0][0]) if latest else "0-0"
+            logger.info(
+                "Port state resynced | version=%d | listening=%s",
+                self.version, {gateway: len(ports) for gateway, ports in self.listening.items()},
+            )
+            changes = await self.apply(self.current_ports())
+            await self.store_gateway_stats()
+            # Open the uptime history of tunnels that have none yet
+            await self.record_uptime(self.previous_ports, set(self.previous_ports))
+            return changes
+
+    async def tick(self) -> Optional[PortChanges]:
+        """Periodic check: resync if the port or index versions diverged."""
+        if time.monotonic() - self.downsampled_at >= UPTIME_DOWNSAMPLE_INTERVAL:
+            self.downsampled_at = time.monotonic()
+            try:
+                await sync_to_async(uptime.downsample_all)()
+            except Exception as e:
+                logger.error("Tunnel uptime downsampling failed: %s", e)
+            try:
+                await sync_to_async(terminal_recording.delete_expired)()
+            except Exception as e:
+                logger.error("Terminal recording retention failed: %s", e)
+
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.get(PORTS_VERSION_KEY)
+        pipe.get(port_index.INDEX_VERSION_KEY)
+        published, index_version = await pipe.execute()
+        if int(published or 0) != self.version:
+            # Missed or trimmed events, or the gateway/Redis restarted
+            await asyncio.sleep(0.1)  # let the event consumer catch up first
+            if int(await self.redis.get(PORTS_VERSION_KEY) or 0) != self.version:
+                return await self.resync()
+
+        alive = await self.read_alive()
+        if alive != self.alive:
+            logger.warning("Gateways changed | up=%s | down=%s", sorted(alive - self.alive), sorted(self.alive - alive))
+            async with self.lock:
+                self.alive = alive
+                changes = await self.apply(self.current_ports())
+                await self.store_gateway_stats()
+                return changes
+
+        if index_version is None or int(index_version) != self.index_version:
+            # Tunnels or sharings changed (or the index is gone)
+            await self.reload_index()
+            async with self.lock:
+                return await self.apply(self.current_ports())
+        return None
+
+    async def consume_events(self) -> None:
+        """Apply the gateway's port events as they arrive."""
+        while True:
+            try:
+                response = await self.redis.xread(
+                    {PORT_EVENTS_STREAM: self.events_id}, count=EVENTS_BATCH, block=EVENTS_BLOCK_MS,
+                )
+                if response:
+                    await self.apply_events(response[0][1])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Port event stream failed: %s", e)
+                await asyncio.sleep(1)
+
+    async def apply_events(self, entries) -> Optional[PortChanges]:
+        events = []
+        for entry_id, fields in entries:
+            fields = {decode(k): decode(v) for k, v in fields.items()}
+            try:
+                events.append((decode(entry_id), int(fields["version"]), fields.get("gateway", DEFAULT_GATEWAY),
+                               int(fields["port"]), fields["status"] == EVENT_CONNECTED))
+            except (KeyError, ValueError):
+                logger.warning("Malformed port event %s: %s", entry_id, fields)
+
+        if events:
+            # Current tunnels and users of the changed ports only
+            await self.refresh_index_ports({port for _, _, _, port, _ in events})
+
+        async with self.lock:
+            for entry_id, version, gateway, port, connected in events:
+                if version <= self.version:
+                    # Already part of the state loaded by a resync
+                    self.events_id = entry_id
+                    continue
+                if version != self.version + 1:
+                    break
+                self.events_id, self.version = entry_id, version
+                if connected:
+                    self.listening.setdefault(gateway, set()).add(port)
+                    # Events prove the node is up before its heartbeat is next checked
+                    self.alive.add(gateway)
+                else:
+                    self.listening.setdefault(gateway, set()).discard(port)
+            else:
+                return await self.apply(self.current_ports())
+
+        logger.warning("Port event gap after version %d, resyncing", self.version)
+        return await self.resync()
+
+    async def apply(self, now_ports: Dict[int, bool]) -> Optional[PortChanges]:
+        """Diff against the previous status, notify users and store the new status."""
+        if now_ports == self.previous_ports:
+            return None
+
+        changes = PortChanges(
+            ports=now_ports,
+            connected={port for port, status in now_ports.items() if status and not self.previous_ports.get(port, False)},
+            disconnected={port for port, status in now_ports.items() if not status and self.previous_ports.get(port, False)},
+        )
+        # Store the status before publishing its version (see port_status.sync_message)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(PORTS_STATUS_KEY)
+        if now_ports:
+            pipe.hset(PORTS_STATUS_KEY, mapping={port: int(status) for port, status in now_ports.items()})
+        await pipe.execute()
+        await self.record_uptime(now_ports, {
+            port for port, status in now_ports.items() if self.previous_ports.get(port) != status
+        })
+        self.previous_ports = now_ports
+        if changes.connected or changes.disconnected:
+            await self.dispatch(changes)
+        if self.prober:
+            await self.prober.forget(changes.disconnected)
+            self.prober.schedule(changes.connected)
+        if changes.connected or changes.disconnected:
+            await self.store_gateway_stats()
+        logger.info(
+            "Ports updated | active=%d | connected=%s | disconnected=%s",
+            len(changes.active_ports), sorted(changes.connected), sorted(changes.disconnected),
+        )
+        return changes
+
+    async def store_gateway_stats(self) -> None:
+        """Store per-gateway tunnel counts (`tunnel_ports:gateways`)."""
+        stats = {
+            gateway: {"alive": gateway in self.alive, "listening": len(self.listening.get(gateway, ())),
+                      "tunnels": 0, "connected": 0, "misplaced": 0}
+            for gateway in set(get_gateways()) | set(self.listening)
+        }
+        for port, tunnels in self.tunnels_by_port.items():
+            for tunnel in tunnels:
+                gateway_stats = stats.setdefault(tunnel.gateway, {
+                    "alive": False, "listening": 0, "tunnels": 0, "connected": 0, "misplaced": 0,
+                })
+                gateway_stats["tunnels"] += 1
+                gateway_stats["connected"] += self.is_listening(tunnel)
+                # Connected to a gateway it is not assigned to (e.g. a stale client script)
+                for gateway, ports in self.listening.items():
+                    if gateway != tunnel.gateway and port in ports:
+                        stats[gateway]["misplaced"] += 1
+        try:
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(GATEWAY_STATS_KEY)
+            pipe.hset(GATEWAY_STATS_KEY, mapping={gateway: dumps(value) for gateway, value in stats.items()})
+            await pipe.execute()
+        except Exception as e:
+            logger.error("Failed to store gateway stats: %s", e)
+
+    async def record_uptime(self, ports: Dict[int, bool], changed: Set[int]) -> None:
+        statuses = {
+            tunnel.id: ports[port]
+            for port in changed for tunnel in self.tunnels_by_port.get(port, [])
+        }
+        try:
+            await uptime.record_statuses(self.redis, statuses)
+        except Exception as e:
+            logger.error("Failed to record tunnel uptime: %s", e)
+
+    async def record(self, changed: Dict[int, bool]) -> int:
+        """Allocate a status version for the changes and append them to the status log."""
+        version = await self.redis.incr(port_status.STATUS_VERSION_KEY)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zadd(port_status.STATUS_LOG_KEY, {port_status.log_entry(version, changed): version})
+        pipe.zremrangebyrank(port_status.STATUS_LOG_KEY, 0, -port_status.STATUS_LOG_SIZE - 1)
+        await pipe.execute()
+        return version
+
+    async def dispatch(self, changes: PortChanges) -> None:
+        changed = {port: True for port in changes.connected}
+        changed.update({port: False for port in changes.disconnected})
+        try:
+            version = await self.record(changed)
+        except Exception as e:
+            logger.error("Failed to record status change: %s", e)
+            return
+
+        # Every affected user gets one delta with only the ports they can access
+        user_changes = defaultdict(dict)
+        for port, connected in changed.items():
+            for tunnel in self.tunnels_by_port.get(port, []):
+                for user_id in tunnel.authorized_users:
+                    user_changes[user_id][port] = connected
+        for user_id, user_changed in user_changes.items():
+            await self.notify_user(user_id, port_status.delta_message(
+                version, self.user_versions.get(user_id), user_changed,
+            ))
+            self.user_versions[user_id] = version
+
+        for port, connected in changed.items():
+            for tunnel in self.tunnels_by_port.get(port, []):
+                await self.group_send(f'tunnel_connection_{tunnel.id}', {
+                    'type': 'tunnel_connection_update',
+                    'message': {
+                        'type': 'connection_status',
+                        'tunnel_id': tunnel.id,
+                        'reverse_port': port,
+                        'is_connected': connected,
+                        'host_friendly_name': tunnel.host_friendly_name,
+                    },
+                })
+
+    async def notify_user(self, user_id: int, message: dict) -> None:
+        await self.group_send(f'user_{user_id}_notifications', {
+            'type': 'send_notification',
+            'message': message,
+        })
+
+    async def group_send(self, group: str, event: dict) -> None:
+        if self.channel_layer is None:
+            return
+        try:
+            await self.channel_layer.group_send(group, event)
+        except Exception as e:
+            logger.error("Failed to send %s to %s: %s", event.get('type'), group, e)
@@ -0,0 +1,209 @@
+"""
+Active latency probing of connected tunnels.
+
+A LISTENing reverse port only means the client's SSH session is up; the
+tunnel can still be unusable or slow.  The port monitor therefore probes every
+connected port each PORT_PROBE_INTERVAL seconds (and right after it
+connects), at most PORT_PROBE_CONCURRENCY at a time:
+
+    ssh -W localhost:<reverse_port> -p <gateway port> telepy@<gateway host>
+
+opens a channel through the tunnel's SSH gateway node (reverse ports are
+bound to its loopback) to the target's sshd.  The handshake RTT is the time
+from opening the channel until the target's SSH identification banner
+arrives, i.e. one round trip through the tunnel plus the target accepting the
+connection.  The connection to each gateway is shared by all its probes
+(ControlMaster), so it is not part of the measurement.
+
+Results are stored next to the port status:
+
+    tunnel_ports:probe  hash  port -> {"ok", "rtt_ms", "degraded", "error", "banner", "ts"}
+
+and pushed to the tunnel's `tunnel_connection_<id>` group as
+`{"type": "probe", ...}`.  A probe is degraded when it fails or its RTT is
+above PORT_PROBE_DEGRADED_MS.
+"""
+import time
+import asyncio
+import logging
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+
+from services.gateways import DEFAULT_GATEWAY, GATEWAY_USER, Gateway, get_gateway
+from services.redis_client import decode, dumps, get_async_redis, get_redis, loads
+
+logger = logging.getLogger('authorized_keys.port_monitor')
+
+PROBE_KEY = "tunnel_ports:probe"
+PROBE_SSH_OPTIONS = [
+    "-q",
+    "-o", "BatchMode=yes",
+    "-o", "ControlMaster=auto",
+    "-o", "ControlPath=/tmp/telepy-probe-%C",
+    "-o", "ControlPersist=600",
+]
+BANNER_MAX_LINES = 20
+
+
+@dataclass
+class ProbeResult:
+    port: int
+    ok: bool
+    rtt_ms: Optional[float] = None
+    degraded: bool = False
+    error: Optional[str] = None
+    banner: Optional[str] = None
+    ts: float = 0.0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data.pop("port")
+        return data
+
+
+def get_interval() -> float:
+    return getattr(settings, "PORT_PROBE_INTERVAL", 60)
+
+
+def get_degraded_ms() -> float:
+    return getattr(settings, "PORT_PROBE_DEGRADED_MS", 500)
+
+
+def get_probes(ports: Optional[Iterable[int]] = None) -> Dict[int, dict]:
+    """Return the last probe result of the given (or all) ports."""
+    client = get_redis()
+    if client is None:
+        return {}
+    if ports is None:
+        raw = client.hgetall(PROBE_KEY)
+    else:
+        ports = sorted(ports)
+        raw = dict(zip(ports, client.hmget(PROBE_KEY, ports))) if ports else {}
+    return {int(decode(port)): loads(value) for port, value in raw.items() if value}
+
+
+async def aget_probe(port: int) -> Optional[dict]:
+    """Async variant of `get_probes` for a single port (consumers)."""
+    return loads(await get_async_redis().hget(PROBE_KEY, port))
+
+
+async def _read_banner(stream: asyncio.StreamReader) -> str:
+    # RFC 4253: the server may send other lines before its identification
+    for _ in range(BANNER_MAX_LINES):
+        line = await stream.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        if line.startswith(b"SSH-"):
+            return line.decode(errors="replace").strip()
+    raise ConnectionError("no SSH banner")
+
+
+async def probe_port(port: int, timeout: float, gateway: Gateway) -> ProbeResult:
+    """Measure the handshake RTT of one reverse port through its gateway."""
+    result = ProbeResult(port=port, ok=False, ts=time.time())
+    started = time.perf_counter()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ssh", *PROBE_SSH_OPTIONS, "-W", f"localhost:{port}",
+            "-p", str(gateway.port), f"{GATEWAY_USER}@{gateway.host}",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except OSError as e:
+        result.error = f"ssh unavailable ({e})"
+        result.degraded = True
+        return result
+
+    try:
+        result.banner = await asyncio.wait_for(_read_banner(process.stdout), timeout)
+        result.rtt_ms = round((time.perf_counter() - started) * 1000, 2)
+        result.ok = True
+    except asyncio.TimeoutError:
+        result.error = "timeout"
+    except ConnectionError as e:
+        result.error = str(e)
+    finally:
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+    result.degraded = not result.ok or result.rtt_ms > get_degraded_ms()
+    return result
+
+
+class PortProber:
+    """Probe the connected ports of a `PortMonitor` with bounded concurrency."""
+
+    def __init__(self, monitor, interval: Optional[float] = None):
+        self.monitor = monitor
+        self.interval = interval if interval is not None else get_interval()
+        self.timeout = getattr(settings, "PORT_PROBE_TIMEOUT", 5)
+        self.semaphore = asyncio.Semaphore(getattr(settings, "PORT_PROBE_CONCURRENCY", 8))
+        self.pending = set()
+
+    def connected_ports(self) -> set:
+        return {port for port, status in self.monitor.previous_ports.items() if status}
+
+    async def run(self) -> None:
+        logger.info("Port prober started | interval=%ss", self.interval)
+        while True:
+            try:
+                await self.probe_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Port probe round failed: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def probe_all(self) -> None:
+        ports = self.connected_ports()
+        stale = [port for port in await self.monitor.redis.hkeys(PROBE_KEY) if int(port) not in ports]
+        if stale:
+            await self.monitor.redis.hdel(PROBE_KEY, *stale)
+        await self.probe_ports(ports)
+
+    def schedule(self, ports: Iterable[int]) -> None:
+        """Probe newly connected ports now, in the background."""
+        task = asyncio.create_task(self.probe_ports(set(ports)))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def probe_ports(self, ports: set) -> None:
+        if not ports:
+            return
+        results = await asyncio.gather(*(self._probe(port) for port in ports))
+        # A port may have disconnected while it was being probed
+        connected = self.connected_ports()
+        results = [result for result in results if result.port in connected]
+        if not results:
+            return
+        await self.monitor.redis.hset(PROBE_KEY, mapping={
+            result.port: dumps(result.to_dict()) for result in results
+        })
+        degraded = [result.port for result in results if result.degraded]
+        logger.info("Ports probed | probed=%d | degraded=%s", len(results), sorted(degraded))
+        for result in results:
+            for tunnel in self.monitor.tunnels_by_port.get(result.port, []):
+                await self.monitor.group_send(f'tunnel_connection_{tunnel.id}', {
+                    'type': 'tunnel_connection_update',
+                    'message': {
+                        'type': 'probe',
+                        'tunnel_id': tunnel.id,
+                        'reverse_port': result.port,
+                        'probe': result.to_dict(),
+                    },
+                })
+
+    async def _probe(self, port: int) -> ProbeResult:
+        tunnels = self.monitor.tunnels_by_port.get(port)
+        gateway = get_gateway(tunnels[0].gateway if tunnels else DEFAULT_GATEWAY)
+        async with self.semaphore:
+            return await probe_port(port, self.timeout, gateway)
+
+    async def forget(self, ports: Iterable[int]) -> None:
+        ports = list(ports)
+        if ports:
+            await self.monitor.redis.hdel(PROBE_KEY, *ports)
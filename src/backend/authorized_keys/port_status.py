@@ -0,0 +1,120 @@
+"""
+Versioned tunnel status protocol for the notification WebSocket.
+
+Every set of port status changes applied by the port monitor gets a new
+status version and is appended to a short log in Redis:
+
+    tunnel_ports:status:version  latest status version
+    tunnel_ports:status:log      sorted set  version -> {"version", "changes": {port: bool}}
+                                 (the last STATUS_LOG_SIZE versions)
+
+Each affected user is sent only the changes of their own ports:
+
+    TUNNEL-STATUS-DELTA     {version, prev, changes: {port: bool}}
+    TUNNEL-STATUS-SNAPSHOT  {version, ports: {port: bool}}
+
+`prev` is the last version sent to that user (None if unknown), so a client
+whose version is older than `prev` missed a delta.  A client (re)connecting or
+detecting a gap sends `{"action": "SYNC-TUNNEL-STATUS", "version": <its
+version>}` and gets the logged changes since then compacted into one delta,
+or a snapshot of its ports if the version is unknown or already trimmed.
+"""
+import json
+import logging
+from typing import Dict, Iterable, Optional, Set
+
+from django.db.models import Q
+
+from authorized_keys.utils import get_ports_status
+from services.redis_client import get_redis
+
+logger = logging.getLogger('authorized_keys.port_monitor')
+
+STATUS_VERSION_KEY = "tunnel_ports:status:version"
+STATUS_LOG_KEY = "tunnel_ports:status:log"
+STATUS_LOG_SIZE = 1000
+
+ACTION_DELTA = "TUNNEL-STATUS-DELTA"
+ACTION_SNAPSHOT = "TUNNEL-STATUS-SNAPSHOT"
+ACTION_SYNC = "SYNC-TUNNEL-STATUS"
+
+
+def log_entry(version: int, changes: Dict[int, bool]) -> str:
+    return json.dumps({"version": version, "changes": {str(port): status for port, status in changes.items()}})
+
+
+def delta_message(version: int, prev: Optional[int], changes: Dict[int, bool]) -> dict:
+    connected = sum(1 for status in changes.values() if status)
+    return {
+        "action": ACTION_DELTA,
+        "version": version,
+        "prev": prev,
+        "changes": {str(port): status for port, status in changes.items()},
+        "details": f"Tunnel status updated: {connected} connected, {len(changes) - connected} disconnected",
+    }
+
+
+def snapshot_message(version: int, ports: Dict[int, bool]) -> dict:
+    return {
+        "action": ACTION_SNAPSHOT,
+        "version": version,
+        "ports": {str(port): status for port, status in ports.items()},
+        "details": "Tunnel status snapshot",
+    }
+
+
+def get_user_ports(user_id: int) -> Set[int]:
+    """Reverse ports of the tunnels the user owns or has been shared."""
+    from authorized_keys.models import ReverseServerAuthorizedKeys
+
+    return set(ReverseServerAuthorizedKeys.objects.filter(
+        Q(user_id=user_id) | Q(shared_with__shared_with_id=user_id),
+    ).values_list('reverse_port', flat=True).distinct())
+
+
+def _only(ports: Iterable, user_ports: Set[int]) -> Dict[int, bool]:
+    return {int(port): status for port, status in ports if int(port) in user_ports}
+
+
+def sync_message(user_id: int, since: Optional[int]) -> dict:
+    """
+    Answer a client's SYNC-TUNNEL-STATUS.
+
+    Returns:
+    - dict: One delta with the user's changes after `since`, or a snapshot of
+      the user's ports when `since` is missing, unknown or no longer logged.
+    """
+    user_ports = get_user_ports(user_id)
+    client = get_redis()
+    version, oldest, entries = 0, None, None
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=True)
+            pipe.get(STATUS_VERSION_KEY)
+            pipe.zrange(STATUS_LOG_KEY, 0, 0, withscores=True)
+            if since is not None:
+                pipe.zrangebyscore(STATUS_LOG_KEY, f"({since}", "+inf")
+            results = pipe.execute()
+            version = int(results[0] or 0)
+            oldest = int(results[1][0][1]) if results[1] else None
+            entries = results[2] if since is not None else None
+        except Exception as e:
+            logger.warning("Tunnel status: failed to read the status log (%s)", e)
+
+    if since is not None and entries is not None and since <= version and (
+        since == version or (oldest is not None and oldest <= since + 1)
+    ):
+        # Report the last logged version: the monitor bumps the version just
+        # before logging, and that change is then still pushed live
+        changes, logged = {}, since
+        for raw in entries:
+            entry = json.loads(raw)
+            changes.update(entry["changes"])
+            logged = max(logged, entry["version"])
+        return delta_message(logged, since, _only(changes.items(), user_ports))
+
+    # The snapshot is stored before the version is bumped, so it is at least as new
+    ports_status = get_ports_status()
+    return snapshot_message(version, {
+        port: bool(ports_status.get(port, False)) for port in sorted(user_ports)
+    })
@@ -2,18 +2,20 @@ import os
 import time
 import socket
 import logging
-import subprocess
 import requests
 import uuid
 import threading
 from typing import Dict, Any
 
 from site_settings.models import SiteSettings
+from services import ssh_pool
+from services.gateways import DEFAULT_GATEWAY
+from services.ssh_pool import SSHTarget
 
 logger = logging.getLogger(__name__)
 
 # Keep track of active remote browser sessions
-# session_id -> { "ssh_process": Popen, "proxy_port": int, "target_target": str, "selenium_session_id": str }
+# session_id -> { "connection": SSHConnection, "forward": str, "proxy_port": int, "selenium_session_id": str }
 ACTIVE_SESSIONS: Dict[str, Dict[str, Any]] = {}
 
 def get_free_port():
@@ -22,26 +24,30 @@ def get_free_port():
         PORT = s.getsockname()[1]
     return PORT
 
-def start_remote_browser(target_username: str, target_reverse_port: int, server_id: int):
+def close_proxy(connection, forward: str):
+    """Remove the SOCKS forward and give the lease on the shared SSH connection back."""
+    if not connection.cancel_forward(forward):
+        logger.warning(f"Failed to cancel SSH proxy {forward}")
+    connection.close()
+
+def start_remote_browser(target_username: str, target_reverse_port: int, server_id: int, gateway: str = DEFAULT_GATEWAY):
     """
     Start a remote browser session.
-    1. Start a local ssh -D to the target.
+    1. Add a SOCKS forward (ssh -D) to the target's shared SSH connection
+       (or start an ssh -D of its own when there is none).
     2. Start a selenium session using the local proxy.
     Returns: { "session_id": ..., "vnc_url": ... }
     """
     proxy_port = get_free_port()
-    # Execute SSH -D. We are inside the backend container. It needs to hit the ssh reverse tunnel gateway.
-    # The gateway is `reverse` container, but we use the ssh domain or `telepy-ssh` in the compose network.
-    
-    ssh_host = "reverse"
-    ssh_cmd = f"ssh -N -q -D 0.0.0.0:{proxy_port} -p {target_reverse_port} {target_username}@{ssh_host}"
-    
+    # We are inside the backend container: the shared connection (`services.ssh_pool`) goes through
+    # the gateway node the tunnel is assigned to, where its reverse port is bound to loopback.
+    connection = ssh_pool.connect(SSHTarget(int(server_id), target_username, target_reverse_port, gateway or DEFAULT_GATEWAY))
+    forward = f"0.0.0.0:{proxy_port}"
+
     logger.info(f"Starting SSH proxy for target {server_id} on port {proxy_port}")
-    ssh_process = subprocess.Popen(ssh_cmd, shell=True)
-    
-    # Wait for proxy to listen
-    time.sleep(2)
-    if ssh_process.poll() is not None:
+    # Returns once the master listens on the port
+    if not connection.forward(forward):
+        connection.close()
         raise Exception(f"Failed to start SSH proxy for target {server_id}. Command exited.")
 
     # Now request Selenium session
@@ -176,7 +182,7 @@ def start_remote_browser(target_username: str, target_reverse_port: int, server_
             except Exception:
                 logger.warning(f"Failed to navigate to Google for session {selenium_session_id}")
     except requests.exceptions.HTTPError as e:
-        ssh_process.terminate()
+        close_proxy(connection, forward)
         error_msg = str(e)
         if res is not None:
             try:
@@ -190,12 +196,13 @@ def start_remote_browser(target_username: str, target_reverse_port: int, server_
                 pass
         raise Exception(f"Failed to start Selenium session: {error_msg}")
     except Exception as e:
-        ssh_process.terminate()
+        close_proxy(connection, forward)
         raise Exception(f"Failed to start Selenium session: {str(e)}")
         
     session_id = str(uuid.uuid4())
     ACTIVE_SESSIONS[session_id] = {
-        "ssh_process": ssh_process,
+        "connection": connection,
+        "forward": forward,
         "proxy_port": proxy_port,
         "server_id": server_id,
         "selenium_session_id": selenium_session_id,
@@ -237,7 +244,6 @@ def stop_remote_browser(session_id: str):
     if not session:
         return False
         
-    ssh_process = session["ssh_process"]
     selenium_session_id = session["selenium_session_id"]
     
     # Stop selenium session
@@ -247,13 +253,8 @@ def stop_remote_browser(session_id: str):
         logger.warning(f"Failed to delete selenium session {selenium_session_id}: {e}")
         
     # Stop ssh proxy
-    try:
-        ssh_process.terminate()
-        ssh_process.wait(timeout=5)
-    except Exception as e:
-        logger.warning(f"Failed to terminate SSH process: {e}")
-        ssh_process.kill()
-        
+    close_proxy(session["connection"], session["forward"])
+
     del ACTIVE_SESSIONS[session_id]
     return True
 
@@ -265,8 +266,8 @@ def cleanup_dead_sessions():
             dead_sessions = []
             now = time.time()
             for sid, sess in list(ACTIVE_SESSIONS.items()):
-                # Clean up if SSH process died naturally OR if it hasn't been pinged within idle_timeout seconds
-                if sess["ssh_process"].poll() is not None or (now - sess.get("last_seen", now)) > idle_timeout:
+                # Clean up if the SSH master died OR if it hasn't been pinged within idle_timeout seconds
+                if not sess["connection"].alive() or (now - sess.get("last_seen", now)) > idle_timeout:
                     dead_sessions.append(sid)
             for sid in dead_sessions:
                 stop_remote_browser(sid)
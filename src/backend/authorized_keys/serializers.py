@@ -80,12 +80,26 @@ class ReverseServerAuthorizedKeysSerializer(serializers.ModelSerializer):
         """Number of users this tunnel is shared with (for owner display)."""
         return TunnelSharing.objects.filter(tunnel=obj).count()
 
+    def validate_record_sessions(self, value):
+        """
+        Recording is an audit setting: only the owner and admins may change it.
+        """
+        request = self.context.get('request')
+        if self.instance is not None and value != self.instance.record_sessions:
+            if not request or not TunnelPermissionManager.check_access(
+                request.user, self.instance, TunnelPermission.ADMIN
+            ):
+                raise serializers.ValidationError("Only the owner or an admin can change session recording.")
+        return value
+
     class Meta:
         model = ReverseServerAuthorizedKeys
         partial = True
         fields = '__all__'
         # Need to set user as read_only field because it is not in the fields list
-        read_only_fields = ('user',)
+        # The gateway is assigned on creation (see `services/gateways.py`)
+        # The port is owned by the allocator (see `reverse_keys/port_allocator.py`)
+        read_only_fields = ('user', 'gateway', 'reverse_port')
 
 class UserAuthorizedKeysSerializer(serializers.ModelSerializer):
 
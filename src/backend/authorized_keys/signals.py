@@ -1,7 +1,17 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete, post_migrate
 from django.dispatch import receiver
 from authorized_keys.models import ReverseServerAuthorizedKeys
 from authorized_keys.models import ServiceAuthorizedKeys
+from authorized_keys.models import UserAuthorizedKeys
+from authorized_keys import key_snapshot
+from authorized_keys import key_files
+from authorized_keys import negative_cache
+from authorized_keys import port_index
+from authorized_keys import uptime
+from reverse_keys import port_allocator
+from tunnels.models import TunnelSharing
+from tunnels import terminal_recording
 
 from tunnels.consumers import send_notification_to_users
 
@@ -64,3 +74,167 @@ def insert_initial_public_key(sender, **kwargs):
         print(f"[authorized_keys] Created service key for '{service_name}'")
     else:
         print(f"[authorized_keys] Updated service key for '{service_name}'")
+
+
+@receiver(post_migrate, dispatch_uid='backfill_key_fingerprints')
+def backfill_authorized_key_fingerprints(sender, **kwargs):
+    """Backfill ``key_fingerprint`` for keys stored before the column existed.
+
+    Migrations are generated at container start, so the backfill lives here
+    instead of a hand-written data migration.  Rows that are already up to
+    date are skipped, which keeps this cheap on every restart.
+    """
+    if sender.name != 'authorized_keys':
+        return
+
+    from authorized_keys.utils import backfill_key_fingerprints
+    updated = backfill_key_fingerprints()
+    if updated:
+        print(f"[authorized_keys] Backfilled {updated} key fingerprint(s)")
+
+
+@receiver(post_save, sender=ReverseServerAuthorizedKeys)
+@receiver(post_delete, sender=ReverseServerAuthorizedKeys)
+@receiver(post_save, sender=UserAuthorizedKeys)
+@receiver(post_delete, sender=UserAuthorizedKeys)
+def refresh_key_snapshot_for_owner(sender, instance, **kwargs):
+    """Keep the owner's entries in the authorized-keys snapshot up to date.
+
+    Runs after commit so the snapshot never reflects a rolled-back change.
+    """
+    owner_id = instance.user_id
+    transaction.on_commit(lambda: key_snapshot.refresh_owners([owner_id]))
+
+
+@receiver(post_save, sender=ReverseServerAuthorizedKeys)
+@receiver(post_save, sender=UserAuthorizedKeys)
+@receiver(post_save, sender=ServiceAuthorizedKeys)
+def forget_negative_key_lookup(sender, instance, **kwargs):
+    """A stored key must not stay cached as an unknown key.
+
+    Forgotten again after commit: a lookup running before the commit can
+    still see no match and cache the miss.
+    """
+    fingerprint = instance.key_fingerprint
+    negative_cache.forget(fingerprint)
+    transaction.on_commit(lambda: negative_cache.forget(fingerprint))
+
+
+@receiver(post_save, sender=ServiceAuthorizedKeys)
+@receiver(post_delete, sender=ServiceAuthorizedKeys)
+def refresh_key_snapshot_for_services(sender, instance, **kwargs):
+    transaction.on_commit(key_snapshot.refresh_service_keys)
+
+
+@receiver(post_save, sender=TunnelSharing)
+@receiver(post_delete, sender=TunnelSharing)
+def refresh_key_snapshot_for_sharee(sender, instance, **kwargs):
+    """Sharing a tunnel decides whether the sharee's personal keys are accepted."""
+    shared_with_id = instance.shared_with_id
+    transaction.on_commit(lambda: key_snapshot.refresh_owners([shared_with_id]))
+
+
+@receiver(post_migrate, dispatch_uid='rebuild_authorized_keys_snapshot')
+def rebuild_authorized_keys_snapshot(sender, **kwargs):
+    """Rebuild the authorized-keys snapshot on startup (after the key backfill)."""
+    if sender.name != 'authorized_keys' or not key_snapshot.is_enabled():
+        return
+
+    version = key_snapshot.rebuild_snapshot()
+    if version is not None:
+        print(f"[authorized_keys] Rebuilt authorized keys snapshot (version {version})")
+
+
+@receiver(post_save, sender=ReverseServerAuthorizedKeys)
+@receiver(post_delete, sender=ReverseServerAuthorizedKeys)
+@receiver(post_save, sender=UserAuthorizedKeys)
+@receiver(post_delete, sender=UserAuthorizedKeys)
+def render_authorized_keys_file_for_owner(sender, instance, **kwargs):
+    """Push mode: rewrite only the owner's authorized_keys file."""
+    if not key_files.is_enabled():
+        return
+    owner_id = instance.user_id
+    transaction.on_commit(lambda: key_files.render_owners([owner_id]))
+
+
+@receiver(post_save, sender=ServiceAuthorizedKeys)
+@receiver(post_delete, sender=ServiceAuthorizedKeys)
+def render_authorized_keys_file_for_services(sender, instance, **kwargs):
+    if not key_files.is_enabled():
+        return
+    transaction.on_commit(key_files.render_service_keys)
+
+
+@receiver(post_save, sender=TunnelSharing)
+@receiver(post_delete, sender=TunnelSharing)
+def render_authorized_keys_file_for_sharee(sender, instance, **kwargs):
+    """Push mode: `TunnelPermissionService` share/unshare decides the sharee's personal keys."""
+    if not key_files.is_enabled():
+        return
+    shared_with_id = instance.shared_with_id
+    transaction.on_commit(lambda: key_files.render_owners([shared_with_id]))
+
+
+@receiver(post_migrate, dispatch_uid='render_authorized_keys_files')
+def render_authorized_keys_files(sender, **kwargs):
+    """Push mode: render all authorized_keys files on startup."""
+    if sender.name != 'authorized_keys' or not key_files.is_enabled():
+        return
+
+    users = key_files.render_all()
+    print(f"[authorized_keys] Rendered authorized keys files for {users} user(s)")
+
+
+@receiver(post_save, sender=ReverseServerAuthorizedKeys)
+@receiver(post_delete, sender=ReverseServerAuthorizedKeys)
+def refresh_port_index_for_tunnel(sender, instance, **kwargs):
+    """Keep the port -> tunnel -> users index used by the port monitor up to date."""
+    tunnel_id = instance.id
+    transaction.on_commit(lambda: port_index.refresh_tunnels([tunnel_id]))
+
+
+@receiver(post_save, sender=TunnelSharing)
+@receiver(post_delete, sender=TunnelSharing)
+def refresh_port_index_for_sharing(sender, instance, **kwargs):
+    tunnel_id = instance.tunnel_id
+    transaction.on_commit(lambda: port_index.refresh_tunnels([tunnel_id]))
+
+
+@receiver(post_migrate, dispatch_uid='rebuild_port_index')
+def rebuild_port_index(sender, **kwargs):
+    """Rebuild the port -> tunnel -> users index on startup."""
+    if sender.name != 'authorized_keys':
+        return
+
+    version = port_index.rebuild_index()
+    if version is not None:
+        print(f"[authorized_keys] Rebuilt tunnel port index (version {version})")
+
+
+@receiver(post_delete, sender=ReverseServerAuthorizedKeys)
+def release_reverse_port(sender, instance, **kwargs):
+    """Return a deleted tunnel's port to the allocator's free-list."""
+    port = instance.reverse_port
+    transaction.on_commit(lambda: port_allocator.release_port(port))
+
+
+@receiver(post_delete, sender=ReverseServerAuthorizedKeys)
+def delete_tunnel_history(sender, instance, **kwargs):
+    """Drop a deleted tunnel's uptime history and terminal recordings."""
+    tunnel_id = instance.id
+    transaction.on_commit(lambda: uptime.delete_history(tunnel_id))
+    transaction.on_commit(lambda: terminal_recording.delete_recordings(tunnel_id))
+
+
+@receiver(post_migrate, dispatch_uid='rebuild_port_allocator')
+def rebuild_port_allocator(sender, **kwargs):
+    """Rebuild the reverse port free-list on startup."""
+    if sender.name != 'authorized_keys':
+        return
+
+    try:
+        free = port_allocator.rebuild()
+    except Exception as e:
+        print(f"[authorized_keys] Failed to rebuild port allocator: {e}")
+        return
+    print(f"[authorized_keys] Rebuilt port allocator ({free} free ports)")
@@ -1,3 +1,83 @@
+import json
+from unittest import mock
+
+import fakeredis
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from authorized_keys import key_snapshot
+from authorized_keys.models import ReverseServerAuthorizedKeys, UserAuthorizedKeys
+from site_settings.models import SiteSettings
+
+KEY = "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIL0cnkkiCDJ+NMU6CLuf3BWf9nwOqYapOWcNu3dNmeiT tunnel"
+
+
+class SnapshotSharedFingerprintTests(TestCase):
+    """The same key held by two owners (keys are only unique within a table)."""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(key_snapshot, "get_redis", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        site_settings = SiteSettings.get_solo()
+        site_settings.allow_registration = True
+        site_settings.save()
+        self.owner = User.objects.create_user("owner", password="x")
+        self.other = User.objects.create_user("other", password="x")
+
+    def create_tunnel(self):
+        return ReverseServerAuthorizedKeys.objects.create(
+            user=self.owner, host_friendly_name="tunnel", key=KEY, reverse_port=20001,
+        )
+
+    def create_copy(self):
+        return UserAuthorizedKeys.objects.create(user=self.other, host_friendly_name="copy", key=KEY)
+
+    def lookup(self, fingerprint):
+        ready, entry = key_snapshot.lookup_fingerprint(fingerprint)
+        self.assertTrue(ready)
+        return entry
+
+    def test_personal_copy_does_not_replace_tunnel_key(self):
+        tunnel = self.create_tunnel()
+        fingerprint = tunnel.key_fingerprint
+        key_snapshot.rebuild_snapshot()
+
+        copy = self.create_copy()
+        key_snapshot.refresh_owners([self.other.id])
+        entry = self.lookup(fingerprint)
+        self.assertEqual((entry["kind"], entry["owner_id"], entry["authorized"]), ("tunnel", self.owner.id, True))
+
+        copy.delete()
+        key_snapshot.refresh_owners([self.other.id])
+        entry = self.lookup(fingerprint)
+        self.assertEqual((entry["kind"], entry["owner_id"]), ("tunnel", self.owner.id))
+        self.assertTrue(self.redis.hexists(key_snapshot.GLOBAL_KEYS_KEY, fingerprint))
+
+        tunnel.delete()
+        key_snapshot.refresh_owners([self.owner.id])
+        self.assertIsNone(self.lookup(fingerprint))
+        self.assertFalse(self.redis.hexists(key_snapshot.GLOBAL_KEYS_KEY, fingerprint))
+
+    def test_user_key_takes_over_when_tunnel_key_is_deleted(self):
+        tunnel = self.create_tunnel()
+        self.create_copy()
+        key_snapshot.rebuild_snapshot()
+
+        tunnel.delete()
+        key_snapshot.refresh_owners([self.owner.id])
+        entry = self.lookup(tunnel.key_fingerprint)
+        self.assertEqual((entry["kind"], entry["owner_id"]), ("user", self.other.id))
+        self.assertFalse(self.redis.hexists(key_snapshot.GLOBAL_KEYS_KEY, tunnel.key_fingerprint))
+
+    def test_rebuild_prefers_tunnel_key(self):
+        # The personal copy is older, but tunnel keys win as in `lookup_offered_key`
+        copy = self.create_copy()
+        self.create_tunnel()
+        key_snapshot.rebuild_snapshot()
+
+        entry = self.lookup(copy.key_fingerprint)
+        self.assertEqual((entry["kind"], entry["owner_id"]), ("tunnel", self.owner.id))
+        owners = json.loads(self.redis.hget(key_snapshot.OWNERS_KEY, str(self.other.id)))
+        self.assertEqual(owners["fingerprints"], [copy.key_fingerprint])
@@ -0,0 +1,288 @@
+"""
+Per-tunnel connection history (uptime, flaps, outage windows).
+
+The port monitor records every status change of a tunnel as run-length
+encoded runs — one entry per stretch of time with the same status — in Redis:
+
+    tunnel_uptime:<id>:current       open run     "<status>:<since>:<flap>"
+    tunnel_uptime:<id>:runs          sorted set   "<start>:<end>:<status>:<flap>" (score = start)
+    tunnel_uptime:<id>:hourly        hash         hour start -> "<up s>:<known s>:<flaps>"
+    tunnel_uptime:<id>:rolled_until  runs before this time live in `hourly` only
+    tunnel_uptime:tunnels            set of tunnel ids with history
+
+`flap` is 1 for a disconnected run that followed a connected one.  Runs
+older than TUNNEL_UPTIME_RAW_DAYS are downsampled into hourly buckets by
+`downsample_all` (run hourly by the monitor) and buckets older than
+TUNNEL_UPTIME_RETENTION_DAYS are dropped.  A query reads at most one bucket
+per hour of the range plus the recent raw runs, so a 90-day window costs one
+HMGET and one ZRANGE per tunnel; outage windows are exact for the raw part.
+"""
+import math
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from services.redis_client import decode, get_redis
+
+logger = logging.getLogger('authorized_keys.port_monitor')
+
+UPTIME_PREFIX = "tunnel_uptime"
+TUNNELS_KEY = f"{UPTIME_PREFIX}:tunnels"
+HOUR = 3600
+
+
+def current_key(tunnel_id) -> str:
+    return f"{UPTIME_PREFIX}:{tunnel_id}:current"
+
+
+def runs_key(tunnel_id) -> str:
+    return f"{UPTIME_PREFIX}:{tunnel_id}:runs"
+
+
+def hourly_key(tunnel_id) -> str:
+    return f"{UPTIME_PREFIX}:{tunnel_id}:hourly"
+
+
+def rolled_key(tunnel_id) -> str:
+    return f"{UPTIME_PREFIX}:{tunnel_id}:rolled_until"
+
+
+def get_raw_days() -> float:
+    return getattr(settings, "TUNNEL_UPTIME_RAW_DAYS", 7)
+
+
+def get_retention_days() -> float:
+    return getattr(settings, "TUNNEL_UPTIME_RETENTION_DAYS", 365)
+
+
+def _ts(value: float) -> str:
+    return f"{value:.3f}"
+
+
+def _hour(ts: float) -> int:
+    return int(ts // HOUR * HOUR)
+
+
+def parse_current(raw) -> Optional[Tuple[bool, float, int]]:
+    """`(status, since, flap)` of the open run, None if there is none."""
+    if not raw:
+        return None
+    status, since, flap = decode(raw).split(":")
+    return status == "1", float(since), int(flap)
+
+
+def parse_run(raw) -> Tuple[float, float, bool, int]:
+    start, end, status, flap = decode(raw).split(":")
+    return float(start), float(end), status == "1", int(flap)
+
+
+def run_member(start: float, end: float, status: bool, flap: int) -> str:
+    return f"{_ts(start)}:{_ts(end)}:{int(status)}:{flap}"
+
+
+async def record_statuses(redis, statuses: Dict[int, bool], ts: Optional[float] = None) -> int:
+    """
+    Close the open run of every tunnel whose status differs and open a new one
+    (called by the port monitor with an asyncio client).
+
+    Returns:
+    - int: The number of tunnels whose status changed.
+    """
+    if not statuses:
+        return 0
+    ts = ts if ts is not None else time.time()
+    tunnel_ids = list(statuses)
+    pipe = redis.pipeline(transaction=False)
+    for tunnel_id in tunnel_ids:
+        pipe.get(current_key(tunnel_id))
+    currents = await pipe.execute()
+
+    changed = 0
+    pipe = redis.pipeline(transaction=True)
+    for tunnel_id, raw in zip(tunnel_ids, currents):
+        status = statuses[tunnel_id]
+        current = parse_current(raw)
+        if current is not None and current[0] == status:
+            continue
+        if current is not None:
+            pipe.zadd(runs_key(tunnel_id), {run_member(current[1], ts, current[0], current[2]): current[1]})
+        flap = int(current is not None and current[0] and not status)
+        pipe.set(current_key(tunnel_id), f"{int(status)}:{_ts(ts)}:{flap}")
+        pipe.sadd(TUNNELS_KEY, tunnel_id)
+        changed += 1
+    if changed:
+        await pipe.execute()
+    return changed
+
+
+def delete_history(tunnel_id: int) -> None:
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=True)
+        pipe.delete(current_key(tunnel_id), runs_key(tunnel_id), hourly_key(tunnel_id), rolled_key(tunnel_id))
+        pipe.srem(TUNNELS_KEY, tunnel_id)
+        pipe.execute()
+    except Exception as e:
+        logger.error("Tunnel uptime: failed to delete history of tunnel %s (%s)", tunnel_id, e)
+
+
+def _fold(buckets: Dict[int, List[float]], start: float, end: float, status: bool, flap: int) -> None:
+    """Add a run (or the part of it in [start, end)) to hourly buckets."""
+    if flap:
+        buckets.setdefault(_hour(start), [0.0, 0.0, 0])[2] += 1
+    hour = _hour(start)
+    while hour < end:
+        seconds = min(end, hour + HOUR) - max(start, hour)
+        if seconds > 0:
+            bucket = buckets.setdefault(hour, [0.0, 0.0, 0])
+            bucket[1] += seconds
+            if status:
+                bucket[0] += seconds
+        hour += HOUR
+
+
+def downsample(client, tunnel_id: int, now: Optional[float] = None) -> int:
+    """
+    Fold runs older than the raw retention into hourly buckets and drop
+    buckets older than the retention.
+
+    Returns:
+    - int: The number of runs folded.
+    """
+    now = now if now is not None else time.time()
+    boundary = _hour(now - get_raw_days() * 86400)
+    raws = client.zrangebyscore(runs_key(tunnel_id), "-inf", f"({boundary}")
+    expired_hours = [
+        field for field in client.hkeys(hourly_key(tunnel_id))
+        if int(decode(field)) < now - get_retention_days() * 86400
+    ]
+    if not raws and not expired_hours:
+        return 0
+
+    buckets: Dict[int, List[float]] = {}
+    straddling = []
+    for raw in raws:
+        start, end, status, flap = parse_run(raw)
+        _fold(buckets, start, min(end, boundary), status, flap)
+        if end > boundary:
+            # Keep the part after the boundary as a raw run (its flap is counted)
+            straddling.append(run_member(boundary, end, status, 0))
+
+    existing = dict(zip(buckets, client.hmget(hourly_key(tunnel_id), list(buckets)))) if buckets else {}
+    pipe = client.pipeline(transaction=True)
+    if raws:
+        pipe.zrem(runs_key(tunnel_id), *raws)
+    for member in straddling:
+        pipe.zadd(runs_key(tunnel_id), {member: boundary})
+    for hour, (up, known, flaps) in buckets.items():
+        if existing.get(hour):
+            old_up, old_known, old_flaps = decode(existing[hour]).split(":")
+            up, known, flaps = up + float(old_up), known + float(old_known), flaps + int(old_flaps)
+        pipe.hset(hourly_key(tunnel_id), hour, f"{up:.0f}:{known:.0f}:{flaps}")
+    if expired_hours:
+        pipe.hdel(hourly_key(tunnel_id), *expired_hours)
+    if raws:
+        pipe.set(rolled_key(tunnel_id), boundary)
+    pipe.execute()
+    return len(raws)
+
+
+def downsample_all() -> int:
+    client = get_redis()
+    if client is None:
+        return 0
+    folded = 0
+    for tunnel_id in client.smembers(TUNNELS_KEY):
+        try:
+            folded += downsample(client, int(decode(tunnel_id)))
+        except Exception as e:
+            logger.error("Tunnel uptime: failed to downsample tunnel %s (%s)", decode(tunnel_id), e)
+    if folded:
+        logger.info("Tunnel uptime downsampled | runs=%d", folded)
+    return folded
+
+
+def query(tunnel_id: int, start: float, end: float) -> dict:
+    """
+    Uptime, flaps and outage windows of a tunnel over [start, end).
+
+    Periods without any recorded status (before the tunnel's first record)
+    count as unknown, not as downtime.  `start` is clamped to the retention
+    period: nothing older is kept, and it bounds the buckets read.
+    """
+    now = time.time()
+    end = min(end, now)
+    start = max(start, now - get_retention_days() * 86400)
+    client = get_redis()
+    if client is None:
+        raise Exception("Tunnel uptime unavailable.")
+
+    pipe = client.pipeline(transaction=True)
+    pipe.get(rolled_key(tunnel_id))
+    pipe.get(current_key(tunnel_id))
+    pipe.zrangebyscore(runs_key(tunnel_id), "-inf", f"({end}")
+    rolled, current, raws = pipe.execute()
+    rolled = float(rolled or 0)
+
+    up = known = 0.0
+    flaps = 0
+
+    # Downsampled part: whole or partial hourly buckets
+    if start < rolled:
+        hours = list(range(_hour(start), int(math.ceil(min(end, rolled) / HOUR)) * HOUR, HOUR))
+        for hour, raw in zip(hours, client.hmget(hourly_key(tunnel_id), hours) if hours else []):
+            if not raw:
+                continue
+            bucket_up, bucket_known, bucket_flaps = decode(raw).split(":")
+            overlap = min(end, rolled, hour + HOUR) - max(start, hour)
+            if overlap <= 0:
+                continue
+            fraction = overlap / HOUR
+            up += float(bucket_up) * fraction
+            known += float(bucket_known) * fraction
+            if hour >= start:
+                flaps += int(bucket_flaps)
+
+    # Raw part: exact runs, including the open one
+    runs = [parse_run(raw) for raw in raws]
+    current = parse_current(current)
+    if current is not None and current[1] < end:
+        runs.append((current[1], now, current[0], current[2]))
+
+    outages = []
+    for run_start, run_end, status, flap in runs:
+        overlap = min(end, run_end) - max(start, run_start)
+        if overlap <= 0:
+            continue
+        known += overlap
+        if status:
+            up += overlap
+            continue
+        if flap and run_start >= start:
+            flaps += 1
+        ongoing = current is not None and run_start == current[1] and not current[0]
+        outages.append({
+            "start": run_start,
+            "end": None if ongoing else run_end,
+            "duration": round(run_end - run_start, 3),
+            "ongoing": ongoing,
+        })
+
+    return {
+        "tunnel_id": tunnel_id,
+        "start": start,
+        "end": end,
+        "uptime_percent": round(up / known * 100, 3) if known else None,
+        "up_seconds": round(up, 3),
+        "known_seconds": round(known, 3),
+        "downtime_seconds": round(known - up, 3),
+        "flaps": flaps,
+        "outages": outages,
+        # Outage windows before this time were downsampled away
+        "outages_since": rolled or None,
+        "current": None if current is None else {"connected": current[0], "since": current[1]},
+    }
@@ -1,19 +1,27 @@
 from django.urls import path, include
 from authorized_keys.views import CheckReverseServerPortStatus
+from authorized_keys.views import CheckReverseServerPortProbes
+from authorized_keys.views import TunnelGatewaysView
 from authorized_keys.views import ReverseServerUsernamesMapServerId
 from authorized_keys.views import SetDefaultUsernameView
+from authorized_keys.views import TunnelUptimeView
 from authorized_keys.views import ServiceAuthorizedKeysListView
 from authorized_keys.views import InternalKeysView
+from authorized_keys.views import InternalKeysStatsView
 from authorized_keys.browse_views import RemoteBrowserStartView, RemoteBrowserStopView, RemoteBrowserPingView
 urlpatterns = [
     path('server/status/ports', CheckReverseServerPortStatus.as_view(), name='reverse-server-ports-status'),
+    path('server/gateways', TunnelGatewaysView.as_view(), name='tunnel-gateways'),
+    path('server/status/probes', CheckReverseServerPortProbes.as_view(), name='reverse-server-ports-probes'),
     path('server/<int:server_id>/usernames', ReverseServerUsernamesMapServerId.as_view(), name='reverse-server-usernames'),
     path('server/<int:server_id>/default-username', SetDefaultUsernameView.as_view(), name='set-default-username'),
+    path('server/<int:server_id>/uptime', TunnelUptimeView.as_view(), name='tunnel-uptime'),
     path('server/<int:server_id>/remote-browser/start', RemoteBrowserStartView.as_view(), name='remote-browser-start'),
     path('server/remote-browser/<str:session_id>/stop', RemoteBrowserStopView.as_view(), name='remote-browser-stop'),
     path('server/remote-browser/<str:session_id>/ping', RemoteBrowserPingView.as_view(), name='remote-browser-ping'),
     path('service/keys', ServiceAuthorizedKeysListView.as_view(), name='service-authorized-keys'),
     path('internal/keys', InternalKeysView.as_view(), name='internal-keys'),
+    path('internal/keys/stats', InternalKeysStatsView.as_view(), name='internal-keys-stats'),
 ]
 
 from rest_framework.routers import DefaultRouter
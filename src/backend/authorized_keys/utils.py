@@ -1,7 +1,7 @@
-from typing import List, Dict
-import re
+from typing import List, Dict, Tuple
 import subprocess
 import base64
+import hashlib
 
 def is_valid_ssh_public_key(key: str) -> bool:
     """
@@ -32,6 +32,63 @@ def is_valid_ssh_public_key(key: str) -> bool:
     except Exception:
         return False
 
+def split_ssh_public_key(key: str) -> Tuple[str, str]:
+    """
+    Split an SSH public key into its normalized `(key_type, blob)` pair.
+
+    Options prefixes are not supported by the key models, so the first two
+    whitespace-separated fields are the type and the base64 blob; anything
+    after them (the comment) is ignored.
+
+    Args:
+    - key (str): The SSH public key as a string.
+
+    Returns:
+    - Tuple[str, str]: The key type and the base64 blob (empty strings if missing).
+    """
+    parts = (key or '').strip().split()
+    key_type = parts[0] if len(parts) > 0 else ''
+    key_blob = parts[1] if len(parts) > 1 else ''
+    return key_type, key_blob
+
+def compute_key_fingerprint(key: str = None, key_type: str = None, key_blob: str = None) -> str:
+    """
+    Compute the SHA-256 fingerprint used to index the authorized key models.
+
+    The fingerprint only covers `key_type` and `blob`, so the same key with a
+    different comment (or extra whitespace) maps to the same value.  Either pass
+    the full `key` string, or the `key_type` and `key_blob` offered by sshd.
+
+    Returns:
+    - str: The hex digest (64 chars).
+    """
+    if key is not None:
+        key_type, key_blob = split_ssh_public_key(key)
+    normalized = f"{key_type or ''} {key_blob or ''}"
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+def backfill_key_fingerprints() -> int:
+    """
+    Fill `key_fingerprint` for rows saved before the column existed
+    (or written with `QuerySet.update`, which bypasses `save()`).
+
+    Returns:
+    - int: The number of updated rows.
+    """
+    from authorized_keys.models import ReverseServerAuthorizedKeys, UserAuthorizedKeys, ServiceAuthorizedKeys
+
+    updated = 0
+    for model in (ReverseServerAuthorizedKeys, UserAuthorizedKeys, ServiceAuthorizedKeys):
+        stale = []
+        for obj in model.objects.only('id', 'key', 'key_fingerprint').iterator():
+            fingerprint = compute_key_fingerprint(obj.key)
+            if obj.key_fingerprint != fingerprint:
+                obj.key_fingerprint = fingerprint
+                stale.append(obj)
+        model.objects.bulk_update(stale, ['key_fingerprint'], batch_size=500)
+        updated += len(stale)
+    return updated
+
 def ssh(command:str, hostname:str):
     """
     Executes an SSH command on a remote server using subprocess.
@@ -52,32 +109,73 @@ def ssh(command:str, hostname:str):
     return result.stdout
 
 from authorized_keys.models import ReverseServerAuthorizedKeys
+from services.gateways import get_gateways
+from services.redis_client import get_redis, get_async_redis, decode, loads
+
+# Port state published by the SSH gateways (ssh/telepy-port-events.py, see services/gateways.py)
+LISTENING_PORTS_PREFIX = "tunnel_ports:listening"  # hash per gateway: port -> listening since (unix time)
+GATEWAY_HEARTBEAT_PREFIX = "tunnel_ports:gateway"  # per gateway, expires when it stops publishing
+PORTS_VERSION_KEY = "tunnel_ports:version"      # incremented on every change (all gateways)
+PORT_EVENTS_STREAM = "tunnel_ports:events"      # one entry per change, with its gateway and version
+GATEWAY_STATS_KEY = "tunnel_ports:gateways"     # hash: gateway -> tunnel counts (port monitor)
+# Tunnel port status written by the port monitor (authorized_keys/port_monitor.py)
+PORTS_STATUS_KEY = "tunnel_ports:status"        # hash: port -> "1" connected / "0" disconnected
+
+def listening_ports_key(gateway: str) -> str:
+    return f"{LISTENING_PORTS_PREFIX}:{gateway}"
+
+def gateway_heartbeat_key(gateway: str) -> str:
+    return f"{GATEWAY_HEARTBEAT_PREFIX}:{gateway}"
+
+def get_listening_ports() -> Dict[str, set]:
+    """Return the ports currently listening on each live SSH gateway."""
+    client = get_redis()
+    if client is None:
+        return {}
+    gateways = list(get_gateways())
+    pipe = client.pipeline(transaction=True)
+    for gateway in gateways:
+        pipe.exists(gateway_heartbeat_key(gateway))
+        pipe.hkeys(listening_ports_key(gateway))
+    results = pipe.execute()
+    return {
+        gateway: {int(port) for port in ports}
+        for gateway, alive, ports in zip(gateways, results[::2], results[1::2])
+        if alive
+    }
+
+def parse_ports_status(raw: dict) -> Dict[int, bool]:
+    return {int(decode(port)): decode(status) == "1" for port, status in raw.items()}
+
+def get_gateway_stats() -> Dict[str, dict]:
+    """Return the per-gateway tunnel counts stored by the port monitor."""
+    client = get_redis()
+    if client is None:
+        return {}
+    return {decode(gateway): loads(value) for gateway, value in client.hgetall(GATEWAY_STATS_KEY).items()}
 
-def parse_ss_ports_from_redis(ss_output:str, filter:bool) -> Dict[int, bool]:
-    used_ports = set()
-    for line in ss_output.split(' LISTEN '):
-        match = re.search(r'^0 128 (127\.0\.0\.1|0\.0\.0\.0):(\d+)', line)
-        if match:
-            used_ports.add(int(match.group(2)))
+def get_ports_status() -> Dict[int, bool]:
+    """Return the last port status of every tunnel as stored by the port monitor."""
+    client = get_redis()
+    if client is None:
+        return {}
+    return parse_ports_status(client.hgetall(PORTS_STATUS_KEY))
+
+async def aget_port_status(port: int) -> bool:
+    """Async variant of `get_ports_status` for a single port (consumers)."""
+    return decode(await get_async_redis().hget(PORTS_STATUS_KEY, port)) == "1"
 
+def build_ports_status(listening_ports: Dict[str, set], filter: bool) -> Dict[int, bool]:
     ports = {}
     # If filter is False, return all ports
     if not filter:
-        ports = {port: True for port in used_ports}
-
-    # Ensure all reverse ports are in the ports
-    reverse_ports = ReverseServerAuthorizedKeys.objects.all().values_list("reverse_port", flat=True)
-    for port in reverse_ports:
-        if port not in used_ports:
-            ports[port] = False # not used
-        else:
-            ports[port] = True
+        ports = {port: True for gateway_ports in listening_ports.values() for port in gateway_ports}
+
+    # Ensure all reverse ports are in the ports; a tunnel is up on its own gateway only
+    reverse_ports = ReverseServerAuthorizedKeys.objects.all().values_list("reverse_port", "gateway")
+    for port, gateway in reverse_ports:
+        ports[port] = port in listening_ports.get(gateway, ())
     return ports
 
-def get_ss_output_from_redis(filter=True) -> Dict[int, bool]:
-    # Retrieve the value from Redis
-    result = subprocess.run("redis-cli -h redis GET ss_output", shell=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if result is None:
-        return {}
-    parsed_output = parse_ss_ports_from_redis(result.stdout, filter=filter)
-    return parsed_output
+def get_ports_status_from_redis(filter=True) -> Dict[int, bool]:
+    return build_ports_status(get_listening_ports(), filter=filter)
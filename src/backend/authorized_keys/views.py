@@ -1,3 +1,5 @@
+import math
+import time
 import logging
 
 from django.http import HttpResponse
@@ -23,15 +25,54 @@ from authorized_keys.serializers import ReverseServerUsernamesSerializer
 from authorized_keys.models import ServiceAuthorizedKeys
 from tunnels.models import TunnelSharing, TunnelPermissionManager, TunnelPermission
 
-from authorized_keys.utils import get_ss_output_from_redis
+from authorized_keys.utils import get_ports_status_from_redis
+from authorized_keys.utils import get_gateway_stats
+from services.gateways import get_gateways
+from authorized_keys.utils import compute_key_fingerprint
+from authorized_keys import key_snapshot
+from authorized_keys import negative_cache
+from authorized_keys import port_probe
+from authorized_keys import port_status
+from authorized_keys import uptime
 from tunnels.consumers import send_notification_to_user, send_notification_to_users
 
+logger = logging.getLogger(__name__)
+
 class CheckReverseServerPortStatus(APIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(tags=['Reverse Server Keys'])
     def get(self, request):
-        return Response(get_ss_output_from_redis())
+        return Response(get_ports_status_from_redis())
+
+class TunnelGatewaysView(APIView):
+    """Configured SSH gateway nodes with their tunnel counts (from the port monitor)."""
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(tags=['Reverse Server Keys'])
+    def get(self, request):
+        stats = get_gateway_stats()
+        return Response([
+            {
+                "name": gateway.name,
+                "host": gateway.host,
+                "port": gateway.port,
+                "public_host": gateway.public_host,
+                "public_port": gateway.public_port,
+                "weight": gateway.weight,
+                **stats.get(gateway.name, {}),
+            }
+            for gateway in get_gateways().values()
+        ])
+
+class CheckReverseServerPortProbes(APIView):
+    """Last latency probe of the user's connected tunnels, keyed by reverse port."""
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(tags=['Reverse Server Keys'])
+    def get(self, request):
+        probes = port_probe.get_probes(port_status.get_user_ports(request.user.id))
+        return Response({str(port): probe for port, probe in probes.items()})
 
 class BaseKeyViewSet(viewsets.ModelViewSet):
     """
@@ -410,6 +451,39 @@ class SetDefaultUsernameView(APIView):
         })
 
 
+class TunnelUptimeView(APIView):
+    """
+    Uptime, flap count and outage windows of a tunnel.
+    Query params `start` / `end` are unix timestamps (default: the last 24 hours).
+    """
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(tags=['Reverse Server Keys'])
+    def get(self, request, server_id):
+        try:
+            tunnel = ReverseServerAuthorizedKeys.objects.get(id=server_id)
+        except ReverseServerAuthorizedKeys.DoesNotExist:
+            return Response({'error': 'Tunnel not found'}, status=404)
+
+        if not TunnelPermissionManager.check_access(request.user, tunnel, TunnelPermission.VIEW):
+            return Response({'error': 'You do not have permission to view this tunnel'}, status=403)
+
+        try:
+            end = float(request.query_params.get('end', time.time()))
+            start = float(request.query_params.get('start', end - 86400))
+        except ValueError:
+            return Response({'error': 'start and end must be unix timestamps'}, status=400)
+        if not (math.isfinite(start) and math.isfinite(end)):
+            return Response({'error': 'start and end must be unix timestamps'}, status=400)
+        if start >= end:
+            return Response({'error': 'start must be before end'}, status=400)
+
+        try:
+            return Response(uptime.query(tunnel.id, start, end))
+        except Exception as e:
+            logger.error("Tunnel uptime query failed: %s", e)
+            return Response({'error': 'Tunnel uptime unavailable'}, status=503)
+
 class ServiceAuthorizedKeysListView(APIView):
     """
     List all service authorized keys
@@ -440,13 +514,28 @@ class InternalKeysView(APIView):
       3. add ALL tunnel keys (ReverseServerAuthorizedKeys)
       4. add ALL service keys (ServiceAuthorizedKeys)
       5. deduplicate → return multi-line text/plain
+
+    With ``mode=minimal`` the authorization decision is made here instead of
+    in sshd: the response is only the offered key's line when it would have
+    been accepted from the full list, or empty otherwise.  Tunnel and service
+    keys are always accepted; personal keys only when their owner has tunnels
+    or shared tunnels.
+
+    Lookups are served from the Redis snapshot (`authorized_keys.key_snapshot`)
+    when it is available, and from the database otherwise.  Keys that matched
+    nothing in the database are cached (`authorized_keys.negative_cache`) so
+    repeated unknown keys are answered without it.
     """
     permission_classes = [IsInternalService]
     authentication_classes = []  # Skip JWT/session auth; token checked by IsInternalService
 
+    MODE_FULL = 'full'
+    MODE_MINIMAL = 'minimal'
+
     def get(self, request):
         key_type = request.GET.get('key_type', '')
         key_blob = request.GET.get('key', '')
+        mode = request.GET.get('mode', self.MODE_FULL)
 
         client_ip = request.META.get('REMOTE_ADDR', 'unknown')
 
@@ -456,52 +545,43 @@ class InternalKeysView(APIView):
             )
             return HttpResponse("", content_type="text/plain")
 
-        # Reconstruct the full key string for DB lookup
-        offered_key = f"{key_type} {key_blob}"
+        # Normalized fingerprint of the offered key (indexed on all key models)
+        offered_fingerprint = compute_key_fingerprint(key_type=key_type, key_blob=key_blob)
 
         internal_keys_logger.info(
-            "Key lookup | IP=%s | type=%s | key_prefix=%s...",
-            client_ip, key_type, key_blob[:20],
+            "Key lookup | IP=%s | type=%s | mode=%s | key_prefix=%s...",
+            client_ip, key_type, mode, key_blob[:20],
         )
 
-        from authorized_keys.models import (
-            ReverseServerAuthorizedKeys,
-            UserAuthorizedKeys,
-        )
+        # --- Fast path: serve from the Redis snapshot (single round trip) ---
+        snapshot_ready, snapshot_entry = key_snapshot.lookup_fingerprint(offered_fingerprint)
+        if snapshot_ready:
+            if snapshot_entry is None:
+                negative_cache.count(negative_cache.COUNTER_UNKNOWN_KEYS)
+            response = self.snapshot_response(snapshot_entry, mode)
+            if response is not None:
+                return response
+
+        # --- Known-miss fast path: unknown keys (scanners) never reach the database ---
+        if mode == self.MODE_MINIMAL and negative_cache.is_known_miss(offered_fingerprint):
+            internal_keys_logger.info("Offered key is a cached miss (minimal mode)")
+            return HttpResponse("", content_type="text/plain")
 
         # --- Step 1: Reverse-lookup the offered key's owner ---
-        owner = None
+        tunnel_match, user_match, service_match = self.lookup_offered_key(offered_fingerprint)
+        if not (tunnel_match or user_match or service_match):
+            negative_cache.remember_miss(offered_fingerprint)
+            if not snapshot_ready:
+                negative_cache.count(negative_cache.COUNTER_UNKNOWN_KEYS)
 
-        # Check tunnel keys
-        tunnel_match = ReverseServerAuthorizedKeys.objects.filter(
-            key__startswith=offered_key,
-        ).select_related('user').first()
+        if mode == self.MODE_MINIMAL:
+            return self.minimal_response(tunnel_match, user_match, service_match)
+
+        owner = None
         if tunnel_match:
             owner = tunnel_match.user
-            internal_keys_logger.info(
-                "Key owner found via tunnel key | user=%s", owner.username,
-            )
-
-        # Check user keys
-        if owner is None:
-            user_match = UserAuthorizedKeys.objects.filter(
-                key__startswith=offered_key,
-            ).select_related('user').first()
-            if user_match:
-                owner = user_match.user
-                internal_keys_logger.info(
-                    "Key owner found via user key | user=%s", owner.username,
-                )
-
-        # Check service keys (no user, but still authorized)
-        if owner is None:
-            service_match = ServiceAuthorizedKeys.objects.filter(
-                key__startswith=offered_key,
-            ).exists()
-            if service_match:
-                internal_keys_logger.info("Key matched service key (no user)")
-                # Service key: return just service keys + all tunnel keys
-                # (no user-scoped keys to add)
+        elif user_match:
+            owner = user_match.user
 
         # --- Step 2 & 3: Collect keys ---
         all_keys = set()
@@ -515,7 +595,6 @@ class InternalKeysView(APIView):
             )
 
             # Check if this user has tunnels shared with them
-            from tunnels.models import TunnelSharing
             has_shared_tunnels = TunnelSharing.objects.filter(
                 shared_with=owner,
             ).exists()
@@ -563,3 +642,112 @@ class InternalKeysView(APIView):
         internal_keys_logger.info("No keys found in database")
         return HttpResponse("", content_type="text/plain")
 
+    def snapshot_response(self, entry, mode):
+        """Build the response from a snapshot entry (None if the snapshot can't answer)."""
+        if mode == self.MODE_MINIMAL:
+            if entry and entry['authorized']:
+                internal_keys_logger.info(
+                    "Returning matched %s key only (minimal mode, snapshot)", entry['kind'],
+                )
+                return HttpResponse(entry['key'].strip() + "\n", content_type="text/plain")
+            internal_keys_logger.info("Offered key not authorized (minimal mode, snapshot)")
+            return HttpResponse("", content_type="text/plain")
+
+        owner_id = None
+        if entry and entry['kind'] != key_snapshot.KIND_SERVICE:
+            owner_id = entry['owner_id']
+        all_keys = key_snapshot.get_full_key_lines(owner_id)
+        if all_keys is None:
+            return None
+
+        internal_keys_logger.info(
+            "Returning %d keys | owner_id=%s (snapshot)", len(all_keys), owner_id,
+        )
+        if all_keys:
+            return HttpResponse("\n".join(all_keys) + "\n", content_type="text/plain")
+        return HttpResponse("", content_type="text/plain")
+
+    def lookup_offered_key(self, fingerprint):
+        """Find the key record matching ``fingerprint``.
+
+        Returns a ``(tunnel_match, user_match, service_match)`` tuple where at
+        most one element is set; tunnel keys win over user keys, which win
+        over service keys.
+        """
+        # Check tunnel keys
+        tunnel_match = ReverseServerAuthorizedKeys.objects.filter(
+            key_fingerprint=fingerprint,
+        ).select_related('user').first()
+        if tunnel_match:
+            internal_keys_logger.info(
+                "Key owner found via tunnel key | user=%s", tunnel_match.user.username,
+            )
+            return tunnel_match, None, None
+
+        # Check user keys
+        user_match = UserAuthorizedKeys.objects.filter(
+            key_fingerprint=fingerprint,
+        ).select_related('user').first()
+        if user_match:
+            internal_keys_logger.info(
+                "Key owner found via user key | user=%s", user_match.user.username,
+            )
+            return None, user_match, None
+
+        # Check service keys (no user, but still authorized)
+        service_match = ServiceAuthorizedKeys.objects.filter(
+            key_fingerprint=fingerprint,
+        ).first()
+        if service_match:
+            internal_keys_logger.info("Key matched service key (no user)")
+            return None, None, service_match
+
+        return None, None, None
+
+    @staticmethod
+    def owner_has_tunnel_access(owner) -> bool:
+        """Personal keys are only accepted if the owner has own or shared tunnels."""
+        return (
+            ReverseServerAuthorizedKeys.objects.filter(user=owner).exists()
+            or TunnelSharing.objects.filter(shared_with=owner).exists()
+        )
+
+    def minimal_response(self, tunnel_match, user_match, service_match):
+        """Return only the offered key line if it is authorized, else nothing."""
+        matched_key = None
+
+        if tunnel_match:
+            matched_key = tunnel_match.key
+        elif service_match:
+            matched_key = service_match.key
+        elif user_match:
+            if self.owner_has_tunnel_access(user_match.user):
+                matched_key = user_match.key
+            else:
+                internal_keys_logger.info(
+                    "Owner %s has NO tunnels and NO shared tunnels → personal key denied",
+                    user_match.user.username,
+                )
+
+        if matched_key:
+            internal_keys_logger.info("Returning matched key only (minimal mode)")
+            return HttpResponse(matched_key.strip() + "\n", content_type="text/plain")
+
+        internal_keys_logger.info("Offered key not authorized (minimal mode)")
+        return HttpResponse("", content_type="text/plain")
+
+
+class InternalKeysStatsView(APIView):
+    """Internal endpoint exposing lookup counters of `InternalKeysView`.
+
+    The ``unknown_keys`` counter tracks keys matching nothing (mostly scanner
+    traffic); ``hits``/``misses`` are the negative cache's hit and miss counts.
+    """
+    permission_classes = [IsInternalService]
+    authentication_classes = []
+
+    def get(self, request):
+        return Response({
+            "snapshot_version": key_snapshot.get_version(),
+            "negative_cache": negative_cache.get_stats(),
+        })
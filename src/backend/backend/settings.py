@@ -3,6 +3,7 @@ Django settings for backend project.
 """
 import os
 import sys
+import json
 from datetime import timedelta
 import logging
 from pathlib import Path
@@ -217,6 +218,85 @@ CACHES = {
     },
 }
 
+# Serve sshd AuthorizedKeysCommand lookups from a precomputed snapshot in Redis
+# (see `authorized_keys/key_snapshot.py`); falls back to the database when missing.
+AUTHORIZED_KEYS_SNAPSHOT_ENABLED = os.getenv("AUTHORIZED_KEYS_SNAPSHOT_ENABLED", "True").lower() == "true"
+# Seconds an offered key that matched no stored key is remembered as a miss
+# (see `authorized_keys/negative_cache.py`); 0 disables the negative cache.
+AUTHORIZED_KEYS_NEGATIVE_CACHE_TTL = int(os.getenv("AUTHORIZED_KEYS_NEGATIVE_CACHE_TTL", "60"))
+# Push mode: render authorized_keys files to a volume shared with the SSH
+# container instead of answering per-login lookups (see `authorized_keys/key_files.py`).
+AUTHORIZED_KEYS_PUSH_MODE = os.getenv("AUTHORIZED_KEYS_PUSH_MODE", "False").lower() == "true"
+AUTHORIZED_KEYS_PUSH_DIR = DATA_DIR / "authorized_keys"
+
+# SSH gateway nodes hosting reverse tunnels (`services/gateways.py`): a JSON
+# list of {"name", "host", "port", "public_host", "public_port", "weight"}.
+# `host`/`port` are how the backend reaches the node's sshd; `public_host` and
+# `public_port` (default: the web host / REVERSE_SERVER_SSH_PORT) are what
+# tunnel clients connect to.  Each node runs the SSH container with its own
+# TELEPY_GATEWAY_NAME.  Default: the single `ssh` container.
+TUNNEL_GATEWAYS = json.loads(os.getenv("TUNNEL_GATEWAYS") or "[]") or [
+    {"name": "default", "host": "ssh", "port": 2222},
+]
+
+# Tunnel port-status monitor (`manage.py port_monitor`): seconds between checks
+# for missed port events and port index changes.
+PORT_MONITOR_INTERVAL = float(os.getenv("PORT_MONITOR_INTERVAL", "5"))
+# Tunnel uptime history (`authorized_keys/uptime.py`): days of exact
+# connect/disconnect runs kept before downsampling to hourly buckets, and days
+# of hourly buckets kept.
+TUNNEL_UPTIME_RAW_DAYS = float(os.getenv("TUNNEL_UPTIME_RAW_DAYS", "7"))
+TUNNEL_UPTIME_RETENTION_DAYS = float(os.getenv("TUNNEL_UPTIME_RETENTION_DAYS", "365"))
+# Latency probes of connected tunnels run by the port monitor
+# (`authorized_keys/port_probe.py`): seconds between rounds (0 disables),
+# parallel probes, per-probe timeout and the RTT above which a tunnel is degraded.
+PORT_PROBE_INTERVAL = float(os.getenv("PORT_PROBE_INTERVAL", "60"))
+PORT_PROBE_CONCURRENCY = int(os.getenv("PORT_PROBE_CONCURRENCY", "8"))
+PORT_PROBE_TIMEOUT = float(os.getenv("PORT_PROBE_TIMEOUT", "5"))
+PORT_PROBE_DEGRADED_MS = float(os.getenv("PORT_PROBE_DEGRADED_MS", "500"))
+
+# Web terminal output (`tunnels/terminal_output.py`): pty output is sent as one
+# frame once this many bytes are buffered or this many seconds after its first byte.
+TERMINAL_OUTPUT_FLUSH_BYTES = int(os.getenv("TERMINAL_OUTPUT_FLUSH_BYTES", "32768"))
+TERMINAL_OUTPUT_FLUSH_DELAY = float(os.getenv("TERMINAL_OUTPUT_FLUSH_DELAY", "0.005"))
+# The pty is no longer read while more than HIGH_WATER bytes of output are
+# unsent or unacknowledged by the browser, until they drop below LOW_WATER.
+TERMINAL_OUTPUT_HIGH_WATER = int(os.getenv("TERMINAL_OUTPUT_HIGH_WATER", "262144"))
+TERMINAL_OUTPUT_LOW_WATER = int(os.getenv("TERMINAL_OUTPUT_LOW_WATER", "65536"))
+# Detached terminal sessions (`tunnels/terminal_sessions.py`): seconds a pty
+# stays alive after its WebSocket drops (0 kills it at once), and bytes of
+# recent output replayed to a reattaching browser.
+TERMINAL_SESSION_GRACE = float(os.getenv("TERMINAL_SESSION_GRACE", "300"))
+TERMINAL_SCROLLBACK_BYTES = int(os.getenv("TERMINAL_SCROLLBACK_BYTES", "262144"))
+# Seconds a closing terminal's ssh child gets after SIGTERM before SIGKILL
+# (`tunnels/pty_process.py`).
+TERMINAL_KILL_TIMEOUT = float(os.getenv("TERMINAL_KILL_TIMEOUT", "2"))
+# Terminal broker (`tunnels/terminal_broker.py`): worker processes owning the
+# terminal sessions (forked by [program:terminal_broker] in supervisord.conf;
+# 0 runs terminals inside the ASGI process) and their sockets.
+TERMINAL_BROKER_WORKERS = int(os.getenv("TERMINAL_BROKER_WORKERS", "4"))
+TERMINAL_BROKER_SOCKET_DIR = os.getenv("TERMINAL_BROKER_SOCKET_DIR", "/tmp/telepy-terminal-broker")
+# Terminal session recordings (`tunnels/terminal_recording.py`): directory,
+# compressed bytes per file before rotating, days kept (0 keeps them), events
+# queued before dropping and seconds between flushes of the files.
+TERMINAL_RECORDING_DIR = os.getenv("TERMINAL_RECORDING_DIR", str(DATA_DIR / "recordings"))
+TERMINAL_RECORDING_MAX_BYTES = int(os.getenv("TERMINAL_RECORDING_MAX_BYTES", "16777216"))
+TERMINAL_RECORDING_RETENTION_DAYS = float(os.getenv("TERMINAL_RECORDING_RETENTION_DAYS", "90"))
+TERMINAL_RECORDING_QUEUE_SIZE = int(os.getenv("TERMINAL_RECORDING_QUEUE_SIZE", "4096"))
+TERMINAL_RECORDING_FLUSH_INTERVAL = float(os.getenv("TERMINAL_RECORDING_FLUSH_INTERVAL", "1"))
+
+# Shared SSH connections to tunnel targets (`services/ssh_pool.py`): control
+# sockets and state, sessions per connection (the target sshd's MaxSessions),
+# seconds an unused connection is kept, seconds between health checks, the
+# handshake timeout and seconds before retrying a connection the target's
+# authentication refused (doubled with each refusal).
+TUNNEL_SSH_POOL_DIR = os.getenv("TUNNEL_SSH_POOL_DIR", "/tmp/telepy-ssh")
+TUNNEL_SSH_MAX_SESSIONS = int(os.getenv("TUNNEL_SSH_MAX_SESSIONS", "10"))
+TUNNEL_SSH_IDLE_TIMEOUT = float(os.getenv("TUNNEL_SSH_IDLE_TIMEOUT", "300"))
+TUNNEL_SSH_CHECK_INTERVAL = float(os.getenv("TUNNEL_SSH_CHECK_INTERVAL", "30"))
+TUNNEL_SSH_CONNECT_TIMEOUT = int(os.getenv("TUNNEL_SSH_CONNECT_TIMEOUT", "15"))
+TUNNEL_SSH_FAILURE_BACKOFF = float(os.getenv("TUNNEL_SSH_FAILURE_BACKOFF", "60"))
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
@@ -262,6 +342,10 @@ HANDLERS.update({
         'class': 'logging.StreamHandler',
         'stream': sys.stdout
     },
+    'port_monitor': {
+        'class': 'logging.StreamHandler',
+        'stream': sys.stdout
+    },
 })
 
 LOGGING = {
@@ -293,7 +377,12 @@ LOGGING = {
             'handlers': ['internal_keys_api'],
             'propagate': False,
             'level': 'INFO',
-        }
+        },
+        'authorized_keys.port_monitor': {
+            'handlers': ['port_monitor'],
+            'propagate': False,
+            'level': 'INFO',
+        },
     }
 }
 
@@ -9,7 +9,7 @@ chown root:root /root/.ssh/config
 chmod 600 /root/.ssh/id_rsa
 
 # Set scripts to executable
-chmod +x /scripts/*.sh
+chmod +x /scripts/*.sh 2>/dev/null || true
 
 # Backend root is under /src
 cd /src
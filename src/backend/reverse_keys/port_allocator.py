@@ -0,0 +1,212 @@
+"""
+Reverse port allocator for new tunnels.
+
+Free ports are kept in Redis as a sorted free-list, so picking a port is a
+single atomic step instead of diffing the whole port range against the
+database, and two concurrent tunnel creations can never be handed the same
+port:
+
+    tunnel_ports:allocator:free      sorted set  free ports (score = port)
+    tunnel_ports:allocator:reserved  sorted set  reserved ports (score = expiry)
+    tunnel_ports:allocator:ready     set once the free-list has been built
+
+Ports are unique across all gateways (see `services/gateways.py`).  A port
+is reserved (popped from the free-list, lowest first, skipping ports
+something is listening on at any gateway), then committed once the tunnel row exists,
+or released on failure.  Reservations that are never confirmed expire after
+PORT_RESERVATION_TTL seconds and return to the free-list.  Deleted tunnels
+release their port (see `authorized_keys/signals.py`).
+
+The free-list is rebuilt from the database on startup and whenever it is
+missing.  A port taken outside the allocator (e.g. tunnels bulk-created by
+`benchmark_auth_keys`) is caught by the unique `reverse_port` constraint and
+skipped; after ALLOCATION_ATTEMPTS such ports in a row the free-list is
+considered stale and rebuilt once.
+"""
+import time
+import logging
+from typing import Callable, TypeVar
+
+from django.db import IntegrityError, transaction
+
+from authorized_keys.utils import listening_ports_key
+from services.gateways import get_gateways
+from services.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PORT_RANGE_START = 1024
+PORT_RANGE_END = 65535  # exclusive
+PORT_RESERVATION_TTL = 60
+ALLOCATION_ATTEMPTS = 5
+
+FREE_KEY = "tunnel_ports:allocator:free"
+RESERVED_KEY = "tunnel_ports:allocator:reserved"
+READY_KEY = "tunnel_ports:allocator:ready"
+REBUILD_LOCK_KEY = "tunnel_ports:allocator:rebuild_lock"
+
+NOT_READY = -1
+
+# KEYS: free, reserved, ready, then the listening hash of every gateway
+# ARGV: now, reservation expiry
+RESERVE_SCRIPT = """
+local function listening(port)
+    for i = 4, #KEYS do
+        if redis.call('HEXISTS', KEYS[i], port) == 1 then
+            return true
+        end
+    end
+    return false
+end
+if redis.call('EXISTS', KEYS[3]) == 0 then
+    return -1
+end
+for _, port in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])) do
+    redis.call('ZREM', KEYS[2], port)
+    redis.call('ZADD', KEYS[1], port, port)
+end
+local skipped = {}
+local port = false
+while true do
+    local popped = redis.call('ZPOPMIN', KEYS[1])
+    if #popped == 0 then
+        break
+    end
+    if not listening(popped[1]) then
+        port = popped[1]
+        break
+    end
+    table.insert(skipped, popped[1])
+end
+for _, skipped_port in ipairs(skipped) do
+    redis.call('ZADD', KEYS[1], skipped_port, skipped_port)
+end
+if port then
+    redis.call('ZADD', KEYS[2], ARGV[2], port)
+end
+return port
+"""
+
+
+class NoFreePortError(Exception):
+    pass
+
+
+def _client():
+    client = get_redis()
+    if client is None:
+        raise Exception("Port allocator unavailable.")
+    return client
+
+
+def rebuild() -> int:
+    """
+    Rebuild the free-list from the tunnels in the database.
+
+    Returns:
+    - int: The number of free ports.
+    """
+    from authorized_keys.models import ReverseServerAuthorizedKeys
+
+    client = _client()
+    if not client.set(REBUILD_LOCK_KEY, 1, nx=True, ex=30):
+        # Another process is rebuilding; wait for it instead of rebuilding twice
+        for _ in range(50):
+            if client.exists(READY_KEY):
+                break
+            time.sleep(0.1)
+        return client.zcard(FREE_KEY)
+
+    try:
+        used = set(ReverseServerAuthorizedKeys.objects.values_list('reverse_port', flat=True))
+        used.update(int(port) for port in client.zrange(RESERVED_KEY, 0, -1))
+        free = [port for port in range(PORT_RANGE_START, PORT_RANGE_END) if port not in used]
+
+        pipe = client.pipeline(transaction=True)
+        pipe.delete(FREE_KEY)
+        for start in range(0, len(free), 10000):
+            pipe.zadd(FREE_KEY, {port: port for port in free[start:start + 10000]})
+        pipe.set(READY_KEY, 1)
+        pipe.execute()
+    finally:
+        client.delete(REBUILD_LOCK_KEY)
+
+    logger.info("Port allocator rebuilt | free=%d | used=%d", len(free), len(used))
+    return len(free)
+
+
+def reserve_port(ttl: int = PORT_RESERVATION_TTL) -> int:
+    """Atomically take the lowest free port; it expires unless committed."""
+    client = _client()
+    script = client.register_script(RESERVE_SCRIPT)
+    listening_keys = [listening_ports_key(gateway) for gateway in get_gateways()]
+    for _ in range(2):
+        now = time.time()
+        port = script(keys=[FREE_KEY, RESERVED_KEY, READY_KEY, *listening_keys], args=[now, now + ttl])
+        if port is None:
+            raise NoFreePortError("Not enough free ports available.")
+        if int(port) != NOT_READY:
+            return int(port)
+        rebuild()
+    raise Exception("Port allocator unavailable.")
+
+
+def commit_port(port: int) -> None:
+    """The port is now used by a tunnel: drop its reservation for good."""
+    pipe = _client().pipeline(transaction=True)
+    pipe.zrem(RESERVED_KEY, port)
+    # Expired and reclaimed meanwhile: take it back off the free-list
+    pipe.zrem(FREE_KEY, port)
+    pipe.execute()
+
+
+def release_port(port: int) -> None:
+    """Return a reserved or no longer used port to the free-list."""
+    if not PORT_RANGE_START <= port < PORT_RANGE_END:
+        return
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        pipe = client.pipeline(transaction=True)
+        pipe.zrem(RESERVED_KEY, port)
+        pipe.zadd(FREE_KEY, {port: port})
+        pipe.execute()
+    except Exception as e:
+        logger.error("Port allocator: failed to release port %s (%s)", port, e)
+
+
+def create_with_port(create: Callable[[int], T]) -> T:
+    """
+    Reserve a port, call `create(port)` and commit the port if it succeeds.
+
+    A port already used in the database (taken outside the allocator) is
+    dropped from the free-list and the next one is tried.  If every attempt
+    collides the free-list is stale: it is rebuilt once and tried again.
+    """
+    from authorized_keys.models import ReverseServerAuthorizedKeys
+
+    for rebuilt in (False, True):
+        for _ in range(ALLOCATION_ATTEMPTS):
+            port = reserve_port()
+            try:
+                with transaction.atomic():
+                    result = create(port)
+            except IntegrityError:
+                if ReverseServerAuthorizedKeys.objects.filter(reverse_port=port).exists():
+                    logger.warning("Port allocator: port %d already in use, skipping", port)
+                    commit_port(port)
+                    continue
+                release_port(port)
+                raise
+            except BaseException:
+                release_port(port)
+                raise
+            commit_port(port)
+            return result
+        if not rebuilt:
+            logger.warning("Port allocator: %d ports in a row already in use, rebuilding", ALLOCATION_ATTEMPTS)
+            rebuild()
+    raise NoFreePortError("Not enough free ports available.")
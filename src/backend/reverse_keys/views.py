@@ -16,9 +16,11 @@ from drf_yasg import openapi
 
 from authorized_keys.models import ReverseServerAuthorizedKeys
 from reverse_keys.utils import issue_token, verify_token, remove_token, get_user_id_from_token
-from reverse_keys.utils import find_multiple_free_ports
+from reverse_keys.port_allocator import create_with_port
+from services.gateways import choose_gateway
 
 from authorized_keys.utils import is_valid_ssh_public_key
+from authorized_keys.utils import compute_key_fingerprint
 
 class IssueToken(APIView):
     permission_classes = (IsAuthenticated,)
@@ -105,19 +107,25 @@ class CreateReverseServerKey(APIView):
         description = request.data.get('description', '')
 
         try:
-            reverse_key = ReverseServerAuthorizedKeys.objects.create(
+            # Least loaded gateway node; the port is reserved atomically, so
+            # concurrent creations never share one
+            gateway = choose_gateway()
+            reverse_key = create_with_port(lambda reverse_port: ReverseServerAuthorizedKeys.objects.create(
                 user=user,
                 host_friendly_name=host_friendly_name,
                 key=key,
-                reverse_port=find_multiple_free_ports(1)[0],
+                reverse_port=reverse_port,
+                gateway=gateway.name,
                 description=description
-            )
+            ))
             remove_token(token)
             return Response({
                 "id": reverse_key.id,
                 "host_friendly_name": reverse_key.host_friendly_name,
                 "key": reverse_key.key,
-                "port": settings.REVERSE_SERVER_SSH_PORT,
+                "port": gateway.public_port or settings.REVERSE_SERVER_SSH_PORT,
+                "gateway": gateway.name,
+                "gateway_host": gateway.public_host,
                 "issuer": {
                     "id": user.id,
                     "username": user.username
@@ -190,7 +198,7 @@ class CheckReverseServerKeyDuplicate(APIView):
         
         key_exists = ReverseServerAuthorizedKeys.objects.filter(
             user=user,
-            key=key,
+            key_fingerprint=compute_key_fingerprint(key),
         ).exists()
 
         if host_friendly_name_exists and key_exists:
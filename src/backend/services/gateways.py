@@ -0,0 +1,93 @@
+"""
+Reverse tunnel gateway nodes.
+
+Tunnels can be spread over several SSH gateway containers (TUNNEL_GATEWAYS).
+Each tunnel is assigned to one gateway when it is created
+(`ReverseServerAuthorizedKeys.gateway`); its client connects to that
+gateway's public address and every SSH connection the backend opens to the
+tunnel (web terminal, SFTP, remote browser, probes) jumps through that
+gateway, where the reverse port is bound to loopback.
+
+Reverse ports stay unique across all gateways (one allocator), so state keyed
+by port (port index, status, probes, uptime) does not change; each gateway
+publishes its own listening ports and a heartbeat (ssh/telepy-port-events.py):
+
+    tunnel_ports:listening:<gateway>  hash  port -> listening since
+    tunnel_ports:gateway:<gateway>    heartbeat (expires when the node is gone)
+"""
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GATEWAY = "default"
+GATEWAY_USER = "telepy"
+
+
+@dataclass(frozen=True)
+class Gateway:
+    name: str
+    # Address the backend reaches the gateway's sshd on
+    host: str
+    port: int = 2222
+    # Address tunnel clients connect to; None: the web host / REVERSE_SERVER_SSH_PORT
+    public_host: Optional[str] = None
+    public_port: Optional[int] = None
+    # Relative share of new tunnels; 0 drains the gateway
+    weight: float = 1.0
+
+    @property
+    def jump(self) -> str:
+        """`ProxyJump` spec of the gateway."""
+        return f"{GATEWAY_USER}@{self.host}:{self.port}"
+
+    @property
+    def proxy_option(self) -> str:
+        """ssh/scp option routing a connection to `localhost:<reverse_port>` through the gateway."""
+        return f"-o ProxyJump={self.jump}"
+
+    def public_address(self, host: str, port) -> Tuple[str, int]:
+        """Where tunnel clients connect: `host`/`port` unless the gateway overrides them."""
+        return self.public_host or host, self.public_port or port
+
+    def ssh_args(self, username: str, reverse_port: int) -> List[str]:
+        """Arguments of an `ssh` connection to a tunnel's target through this gateway."""
+        return ["-o", f"ProxyJump={self.jump}", "-p", str(reverse_port), f"{username}@localhost"]
+
+
+def get_gateways() -> Dict[str, Gateway]:
+    gateways = {}
+    for config in getattr(settings, "TUNNEL_GATEWAYS", None) or [{"name": DEFAULT_GATEWAY, "host": "ssh"}]:
+        gateway = Gateway(**config)
+        gateways[gateway.name] = gateway
+    return gateways
+
+
+def get_gateway(name: Optional[str]) -> Gateway:
+    """The named gateway, or the default one if it is no longer configured."""
+    gateways = get_gateways()
+    gateway = gateways.get(name or DEFAULT_GATEWAY)
+    if gateway is None:
+        logger.warning("Unknown tunnel gateway %r, using the default gateway", name)
+        gateway = gateways.get(DEFAULT_GATEWAY) or next(iter(gateways.values()))
+    return gateway
+
+
+def choose_gateway() -> Gateway:
+    """Pick the gateway for a new tunnel: the fewest tunnels per unit of weight."""
+    from django.db.models import Count
+    from authorized_keys.models import ReverseServerAuthorizedKeys
+
+    gateways = [gateway for gateway in get_gateways().values() if gateway.weight > 0]
+    if not gateways:
+        raise Exception("No tunnel gateway accepts new tunnels.")
+    if len(gateways) == 1:
+        return gateways[0]
+
+    counts = dict(
+        ReverseServerAuthorizedKeys.objects.values_list('gateway').annotate(count=Count('id'))
+    )
+    return min(gateways, key=lambda gateway: (counts.get(gateway.name, 0) / gateway.weight, gateway.name))
@@ -0,0 +1,64 @@
+"""
+Shared Redis access for gateway state (tunnel ports and status, snapshots,
+script tokens, terminal sessions).
+
+All state lives in the Redis behind the default cache (`CACHES['default']`):
+
+- `get_redis()` returns the synchronous client of django-redis, backed by its
+  connection pool, for views, signals and management commands.
+- `get_async_redis()` returns a `redis.asyncio` client for consumers and the
+  port monitor.  Asyncio connections are bound to an event loop, so one pool
+  is kept per running loop.
+
+Neither spawns a process or opens a connection per call.  Values are stored
+as plain strings/JSON (not pickled like Django cache values), so the SSH
+gateway and other processes can read them too.
+"""
+import json
+import asyncio
+import logging
+import weakref
+from typing import Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def get_redis_url() -> str:
+    return settings.CACHES['default']['LOCATION']
+
+
+def get_redis():
+    """Return the pooled synchronous Redis client, or None if unavailable."""
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection("default")
+    except Exception as e:
+        logger.warning("Redis unavailable (%s)", e)
+        return None
+
+
+def get_async_redis():
+    """Return an asyncio Redis client using the current event loop's pool."""
+    import redis.asyncio as aioredis
+
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        pool = _async_pools[loop] = aioredis.ConnectionPool.from_url(get_redis_url())
+    return aioredis.Redis(connection_pool=pool)
+
+
+def decode(value) -> Optional[str]:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def dumps(value) -> str:
+    return json.dumps(value)
+
+
+def loads(value):
+    return json.loads(value) if value is not None else None
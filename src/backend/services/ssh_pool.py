@@ -0,0 +1,412 @@
+"""
+Shared SSH connections to tunnel targets.
+
+Every feature that reaches a tunnel's target (web terminal, file manager,
+SFTP views, remote browser) runs its sessions as channels of one multiplexed
+OpenSSH master per (tunnel, username) instead of opening a connection of its
+own, so the handshake through the gateway and the reverse tunnel is paid once:
+
+    with ssh_pool.connect(SSHTarget.for_tunnel(tunnel, username)) as connection:
+        subprocess.run(connection.ssh_argv("uname -a"))
+
+A master (`ssh -M -N -f`) listens on a control socket in TUNNEL_SSH_POOL_DIR
+and is shared by every process of the backend (ASGI server, terminal broker
+workers).  Per target, a state file locked with flock records its masters
+("slots") and the leases of all processes:
+
+- reference counting: `connect` takes a lease, `close` gives it back; leases
+  of processes that died are dropped.
+- max sessions: a master carries at most TUNNEL_SSH_MAX_SESSIONS leases (the
+  target sshd's MaxSessions); further connections get a second master.
+- health checks: a master is checked (`ssh -O check`) before it is reused,
+  at most every TUNNEL_SSH_CHECK_INTERVAL seconds, and replaced when dead.
+- idle eviction: a master without leases for TUNNEL_SSH_IDLE_TIMEOUT seconds
+  is stopped (`ssh -O exit`) by the maintenance thread of any process using
+  the pool.
+
+Clients use ControlMaster=no: if a master could not be started, they fall
+back to a connection of their own (ControlPath=none) and report its error as
+before; a SOCKS forward then runs as an `ssh -N -D` of its own.  Masters run
+with BatchMode, so targets where the backend has no key (users type a
+password in the web terminal) never get one: a master refused by the target's
+authentication is recorded in the state file and not tried again for
+TUNNEL_SSH_FAILURE_BACKOFF seconds, doubling with each further refusal up to
+an hour, so such targets pay the failed handshake once per backoff instead of
+on every connection.  Other failures (e.g. the tunnel is offline) do not back
+off: the next connection tries again.
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterator, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from services.gateways import DEFAULT_GATEWAY, get_gateway
+
+logger = logging.getLogger(__name__)
+
+MASTER_OPTIONS = [
+    "-o", "BatchMode=yes",
+    "-o", "ServerAliveInterval=15",
+    "-o", "ServerAliveCountMax=3",
+    "-o", "ControlPersist=yes",
+]
+# Seconds `ssh -O <command>` may take to answer
+CONTROL_TIMEOUT = 5
+# Longest wait before a master is tried again after failures
+MAX_FAILURE_BACKOFF = 3600
+# Errors of a master refused by the target (BatchMode: no password prompt)
+AUTH_ERRORS = ("Permission denied", "Too many authentication failures")
+# Seconds a standalone forward gets to listen
+FORWARD_STARTUP = 2
+
+_maintenance_lock = threading.Lock()
+_maintenance_pid: Optional[int] = None
+
+
+def get_pool_dir() -> str:
+    return getattr(settings, "TUNNEL_SSH_POOL_DIR", "/tmp/telepy-ssh")
+
+
+def get_max_sessions() -> int:
+    return getattr(settings, "TUNNEL_SSH_MAX_SESSIONS", 10)
+
+
+def get_idle_timeout() -> float:
+    return getattr(settings, "TUNNEL_SSH_IDLE_TIMEOUT", 300)
+
+
+def get_check_interval() -> float:
+    return getattr(settings, "TUNNEL_SSH_CHECK_INTERVAL", 30)
+
+
+def get_connect_timeout() -> int:
+    return getattr(settings, "TUNNEL_SSH_CONNECT_TIMEOUT", 15)
+
+
+def get_failure_backoff() -> float:
+    return getattr(settings, "TUNNEL_SSH_FAILURE_BACKOFF", 60)
+
+
+@dataclass(frozen=True)
+class SSHTarget:
+    """A username on a tunnel's target, reached through the tunnel's gateway."""
+    server_id: int
+    username: str
+    reverse_port: int
+    gateway: str = DEFAULT_GATEWAY
+
+    @classmethod
+    def for_tunnel(cls, tunnel, username: str) -> "SSHTarget":
+        return cls(tunnel.id, username, tunnel.reverse_port, tunnel.gateway or DEFAULT_GATEWAY)
+
+    @property
+    def key(self) -> str:
+        # Control sockets must fit in sun_path: hash instead of the username
+        identity = f"{self.server_id}:{self.username}:{self.reverse_port}:{self.gateway}"
+        return hashlib.sha1(identity.encode()).hexdigest()[:16]
+
+    def ssh_args(self) -> List[str]:
+        return get_gateway(self.gateway).ssh_args(self.username, self.reverse_port)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def control_path(key: str, slot: int) -> str:
+    return os.path.join(get_pool_dir(), f"{key}-{slot}.sock")
+
+
+def control(path: str, command: str, *args: str) -> bool:
+    """Run `ssh -O <command>` against the master on `path`."""
+    # The destination is required but not contacted (the ControlPath has no tokens)
+    argv = ["ssh", "-o", f"ControlPath={path}", "-O", command, *args, "pool"]
+    try:
+        result = subprocess.run(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL, timeout=CONTROL_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return result.returncode == 0
+
+
+def start_master(path: str, target: SSHTarget) -> Optional[str]:
+    """Start a master on `path`. Returns its error if it could not be started."""
+    timeout = get_connect_timeout()
+    argv = [
+        "ssh", "-M", "-N", "-f", *MASTER_OPTIONS,
+        "-o", f"ConnectTimeout={timeout}",
+        "-o", f"ControlPath={path}",
+        *target.ssh_args(),
+    ]
+    # Not a pipe: the backgrounded master would keep it open
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            result = subprocess.run(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=stderr, timeout=timeout * 2)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"SSH master for tunnel {target.server_id} ({target.username}) not started: {e}")
+            return str(e)
+        if result.returncode != 0:
+            stderr.seek(0)
+            error = stderr.read().decode(errors="replace").strip()
+            logger.warning(f"SSH master for tunnel {target.server_id} ({target.username}) not started: {error}")
+            return error or f"ssh exited with {result.returncode}"
+    logger.info(f"SSH master started for tunnel {target.server_id} ({target.username}) on {path}")
+    return None
+
+
+def stop_master(path: str) -> None:
+    control(path, "exit")
+    # A master that did not answer leaves its socket behind
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def lease_counts(state: dict) -> Dict[int, int]:
+    counts: Dict[int, int] = {}
+    for lease in state["leases"].values():
+        counts[lease["slot"]] = counts.get(lease["slot"], 0) + 1
+    return counts
+
+
+@contextmanager
+def locked_state(key: str) -> Iterator[dict]:
+    """The state of a target's masters, locked against all processes while in use."""
+    os.makedirs(get_pool_dir(), mode=0o700, exist_ok=True)
+    fd = os.open(os.path.join(get_pool_dir(), f"{key}.json"), os.O_RDWR | os.O_CREAT, 0o600)
+    with os.fdopen(fd, "r+") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            state = json.loads(f.read() or "{}")
+        except ValueError:
+            state = {}
+        state.setdefault("slots", {})
+        state["leases"] = {
+            lease_id: lease for lease_id, lease in state.get("leases", {}).items() if pid_alive(lease["pid"])
+        }
+        yield state
+
+        # Masters left without leases start their idle time
+        now = time.time()
+        counts = lease_counts(state)
+        for slot, info in state["slots"].items():
+            if counts.get(int(slot)):
+                info["idle_since"] = None
+            elif info.get("idle_since") is None:
+                info["idle_since"] = now
+        f.seek(0)
+        f.truncate()
+        json.dump(state, f)
+
+
+class SSHConnection:
+    """
+    A lease on the shared master of `target`; `close` gives it back.
+
+    Without a master (`control_path` is None) its commands open a connection
+    of their own and its forwards run as `ssh -N -D` processes.
+    """
+
+    def __init__(self, target: SSHTarget, path: Optional[str], lease_id: Optional[str]):
+        self.target = target
+        self.control_path = path
+        self.lease_id = lease_id
+        self.closed = False
+        # Standalone forwards (no master): spec -> ssh process
+        self.forwards: Dict[str, subprocess.Popen] = {}
+
+    @property
+    def options(self) -> List[str]:
+        if self.control_path is None:
+            return ["-o", "ControlPath=none"]
+        return ["-o", "ControlMaster=no", "-o", f"ControlPath={self.control_path}"]
+
+    @property
+    def destination(self) -> str:
+        return f"{self.target.username}@localhost"
+
+    def ssh_argv(self, *command: str) -> List[str]:
+        """`ssh` command line running `command` (or a shell) on the target as a channel of the master."""
+        return ["ssh", *self.options, *self.target.ssh_args(), *command]
+
+    def proxy_options(self) -> List[str]:
+        """Options of an `ssh`/`scp` to `destination` (the port is passed with -p/-P)."""
+        return [*self.options, "-o", f"ProxyJump={get_gateway(self.target.gateway).jump}"]
+
+    def alive(self) -> bool:
+        if self.control_path is None:
+            return bool(self.forwards) and all(process.poll() is None for process in self.forwards.values())
+        return control(self.control_path, "check")
+
+    def forward(self, spec: str) -> bool:
+        """Add a dynamic (SOCKS) forward `[bind_address:]port` to the master."""
+        if self.control_path is not None:
+            return control(self.control_path, "forward", "-D", spec)
+        argv = ["ssh", *self.options, "-N", "-q", "-D", spec, *self.target.ssh_args()]
+        try:
+            process = subprocess.Popen(argv, stdin=subprocess.DEVNULL)
+        except OSError as e:
+            logger.warning(f"SSH forward for tunnel {self.target.server_id} not started: {e}")
+            return False
+        # Wait for the forward to listen
+        try:
+            process.wait(timeout=FORWARD_STARTUP)
+        except subprocess.TimeoutExpired:
+            self.forwards[spec] = process
+            return True
+        return False
+
+    def cancel_forward(self, spec: str) -> bool:
+        if self.control_path is not None:
+            return control(self.control_path, "cancel", "-D", spec)
+        process = self.forwards.pop(spec, None)
+        if process is None:
+            return False
+        process.terminate()
+        try:
+            process.wait(timeout=CONTROL_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        return True
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        for spec in list(self.forwards):
+            self.cancel_forward(spec)
+        if self.lease_id is None:
+            return
+        with locked_state(self.target.key) as state:
+            state["leases"].pop(self.lease_id, None)
+
+    async def aclose(self) -> None:
+        await sync_to_async(self.close, thread_sensitive=False)()
+
+    def __enter__(self) -> "SSHConnection":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def connect(target: SSHTarget) -> SSHConnection:
+    """
+    Take a lease on a healthy master of `target`, starting one if needed.
+
+    Blocks while a master is started; use `aconnect` on an event loop.
+    """
+    start_maintenance()
+    now = time.time()
+    lease_id = f"{os.getpid()}:{uuid.uuid4().hex[:12]}"
+    with locked_state(target.key) as state:
+        backoff = state.get("backoff")
+        if backoff is not None and now < backoff["until"]:
+            # A master was refused recently (the target wants a password): do not try again yet
+            return SSHConnection(target, None, None)
+
+        counts = lease_counts(state)
+        slot = 0
+        while counts.get(slot, 0) >= get_max_sessions():
+            slot += 1
+        path = control_path(target.key, slot)
+        info = state["slots"].get(str(slot))
+
+        healthy = info is not None and os.path.exists(path)
+        if healthy and now - info["checked_at"] >= get_check_interval():
+            healthy = control(path, "check")
+            info["checked_at"] = now
+        if not healthy:
+            if info is not None:
+                logger.warning(f"SSH master for tunnel {target.server_id} ({target.username}) is gone, replacing it")
+            stop_master(path)
+            error = start_master(path, target)
+            if error is None:
+                state["slots"][str(slot)] = {"checked_at": now, "idle_since": None}
+                state.pop("backoff", None)
+            elif not any(message in error for message in AUTH_ERRORS):
+                # e.g. the tunnel is offline: the next connection tries again
+                state["slots"].pop(str(slot), None)
+                return SSHConnection(target, None, None)
+            else:
+                state["slots"].pop(str(slot), None)
+                failures = (backoff or {}).get("failures", 0) + 1
+                delay = min(get_failure_backoff() * 2 ** (failures - 1), MAX_FAILURE_BACKOFF)
+                state["backoff"] = {"failures": failures, "until": time.time() + delay}
+                logger.warning(f"No SSH master for tunnel {target.server_id} ({target.username}) for {delay:.0f}s")
+                return SSHConnection(target, None, None)
+        state["leases"][lease_id] = {"pid": os.getpid(), "slot": slot}
+    return SSHConnection(target, path, lease_id)
+
+
+async def aconnect(target: SSHTarget) -> SSHConnection:
+    return await sync_to_async(connect, thread_sensitive=False)(target)
+
+
+def sweep() -> None:
+    """Stop idle masters and drop dead ones, for every target."""
+    try:
+        names = os.listdir(get_pool_dir())
+    except FileNotFoundError:
+        return
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        key = name[:-len(".json")]
+        with locked_state(key) as state:
+            now = time.time()
+            for slot, info in list(state["slots"].items()):
+                path = control_path(key, int(slot))
+                if info.get("idle_since") is not None and now - info["idle_since"] >= get_idle_timeout():
+                    logger.info(f"Stopping idle SSH master {path}")
+                    stop_master(path)
+                    del state["slots"][slot]
+                elif now - info["checked_at"] >= get_check_interval():
+                    if control(path, "check"):
+                        info["checked_at"] = now
+                    else:
+                        logger.warning(f"SSH master {path} failed its health check")
+                        stop_master(path)
+                        del state["slots"][slot]
+
+
+def run_maintenance() -> None:
+    while True:
+        time.sleep(min(get_check_interval(), get_idle_timeout()))
+        try:
+            sweep()
+        except Exception as e:
+            logger.error(f"SSH pool maintenance failed: {e}")
+
+
+def start_maintenance() -> None:
+    """Start this process's maintenance thread (once)."""
+    global _maintenance_pid
+    with _maintenance_lock:
+        if _maintenance_pid == os.getpid():
+            return
+        _maintenance_pid = os.getpid()
+    threading.Thread(target=run_maintenance, name="ssh-pool-maintenance", daemon=True).start()
@@ -797,6 +797,35 @@ function deleteUser(userId, serverId) { // Add serverId parameter
     });
 }
 
+// Tunnel status version of the displayed status (null until the first snapshot)
+let tunnelStatusVersion = null;
+
+function syncTunnelStatus(socket) {
+    if (socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ action: "SYNC-TUNNEL-STATUS", version: tunnelStatusVersion }));
+    }
+}
+
+function applyTunnelStatus(ports, notify) {
+    // ports: { "<reverse port>": connected }
+    if (!globalThis.data) {
+        return;
+    }
+    Object.entries(ports).forEach(([port, isConnected]) => {
+        const tunnel = globalThis.data.find(item => item.reverse_port === Number(port));
+        if (!tunnel) {
+            return;
+        }
+        updateStatus(isConnected, tunnel.host_friendly_name);
+        if (notify) {
+            const statusText = isConnected ? 'online' : 'offline';
+            const iconType = isConnected ? 'success' : 'warning';
+            createToastAlert(`Tunnel "${tunnel.host_friendly_name}" is now ${statusText}`, false, iconType);
+        }
+    });
+    console.log('Updated tunnel status:', ports);
+}
+
 function tunnelNotificationWebsocket() {
     var socket = notificationWebsocket();
     if (!socket) {
@@ -804,6 +833,11 @@ function tunnelNotificationWebsocket() {
         return;
     }
 
+    // Catch up on status changes missed before the connection
+    socket.addEventListener('open', function () {
+        syncTunnelStatus(socket);
+    });
+
     socket.onmessage = function (event) {
         const data = JSON.parse(event.data);
         console.log('Notification message:', data.message);
@@ -827,53 +861,24 @@ function tunnelNotificationWebsocket() {
             createToastAlert(data.message.details, false, 'info');
             // Refresh tunnel list to reflect permission changes
             fetchAndDisplayReverseServerKeys();
-        } else if (action === "UPDATE-TUNNEL-STATUS") {
-            // Update status for specific tunnel based on port
-            const port = data.message.port;
-            const status = data.message.status;
-            const isConnected = status === 'connected';
-
-            // Find tunnel with this port and update its status
-            if (globalThis.data) {
-                const tunnel = globalThis.data.find(item => item.reverse_port === port);
-                if (tunnel) {
-                    updateStatus(isConnected, tunnel.host_friendly_name);
-                    console.log(`Updated status for tunnel ${tunnel.host_friendly_name} (port ${port}): ${status}`);
-
-                    // Show toast notification for status change
-                    const statusText = isConnected ? 'online' : 'offline';
-                    const iconType = isConnected ? 'success' : 'warning';
-                    createToastAlert(`Tunnel "${tunnel.host_friendly_name}" is now ${statusText}`, false, iconType);
-                }
+        } else if (action === "TUNNEL-STATUS-SNAPSHOT") {
+            // Status of all tunnels of this user
+            tunnelStatusVersion = data.message.version;
+            applyTunnelStatus(data.message.ports || {}, false);
+        } else if (action === "TUNNEL-STATUS-DELTA") {
+            // Only the ports that changed since the previous version
+            const version = data.message.version;
+            const prev = data.message.prev;
+            if (tunnelStatusVersion !== null && version <= tunnelStatusVersion) {
+                return;
             }
-        } else if (action === "UPDATE-TUNNEL-STATUS-DATA") {
-            // Update status for all tunnels based on activated ports
-            const activatedPorts = data.message.data || [];
-
-            if (globalThis.data) {
-                globalThis.data.forEach(item => {
-                    const hostFriendlyName = item.host_friendly_name;
-                    const reversePort = item.reverse_port;
-
-                    // Check if port is in activated ports list
-                    const isConnected = activatedPorts.includes(reversePort);
-                    updateStatus(isConnected, hostFriendlyName);
-                });
-                console.log('Updated status for all tunnels based on activated ports:', activatedPorts);
-
-                // Show a summary toast notification
-                const onlineCount = activatedPorts.length;
-                const totalCount = globalThis.data.length;
-                const offlineCount = totalCount - onlineCount;
-
-                if (onlineCount > 0 && offlineCount > 0) {
-                    createToastAlert(`Tunnel status updated: ${onlineCount} online, ${offlineCount} offline`, false, 'info');
-                } else if (onlineCount === totalCount) {
-                    createToastAlert(`All ${totalCount} tunnels are online`, false, 'success');
-                } else if (offlineCount === totalCount) {
-                    createToastAlert(`All ${totalCount} tunnels are offline`, false, 'warning');
-                }
+            if (tunnelStatusVersion === null || (prev !== null && prev > tunnelStatusVersion)) {
+                // Missed a delta, ask for the changes since our version
+                syncTunnelStatus(socket);
+                return;
             }
+            tunnelStatusVersion = version;
+            applyTunnelStatus(data.message.changes || {}, true);
         } else {
             // For unknown actions, just show a general toast
             createToastAlert(data.message.details || "Notification received", false);
@@ -1,13 +1,8 @@
-import os
 import json
 import asyncio
-import pty
-import signal
-import fcntl
-import termios
-import struct
 import base64
 import subprocess
+from typing import Optional, Tuple
 
 from asgiref.sync import sync_to_async
 from asgiref.sync import async_to_sync
@@ -23,7 +18,15 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 
 from authorized_keys.models import ReverseServerAuthorizedKeys
 from authorized_keys.models import ReverseServerUsernames
+from authorized_keys import port_status
 from tunnels.models import TunnelSharing, TunnelPermissionManager, TunnelPermission
+from services import ssh_pool
+from services.gateways import Gateway, get_gateway
+from services.ssh_pool import SSHTarget
+from tunnels import terminal_broadcast
+from tunnels import terminal_protocol
+from tunnels import terminal_broker
+from tunnels import terminal_sessions
 
 import logging
 logger = logging.getLogger(__name__)
@@ -31,8 +34,12 @@ logger = logging.getLogger(__name__)
 class TerminalConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.child_pid = None
-        self.fd = None
+        # Terminal session (pty and ssh child, kept for a while after a disconnect) in a
+        # broker worker or this process (`tunnels/terminal_broker.py`, `tunnels/terminal_sessions.py`)
+        self.terminal = None
+        # Binary protocol (`tunnels/terminal_protocol.py`) or JSON fallback
+        self.binary = False
+        self.text_output = terminal_protocol.TextOutput()
 
     async def connect(self):
         logger.info("WebSocket connection attempt")
@@ -40,6 +47,7 @@ class TerminalConsumer(AsyncWebsocketConsumer):
         token = None
         server_id = None
         username = None
+        session_id = None
 
         # Check for subprotocols
         if self.scope['subprotocols']:
@@ -59,6 +67,9 @@ class TerminalConsumer(AsyncWebsocketConsumer):
                     elif protocol.startswith('auth.'):
                         # Use the `auth` ticket as the subprotocol
                         subprotocol_auth = protocol
+                    elif protocol.startswith(terminal_sessions.SESSION_SUBPROTOCOL_PREFIX):
+                        # Session to reattach to (or the id to give a new one)
+                        session_id = terminal_sessions.parse_session_id(protocol)
             except Exception as e:
                 logger.error(f"Error parsing subprotocols: {e}")
                 await self.close(code=4000)
@@ -93,14 +104,15 @@ class TerminalConsumer(AsyncWebsocketConsumer):
             await self.close(code=4001)
             return
 
-        # Get reverse server port
-        reverse_port = await self.get_reverse_server_port(server_id)
+        # Get reverse server port, the gateway node it is reached through and whether sessions are recorded
+        route = await self.get_reverse_server_route(server_id)
 
         # Check if reverse_port is valid
-        if not reverse_port:
+        if not route:
             logger.error(f"Invalid server ID: {server_id}")
             await self.close(code=4002)
             return
+        reverse_port, gateway, record = route
 
         # Check if any target server usernames exist (4006 = none configured)
         has_usernames = await self.has_target_server_usernames(server_id)
@@ -119,23 +131,25 @@ class TerminalConsumer(AsyncWebsocketConsumer):
         await self.accept(subprotocol_auth)
         logger.info("WebSocket connection accepted")
 
-        # Start the SSH connection
-        if self.child_pid is None:
-            try:
-                # Fork a child process
-                self.child_pid, self.fd = pty.fork()
-                if self.child_pid == 0:  # Child process
-                    # Set TERM environment variable to xterm
-                    os.environ['TERM'] = 'xterm'
-                    # Execute the SSH command
-                    os.execlp('bash', 'bash', '-c', f'ssh {username}@reverse -p {reverse_port}')
-                else:  # Parent process
-                    asyncio.get_event_loop().add_reader(self.fd, self.forward_output)
-                logger.info("SSH connection started")
-            except Exception as e:
-                logger.error(f"Error starting SSH connection: {e}")
-                await self.close(code=4005)
-                return
+        self.binary = terminal_protocol.offered(self.scope['subprotocols'])
+
+        # Reattach to the detached session or start the SSH connection
+        terminal = terminal_broker.create_terminal(self)
+        try:
+            session_id, resumed, shared = await terminal.open(
+                session_id, user.id, SSHTarget(int(server_id), username, reverse_port, gateway.name),
+                detachable=session_id is not None or self.binary, record=record,
+            )
+            logger.info("Terminal session resumed" if resumed else "SSH connection started")
+        except Exception as e:
+            logger.error(f"Error starting SSH connection: {e}")
+            await self.close(code=4005)
+            return
+        self.terminal = terminal
+
+        if self.binary:
+            await self.send(bytes_data=terminal_protocol.hello(session=session_id, resumed=resumed, shared=shared))
+        await self.terminal.start()
 
     @sync_to_async
     def check_permissions(self, user, server_id) -> bool:
@@ -173,67 +187,192 @@ class TerminalConsumer(AsyncWebsocketConsumer):
         return ReverseServerUsernames.objects.filter(reverse_server=reverser_server).exists()
 
     @sync_to_async
-    def get_reverse_server_port(self, server_id) -> int:
+    def get_reverse_server_route(self, server_id) -> Optional[Tuple[int, Gateway, bool]]:
         # Check if the server_id is valid
         try:
             reverser_server = ReverseServerAuthorizedKeys.objects.get(id=server_id)
         except ReverseServerAuthorizedKeys.DoesNotExist:
             print(f"ReverseServerAuthorizedKeys with id {server_id} does not exist")
             return None
-        return reverser_server.reverse_port
+        return reverser_server.reverse_port, get_gateway(reverser_server.gateway), reverser_server.record_sessions
 
 
     async def disconnect(self, close_code):
-        # Gracefully terminate the child process
-        if self.child_pid:
-            try:
-                # First, try to terminate the process gently
-                os.kill(self.child_pid, signal.SIGTERM)
-                # Wait a brief period to allow for graceful shutdown
-                await asyncio.sleep(0.5)
-                # Forcefully kill if still alive
-                os.kill(self.child_pid, signal.SIGKILL)
-                os.waitpid(self.child_pid, 0)
-            except ProcessLookupError:
-                pass
-            finally:
-                # Ensure removal of reader happens before clearing fd
-                if self.fd is not None:
-                    asyncio.get_event_loop().remove_reader(self.fd)
-                self.child_pid = None
-                self.fd = None
+        terminal, self.terminal = self.terminal, None
+        if terminal is not None:
+            await terminal.release()
 
     async def receive(self, text_data=None, bytes_data=None):
         # Handle receiving input from the client (e.g., keyboard input)
-        if text_data:
+        if bytes_data:
+            try:
+                opcode, payload = terminal_protocol.decode_frame(bytes_data)
+            except terminal_protocol.ProtocolError as e:
+                logger.warning(f"Invalid terminal frame: {e}")
+                return
+            if not self.terminal:
+                return
+            if opcode == terminal_protocol.OP_DATA:
+                self.terminal.write(payload)
+            elif opcode == terminal_protocol.OP_ACK:
+                self.terminal.ack(payload)
+            elif opcode == terminal_protocol.OP_RESIZE:
+                self.terminal.resize(*payload)
+            elif opcode == terminal_protocol.OP_CONTROL and payload.get('type') == 'share':
+                # Publish to read-only viewers (`tunnels/terminal_broadcast.py`)
+                await self.terminal.share(bool(payload.get('enabled')))
+
+        elif text_data:
             data = json.loads(text_data)
             action = data.get('action')
             payload = data.get('payload')
 
             # Handle pty_input action
-            if action == 'pty_input' and self.fd:
-                os.write(self.fd, payload['input'].encode())
+            if action == 'pty_input' and self.terminal:
+                self.terminal.write(payload['input'].encode())
 
             # Handle resize action
-            if action == 'pty_resize' and self.fd:
-                # Resize the pty
-                pty_size = payload['size']
+            if action == 'pty_resize' and self.terminal:
                 # Frontend sends size as dict with keys: rows, cols, height, width
-                # Convert to struct with keys: rows, cols, x, y
-                pty_size_bytes = struct.pack('HHHH', pty_size['rows'], pty_size['cols'], pty_size['height'], pty_size['width'])
-                fcntl.ioctl(self.fd, termios.TIOCSWINSZ, pty_size_bytes)
+                pty_size = payload['size']
+                self.terminal.resize(pty_size['rows'], pty_size['cols'], pty_size['height'], pty_size['width'])
+
+            # Handle share action (read-only viewers)
+            if action == 'share' and self.terminal:
+                await self.terminal.share(bool(payload.get('enabled')))
+
+    async def send_output(self, output: bytes):
+        # Coalesced pty output (see `tunnels/terminal_output.py`)
+        if self.binary:
+            await self.send(bytes_data=terminal_protocol.encode_data(output))
+        else:
+            text = self.text_output.decode(output)
+            if text:  # Not only the start of a split character
+                await self.send(text_data=text)
+
+class TerminalWatchConsumer(AsyncWebsocketConsumer):
+    """
+    Read-only viewer of a shared terminal session (`tunnels/terminal_broadcast.py`).
+    Subprotocols: token.<base64(jwt)>, session.<id>, auth.<ticket> and optionally terminal.binary.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.group = None
+        self.binary = False
+        self.text_output = terminal_protocol.TextOutput()
+        # Output is only forwarded after the scrollback snapshot
+        self.synced = False
+        self.snapshot_timeout: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        logger.info("Terminal watch WebSocket connection attempt")
+        subprotocol_auth = None
+        token = None
+        session_id = None
+
+        if self.scope['subprotocols']:
+            try:
+                for protocol in self.scope['subprotocols']:
+                    if protocol.startswith('token.'):
+                        base64_encoded_token = protocol.split('.', 1)[1]
+                        token = base64.b64decode(base64_encoded_token).decode()
+                    elif protocol.startswith(terminal_sessions.SESSION_SUBPROTOCOL_PREFIX):
+                        session_id = terminal_sessions.parse_session_id(protocol)
+                    elif protocol.startswith('auth.'):
+                        subprotocol_auth = protocol
+            except Exception as e:
+                logger.error(f"Error parsing subprotocols: {e}")
+                await self.close(code=4000)
+                return
+
+        if not token or not session_id or not subprotocol_auth:
+            logger.error("Missing required subprotocols (token/session/auth)")
+            await self.close(code=4000)
+            return
 
-    def forward_output(self):
         try:
-            output = os.read(self.fd, 1024).decode()
-            if len(output) == 0:
-                # EOF received, meaning the shell has been exited
-                asyncio.ensure_future(self.close())
-            else:
-                asyncio.ensure_future(self.send(text_data=output))
-        except OSError:
-            # OSError can occur if the fd has been closed due to the process exiting
-            asyncio.ensure_future(self.close())
+            access_token = AccessToken(token)
+            user = await sync_to_async(User.objects.get)(id=access_token['user_id'])
+        except (InvalidToken, TokenError) as e:
+            logger.error(f"Token invalid: {e}")
+            await self.close(code=4001)
+            return
+        except User.DoesNotExist:
+            logger.error("User not found")
+            await self.close(code=4001)
+            return
+
+        share = await terminal_broadcast.aget_share(session_id)
+        if share is None:
+            logger.error(f"Terminal session [{session_id}] is not shared")
+            await self.close(code=terminal_broadcast.CLOSE_NOT_SHARED)
+            return
+        if not await self.check_permissions(user, share['server_id']):
+            logger.error(f"User [{user}] does not have access to server [{share['server_id']}]")
+            await self.close(code=4004)
+            return
+
+        await self.accept(subprotocol_auth)
+        self.binary = terminal_protocol.offered(self.scope['subprotocols'])
+        self.group = terminal_broadcast.group_name(session_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        if self.binary:
+            await self.send(bytes_data=terminal_protocol.hello(session=session_id, readonly=True))
+        # Ask the session for its scrollback
+        await self.channel_layer.send(share['channel'], {
+            'type': 'terminal.watch',
+            'reply_channel': self.channel_name,
+        })
+        self.snapshot_timeout = asyncio.create_task(self.close_without_snapshot(session_id))
+        logger.info(f"User [{user}] watching terminal session [{session_id}]")
+
+    @sync_to_async
+    def check_permissions(self, user, server_id) -> bool:
+        """Check if user has access to the tunnel"""
+        try:
+            tunnel = ReverseServerAuthorizedKeys.objects.get(id=server_id)
+            return TunnelPermissionManager.check_access(user, tunnel, TunnelPermission.VIEW)
+        except ReverseServerAuthorizedKeys.DoesNotExist:
+            return False
+
+    async def close_without_snapshot(self, session_id: str):
+        """The session never answered (e.g. its process died): it is no longer shared."""
+        await asyncio.sleep(terminal_broadcast.SNAPSHOT_TIMEOUT)
+        if not self.synced:
+            logger.error(f"Terminal session [{session_id}] sent no snapshot")
+            await self.close(code=terminal_broadcast.CLOSE_NOT_SHARED)
+
+    async def disconnect(self, close_code):
+        if self.snapshot_timeout is not None:
+            self.snapshot_timeout.cancel()
+        if self.group:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Read-only: only the owner's socket writes to the pty
+        pass
+
+    async def terminal_snapshot(self, event):
+        self.synced = True
+        if self.snapshot_timeout is not None:
+            self.snapshot_timeout.cancel()
+        if event['data']:
+            await self.send_output(event['data'])
+
+    async def terminal_output(self, event):
+        if self.synced:
+            await self.send_output(event['data'])
+
+    async def terminal_end(self, event):
+        await self.close()
+
+    async def send_output(self, output: bytes):
+        if self.binary:
+            await self.send(bytes_data=terminal_protocol.encode_data(output))
+        else:
+            text = self.text_output.decode(output)
+            if text:
+                await self.send(text_data=text)
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -308,6 +447,22 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data or "{}")
+        except json.JSONDecodeError:
+            return
+
+        # Client (re)connected or missed a status delta: send what changed since its version
+        if data.get('action') == port_status.ACTION_SYNC:
+            since = data.get('version')
+            if not isinstance(since, int) or isinstance(since, bool):
+                since = None
+            message = await sync_to_async(port_status.sync_message)(self.user.id, since)
+            await self.send(text_data=json.dumps({
+                'message': message
+            }))
+
     # Receive message from room group
     async def send_notification(self, event):
         message = event['message']
@@ -433,21 +588,23 @@ class TunnelConnectionConsumer(AsyncWebsocketConsumer):
     async def send_connection_status(self):
         """Check and send current tunnel connection status"""
         try:
-            from django.core.cache import cache
             from authorized_keys.models import ReverseServerAuthorizedKeys
+            from authorized_keys.utils import aget_port_status
+            from authorized_keys.port_probe import aget_probe
 
             reverse_server = await sync_to_async(ReverseServerAuthorizedKeys.objects.get)(id=self.tunnel_id)
             reverse_port = reverse_server.reverse_port
 
-            ports_status = cache.get("ports_status", {})
-            is_connected = ports_status.get(reverse_port, False)
+            is_connected = await aget_port_status(reverse_port)
+            probe = await aget_probe(reverse_port) if is_connected else None
 
             await self.send(text_data=json.dumps({
                 'type': 'connection_status',
                 'tunnel_id': int(self.tunnel_id),
                 'reverse_port': reverse_port,
                 'is_connected': is_connected,
-                'host_friendly_name': reverse_server.host_friendly_name
+                'host_friendly_name': reverse_server.host_friendly_name,
+                'probe': probe,
             }))
 
         except Exception as e:
@@ -511,11 +668,8 @@ class FileManagerConsumer(AsyncWebsocketConsumer):
         self.username = None
         self.user = None
         self.reverse_server = None
-        # Persistent SSH session
-        self.ssh_process = None
-        self.ssh_stdin = None
-        self.ssh_stdout = None
-        self.ssh_stderr = None
+        # Lease on the shared SSH connection to the target
+        self.connection = None
 
     async def connect(self):
         logger.info("FileManager WebSocket connection attempt")
@@ -738,15 +892,15 @@ class FileManagerConsumer(AsyncWebsocketConsumer):
         }))
 
     # Helper methods (using sync functions from web_sftp.views)
-    def execute_ssh_command(self, server, port, command):
+    def execute_ssh_command(self, target, command):
         """Execute SSH command synchronously"""
         from web_sftp.views import execute_ssh_command
-        return execute_ssh_command(server, port, command)
+        return execute_ssh_command(target, command)
 
-    def is_powershell(self, server, port):
+    def is_powershell(self, target):
         """Check if server is using PowerShell"""
         from web_sftp.views import is_powershell
-        return is_powershell(server, port)
+        return is_powershell(target)
 
     async def parse_powershell_output(self, stdout):
         """Parse PowerShell JSON output"""
@@ -823,83 +977,33 @@ class FileManagerConsumer(AsyncWebsocketConsumer):
         return f"{size_bytes:.1f} {size_names[i]}"
 
     async def initialize_ssh_session(self):
-        """Initialize persistent SSH session for file operations"""
+        """Take a lease on the shared SSH connection to the target (`services.ssh_pool`)"""
         try:
-            port = self.reverse_server.reverse_port
-            server = f"{self.username}@reverse"
-            
-            # Create SSH process with persistent connection
-            ssh_command = [
-                'ssh', 
-                '-p', str(port),
-                '-o', 'ControlMaster=yes',
-                '-o', 'ControlPath=/tmp/ssh_fm_%r@%h:%p',
-                '-o', 'ControlPersist=600',
-                '-o', 'StrictHostKeyChecking=no',
-                '-o', 'UserKnownHostsFile=/dev/null',
-                '-o', 'LogLevel=ERROR',
-                server,
-                # Keep connection alive with a simple command
-                'cat'
-            ]
-            
-            self.ssh_process = await asyncio.create_subprocess_exec(
-                *ssh_command,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            
-            logger.info(f"SSH session initialized for {server}:{port}")
-            
+            self.connection = await ssh_pool.aconnect(SSHTarget.for_tunnel(self.reverse_server, self.username))
+            logger.info(f"SSH session initialized for {self.connection.destination}:{self.reverse_server.reverse_port}")
         except Exception as e:
             logger.error(f"Failed to initialize SSH session: {e}")
             raise
 
     async def cleanup_ssh_session(self):
-        """Clean up persistent SSH session"""
-        if self.ssh_process:
+        """Give the lease on the shared SSH connection back"""
+        if self.connection:
             try:
-                # Terminate the SSH process gracefully
-                self.ssh_process.terminate()
-                try:
-                    await asyncio.wait_for(self.ssh_process.wait(), timeout=5.0)
-                except asyncio.TimeoutError:
-                    # Force kill if not terminated within 5 seconds
-                    self.ssh_process.kill()
-                    await self.ssh_process.wait()
-                
+                await self.connection.aclose()
                 logger.info("SSH session cleaned up")
-                
             except Exception as e:
                 logger.error(f"Error cleaning up SSH session: {e}")
             finally:
-                self.ssh_process = None
+                self.connection = None
 
     async def execute_ssh_command_persistent(self, command):
-        """Execute SSH command using persistent session"""
-        if not self.ssh_process:
+        """Execute SSH command as a channel of the shared connection"""
+        if not self.connection:
             raise Exception("SSH session not initialized")
-            
+
         try:
-            port = self.reverse_server.reverse_port
-            server = f"{self.username}@reverse"
-            
-            # Use SSH multiplexing to reuse the connection
-            ssh_exec_command = [
-                'ssh',
-                '-p', str(port),
-                '-o', 'ControlPath=/tmp/ssh_fm_%r@%h:%p',
-                '-o', 'StrictHostKeyChecking=no',
-                '-o', 'UserKnownHostsFile=/dev/null',
-                '-o', 'LogLevel=ERROR',
-                server,
-                command
-            ]
-            
-            # Execute command using the persistent connection
             exec_process = await asyncio.create_subprocess_exec(
-                *ssh_exec_command,
+                *self.connection.ssh_argv(command),
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE
             )
@@ -0,0 +1,75 @@
+import time
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+
+from tunnels.terminal_broker import BrokerWorker, get_workers
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the worker processes
+WORKER_CHECK_INTERVAL = 1
+
+
+def run_worker(worker: int) -> None:
+    # Forked workers inherit the broker's handlers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        asyncio.run(BrokerWorker(worker).run())
+    except KeyboardInterrupt:
+        pass
+
+
+class Command(BaseCommand):
+    help = ("Run the web terminal broker: TERMINAL_BROKER_WORKERS worker processes, each owning "
+            "the ptys and ssh children of its share of the terminals.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker', type=int, default=None,
+                            help="Run only this worker, 0 .. TERMINAL_BROKER_WORKERS - 1")
+
+    def handle(self, *args, **options):
+        if options['worker'] is not None:
+            run_worker(options['worker'])
+            return
+
+        count = get_workers()
+        if count <= 0:
+            # Terminals run inside the ASGI process; stay up so supervisord does not restart us
+            self.stdout.write("TERMINAL_BROKER_WORKERS is 0: terminals run in the ASGI process")
+            signal.pause()
+            return
+
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        # Forked: each worker is its own process (and event loop), restarted if it dies
+        context = multiprocessing.get_context("fork")
+        processes = {}
+        try:
+            while not stopping:
+                for worker in range(count):
+                    process = processes.get(worker)
+                    if process is not None and process.is_alive():
+                        continue
+                    if process is not None:
+                        logger.error(f"Terminal broker worker {worker} exited ({process.exitcode}), restarting")
+                    process = context.Process(target=run_worker, args=(worker,), name=f"terminal_broker_{worker}")
+                    process.start()
+                    processes[worker] = process
+                time.sleep(WORKER_CHECK_INTERVAL)
+        finally:
+            for process in processes.values():
+                process.terminate()
+            for process in processes.values():
+                process.join(5)
@@ -0,0 +1,110 @@
+"""
+Child process of a terminal session, managed without blocking the event loop.
+
+The command (ssh) is exec'd directly on a new pty, with no shell in
+between.  Its exit is noticed through a pidfd (Linux >= 5.3) registered with
+the event loop, falling back to polling `waitpid(WNOHANG)`, and the child
+is reaped as soon as it exits.  `terminate` sends SIGTERM, waits up to
+TERMINAL_KILL_TIMEOUT seconds for the exit and only then sends SIGKILL, so
+closing hundreds of terminals at once never stalls other consumers on the
+loop.
+"""
+import os
+import pty
+import signal
+import asyncio
+import logging
+from typing import List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.1
+
+
+def get_kill_timeout() -> float:
+    return getattr(settings, "TERMINAL_KILL_TIMEOUT", 2)
+
+
+class PtyProcess:
+    def __init__(self, argv: List[str]):
+        self.argv = argv
+        self.pid: Optional[int] = None
+        self.fd: Optional[int] = None
+        self.loop = asyncio.get_event_loop()
+        # Resolves to the exit code once the child has been reaped
+        self.exited: asyncio.Future = self.loop.create_future()
+        self.pidfd: Optional[int] = None
+
+    def spawn(self) -> int:
+        """Start the child; returns the pty master fd."""
+        self.pid, self.fd = pty.fork()
+        if self.pid == 0:  # Child process
+            try:
+                # Set TERM environment variable to xterm
+                os.environ['TERM'] = 'xterm'
+                os.execvp(self.argv[0], self.argv)
+            finally:
+                os._exit(127)
+        self.watch()
+        return self.fd
+
+    def watch(self) -> None:
+        try:
+            self.pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            # No pidfd support: poll
+            self.loop.call_later(POLL_INTERVAL, self.reap)
+            return
+        self.loop.add_reader(self.pidfd, self.reap)
+
+    def reap(self) -> None:
+        if self.exited.done():
+            return
+        try:
+            pid, status = os.waitpid(self.pid, os.WNOHANG)
+        except ChildProcessError:
+            # Reaped elsewhere
+            pid, status = self.pid, 0
+        if pid == 0:
+            if self.pidfd is None:
+                self.loop.call_later(POLL_INTERVAL, self.reap)
+            return
+        if self.pidfd is not None:
+            self.loop.remove_reader(self.pidfd)
+            os.close(self.pidfd)
+            self.pidfd = None
+        self.exited.set_result(os.waitstatus_to_exitcode(status))
+
+    def signal(self, signum: int) -> None:
+        if not self.exited.done():
+            try:
+                os.kill(self.pid, signum)
+            except ProcessLookupError:
+                pass
+
+    async def terminate(self, timeout: Optional[float] = None) -> Optional[int]:
+        """SIGTERM, then SIGKILL if the child has not exited after `timeout` seconds."""
+        timeout = timeout if timeout is not None else get_kill_timeout()
+        if self.pid is None:
+            return None
+        self.signal(signal.SIGTERM)
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.exited), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Terminal child {self.pid} ignored SIGTERM, killing it")
+        self.signal(signal.SIGKILL)
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.exited), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Terminal child {self.pid} did not exit after SIGKILL")
+            return None
+
+    def close_fd(self) -> None:
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
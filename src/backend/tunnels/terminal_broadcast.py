@@ -0,0 +1,124 @@
+"""
+Read-only viewers of a shared terminal session.
+
+The owner of a terminal session shares it (CONTROL `{"type": "share",
+"enabled": true}`, or the JSON action `share`).  From then on every chunk of
+output the session reads from its pty is published once to the channel group
+
+    terminal_watch_<session id>
+
+so any number of viewers cost one pty read plus one channel send per viewer,
+instead of an ssh connection and a shell each on the target.  Shared
+sessions are registered in Redis:
+
+    terminal_share:<session id>  {"server_id", "user_id", "username", "channel"}
+
+The entry expires after SHARE_TTL seconds unless the live session refreshes
+it, so the share of a session whose process died (broker worker or ASGI
+restart) disappears on its own instead of pointing at a dead channel.
+
+`TerminalWatchConsumer` (ws/terminal/watch/, `session.<id>` subprotocol)
+admits a viewer who has VIEW access to the session's tunnel
+(`TunnelPermissionManager.check_access`), joins the group and asks the
+session, on its own channel, for a snapshot of the scrollback.  Output
+published before the snapshot is skipped, so the viewer's stream continues
+exactly where the snapshot ends; a viewer that gets no snapshot within
+SNAPSHOT_TIMEOUT seconds is closed.  Viewers never write to the pty: only the
+owner's socket sends input.  Viewers are not flow controlled; one that falls
+behind loses output once its channel is full, without slowing the owner.
+"""
+import asyncio
+import logging
+from typing import List, Optional
+
+from channels.layers import get_channel_layer
+
+from services.redis_client import dumps, get_async_redis, loads
+
+logger = logging.getLogger(__name__)
+
+SHARE_PREFIX = "terminal_share"
+# Seconds a share stays registered without being refreshed by its session
+SHARE_TTL = 60
+# Seconds a viewer waits for the scrollback snapshot
+SNAPSHOT_TIMEOUT = 10
+# Close code of a viewer whose session is not (or no longer) shared
+CLOSE_NOT_SHARED = 4008
+
+
+def share_key(session_id: str) -> str:
+    return f"{SHARE_PREFIX}:{session_id}"
+
+
+def group_name(session_id: str) -> str:
+    return f"terminal_watch_{session_id}"
+
+
+async def aget_share(session_id: str) -> Optional[dict]:
+    return loads(await get_async_redis().get(share_key(session_id)))
+
+
+class Broadcast:
+    """Publishes the output of one `TerminalSession` to its viewers."""
+
+    def __init__(self, session):
+        self.session = session
+        self.group = group_name(session.id)
+        self.channel_layer = get_channel_layer()
+        self.channel: Optional[str] = None
+        self.tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self.channel = await self.channel_layer.new_channel()
+        await self.register()
+        self.tasks = [asyncio.create_task(self.serve()), asyncio.create_task(self.keep_registered())]
+        logger.info(f"Terminal session {self.session.id} shared")
+
+    async def register(self) -> None:
+        await get_async_redis().set(share_key(self.session.id), dumps({
+            "server_id": self.session.server_id,
+            "user_id": self.session.user_id,
+            "username": self.session.username,
+            "channel": self.channel,
+        }), ex=SHARE_TTL)
+
+    async def keep_registered(self) -> None:
+        """Refresh the share while the session lives."""
+        while True:
+            await asyncio.sleep(SHARE_TTL / 3)
+            try:
+                await self.register()
+            except Exception as e:
+                logger.warning(f"Failed to refresh the share of terminal session {self.session.id}: {e}")
+
+    async def publish(self, chunk: bytes) -> None:
+        await self.channel_layer.group_send(self.group, {"type": "terminal.output", "data": chunk})
+
+    async def serve(self) -> None:
+        """Answer viewers' snapshot requests."""
+        while True:
+            try:
+                message = await self.channel_layer.receive(self.channel)
+                if message.get("type") != "terminal.watch":
+                    continue
+                # Under the session lock: no output is published between the snapshot and the next chunk
+                async with self.session.lock:
+                    await self.channel_layer.send(message["reply_channel"], {
+                        "type": "terminal.snapshot",
+                        "data": self.session.scrollback.tail(),
+                    })
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Terminal session {self.session.id} failed to serve a viewer: {e}")
+                await asyncio.sleep(1)
+
+    async def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        try:
+            await get_async_redis().delete(share_key(self.session.id))
+            await self.channel_layer.group_send(self.group, {"type": "terminal.end"})
+        except Exception as e:
+            logger.warning(f"Failed to unshare terminal session {self.session.id}: {e}")
+        logger.info(f"Terminal session {self.session.id} no longer shared")
@@ -0,0 +1,274 @@
+"""
+Terminal broker: web terminal ptys and ssh children outside the ASGI server.
+
+Each of the TERMINAL_BROKER_WORKERS worker processes forked by
+`manage.py terminal_broker` (see supervisord.conf; `--worker <n>` runs a
+single one) owns the terminal sessions (`tunnels/terminal_sessions.py`) of
+its share of the terminals and serves them on a unix socket:
+
+    TERMINAL_BROKER_SOCKET_DIR/worker-<n>.sock
+
+A `TerminalConsumer` connects to the worker chosen by hashing the user,
+tunnel and username (so a reconnect finds its detached session) and relays
+frames of a one-byte type and a four-byte length:
+
+    consumer -> worker   OPEN (JSON), INPUT, RESIZE (!HHHH), ACK (!I), SHARE (!?)
+    worker -> consumer   OPENED (JSON), OUTPUT, CLOSE (!H close code), ERROR
+
+The ASGI process only moves bytes between the WebSocket and the socket;
+pty reads, output coalescing, scrollback and flow control (browser ACKs are
+forwarded) run in the workers, spread over the CPUs.  With
+TERMINAL_BROKER_WORKERS = 0 sessions run inside the ASGI process instead.
+"""
+import os
+import json
+import zlib
+import struct
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+from services.ssh_pool import SSHTarget
+from tunnels import terminal_sessions
+from tunnels.terminal_sessions import TerminalSession
+
+logger = logging.getLogger(__name__)
+
+MSG_OPEN = 1
+MSG_OPENED = 2
+MSG_INPUT = 3
+MSG_RESIZE = 4
+MSG_ACK = 5
+MSG_OUTPUT = 6
+MSG_CLOSE = 7
+MSG_ERROR = 8
+MSG_SHARE = 9
+
+HEADER = struct.Struct("!BI")
+RESIZE = struct.Struct("!HHHH")
+ACK = struct.Struct("!I")
+CLOSE = struct.Struct("!H")
+SHARE = struct.Struct("!?")
+# Largest frame accepted (pty reads are at most 64 KB, the scrollback a few hundred)
+MAX_FRAME = 16 * 1024 * 1024
+
+
+class BrokerError(Exception):
+    pass
+
+
+def get_workers() -> int:
+    return getattr(settings, "TERMINAL_BROKER_WORKERS", 4)
+
+
+def get_socket_dir() -> str:
+    return getattr(settings, "TERMINAL_BROKER_SOCKET_DIR", "/tmp/telepy-terminal-broker")
+
+
+def socket_path(worker: int) -> str:
+    return os.path.join(get_socket_dir(), f"worker-{worker}.sock")
+
+
+def choose_worker(user_id: int, server_id: int, username: str) -> int:
+    return zlib.crc32(f"{user_id}:{server_id}:{username}".encode()) % get_workers()
+
+
+def write_message(writer: asyncio.StreamWriter, kind: int, payload: bytes = b"") -> None:
+    writer.write(HEADER.pack(kind, len(payload)) + payload)
+
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """Raises `asyncio.IncompleteReadError` when the peer is gone."""
+    kind, size = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if size > MAX_FRAME:
+        raise BrokerError(f"frame too large ({size} bytes)")
+    return kind, await reader.readexactly(size) if size else b""
+
+
+async def share_session(session: TerminalSession, enabled: bool) -> None:
+    try:
+        await session.share(enabled)
+    except Exception as e:
+        logger.error(f"Failed to share terminal session {session.id}: {e}")
+
+
+class BrokerPeer:
+    """Worker-side stand-in for the `TerminalConsumer` of a session."""
+
+    def __init__(self, writer: asyncio.StreamWriter, binary: bool):
+        self.writer = writer
+        self.binary = binary
+
+    async def send_output(self, output: bytes) -> None:
+        write_message(self.writer, MSG_OUTPUT, output)
+        # A consumer that stops reading holds back the session's pump
+        await self.writer.drain()
+
+    async def close(self, code: int = 1000) -> None:
+        try:
+            write_message(self.writer, MSG_CLOSE, CLOSE.pack(code))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+
+
+class BrokerWorker:
+    def __init__(self, worker: int):
+        self.worker = worker
+        self.path = socket_path(worker)
+
+    async def run(self) -> None:
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self.handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        logger.info(f"Terminal broker worker {self.worker} listening on {self.path}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = peer = None
+        try:
+            kind, payload = await read_message(reader)
+            if kind != MSG_OPEN:
+                raise BrokerError(f"expected OPEN, got {kind}")
+            request = json.loads(payload)
+            peer = BrokerPeer(writer, request["binary"])
+            session, resumed = await terminal_sessions.open_session(
+                request["session_id"], request["user_id"], SSHTarget(**request["target"]), request["detachable"],
+                request.get("record", False),
+            )
+            write_message(writer, MSG_OPENED, json.dumps({
+                "session": session.id, "resumed": resumed, "shared": session.broadcast is not None,
+            }).encode())
+            await session.attach(peer)
+
+            while True:
+                kind, payload = await read_message(reader)
+                if kind == MSG_INPUT:
+                    session.write(payload)
+                elif kind == MSG_RESIZE:
+                    session.resize(*RESIZE.unpack(payload))
+                elif kind == MSG_ACK:
+                    session.pump.ack(ACK.unpack(payload)[0])
+                elif kind == MSG_SHARE:
+                    await share_session(session, SHARE.unpack(payload)[0])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Terminal broker connection failed: {e}")
+            if session is None:
+                write_message(writer, MSG_ERROR, str(e).encode())
+        finally:
+            if session is not None:
+                await session.release(peer)
+            writer.close()
+
+
+class LocalTerminal:
+    """A consumer's terminal session running in the ASGI process (no broker)."""
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.session: Optional[TerminalSession] = None
+
+    async def open(self, session_id: Optional[str], user_id: int, target: SSHTarget,
+                   detachable: bool, record: bool = False) -> Tuple[str, bool, bool]:
+        self.session, resumed = await terminal_sessions.open_session(session_id, user_id, target, detachable, record)
+        return self.session.id, resumed, self.session.broadcast is not None
+
+    async def start(self) -> None:
+        await self.session.attach(self.consumer)
+
+    def write(self, data: bytes) -> None:
+        self.session.write(data)
+
+    def resize(self, rows: int, cols: int, height: int, width: int) -> None:
+        self.session.resize(rows, cols, height, width)
+
+    def ack(self, size: int) -> None:
+        self.session.pump.ack(size)
+
+    async def share(self, enabled: bool) -> None:
+        await share_session(self.session, enabled)
+
+    async def release(self) -> None:
+        await self.session.release(self.consumer)
+
+
+class BrokerTerminal:
+    """A consumer's terminal session running in a broker worker."""
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.relay: Optional[asyncio.Task] = None
+
+    async def open(self, session_id: Optional[str], user_id: int, target: SSHTarget,
+                   detachable: bool, record: bool = False) -> Tuple[str, bool, bool]:
+        worker = choose_worker(user_id, target.server_id, target.username)
+        path = socket_path(worker)
+        try:
+            self.reader, self.writer = await asyncio.open_unix_connection(path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            logger.error(f"Terminal broker worker {worker} is not running (no socket at {path}): "
+                         f"is `manage.py terminal_broker` running with TERMINAL_BROKER_WORKERS = {get_workers()}?")
+            raise BrokerError(f"terminal broker worker {worker} is not running") from e
+        write_message(self.writer, MSG_OPEN, json.dumps({
+            "session_id": session_id,
+            "user_id": user_id,
+            "target": target.to_dict(),
+            "detachable": detachable,
+            "record": record,
+            "binary": self.consumer.binary,
+        }).encode())
+        await self.writer.drain()
+        kind, payload = await read_message(self.reader)
+        if kind != MSG_OPENED:
+            self.writer.close()
+            raise BrokerError(payload.decode(errors="replace") or f"unexpected reply {kind}")
+        opened = json.loads(payload)
+        return opened["session"], opened["resumed"], opened.get("shared", False)
+
+    async def start(self) -> None:
+        self.relay = asyncio.create_task(self.relay_output())
+
+    async def relay_output(self) -> None:
+        code = 1000
+        try:
+            while True:
+                kind, payload = await read_message(self.reader)
+                if kind == MSG_OUTPUT:
+                    await self.consumer.send_output(payload)
+                elif kind == MSG_CLOSE:
+                    code = CLOSE.unpack(payload)[0]
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning("Terminal broker connection lost")
+        await self.consumer.close(code=code)
+
+    def write(self, data: bytes) -> None:
+        write_message(self.writer, MSG_INPUT, data)
+
+    def resize(self, rows: int, cols: int, height: int, width: int) -> None:
+        write_message(self.writer, MSG_RESIZE, RESIZE.pack(rows, cols, height, width))
+
+    def ack(self, size: int) -> None:
+        write_message(self.writer, MSG_ACK, ACK.pack(size))
+
+    async def share(self, enabled: bool) -> None:
+        write_message(self.writer, MSG_SHARE, SHARE.pack(enabled))
+
+    async def release(self) -> None:
+        # The worker detaches or closes the session when the socket closes
+        if self.relay is not None and self.relay is not asyncio.current_task():
+            self.relay.cancel()
+        self.writer.close()
+
+
+def create_terminal(consumer):
+    return BrokerTerminal(consumer) if get_workers() > 0 else LocalTerminal(consumer)
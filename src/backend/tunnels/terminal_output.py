@@ -0,0 +1,178 @@
+"""
+Coalesced, flow-controlled forwarding of a terminal's pty output.
+
+Reading the pty in small slices and sending one frame per read turns a
+`cat` of a large file into tens of thousands of tiny frames and tasks per
+second.  `OutputPump` drains everything readable into a buffer and flushes
+it as one frame when either
+
+    - the buffer reaches TERMINAL_OUTPUT_FLUSH_BYTES, or
+    - TERMINAL_OUTPUT_FLUSH_DELAY seconds passed since its first byte.
+
+The delay is a few milliseconds, well below what a typist notices, so an
+echoed keystroke still arrives immediately while bulk output is batched.
+Frames are sent in order by a single writer task.
+
+Flow control: the output not yet delivered — buffered, queued, being sent
+and, for clients that acknowledge what they have rendered (binary protocol
+ACK frames), sent but unacknowledged — is capped.  Above
+TERMINAL_OUTPUT_HIGH_WATER bytes the pump stops reading the pty until it
+drops below TERMINAL_OUTPUT_LOW_WATER, so a slow client makes the remote
+program block on a full pty instead of growing the backend's memory.
+"""
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 65536
+
+
+def get_flush_bytes() -> int:
+    return getattr(settings, "TERMINAL_OUTPUT_FLUSH_BYTES", 32768)
+
+
+def get_flush_delay() -> float:
+    return getattr(settings, "TERMINAL_OUTPUT_FLUSH_DELAY", 0.005)
+
+
+def get_high_water() -> int:
+    return getattr(settings, "TERMINAL_OUTPUT_HIGH_WATER", 262144)
+
+
+def get_low_water() -> int:
+    return getattr(settings, "TERMINAL_OUTPUT_LOW_WATER", 65536)
+
+
+class OutputPump:
+    """Read a pty fd on the event loop and send its output in coalesced chunks."""
+
+    def __init__(self, fd: int, send: Callable[[bytes], Awaitable[None]],
+                 on_eof: Callable[[], Awaitable[None]],
+                 flush_bytes: Optional[int] = None, flush_delay: Optional[float] = None,
+                 high_water: Optional[int] = None, low_water: Optional[int] = None):
+        self.fd = fd
+        self.send = send
+        self.on_eof = on_eof
+        self.flush_bytes = flush_bytes if flush_bytes is not None else get_flush_bytes()
+        self.flush_delay = flush_delay if flush_delay is not None else get_flush_delay()
+        self.high_water = high_water if high_water is not None else get_high_water()
+        self.low_water = low_water if low_water is not None else get_low_water()
+        self.loop = asyncio.get_event_loop()
+        self.buffer = bytearray()
+        self.chunks: Deque[bytes] = deque()
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.writer: Optional[asyncio.Task] = None
+        # Bytes read but not yet sent, and sent but not yet acknowledged
+        self.pending = 0
+        self.unacked = 0
+        self.reading = False
+        self.paused = False
+        self.closed = False
+
+    @property
+    def outstanding(self) -> int:
+        return self.pending + self.unacked
+
+    def start(self) -> None:
+        self.loop.add_reader(self.fd, self.on_readable)
+        self.reading = True
+
+    def stop(self) -> None:
+        """Stop reading and drop unsent output (the terminal is going away)."""
+        self.closed = True
+        self._remove_reader()
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.buffer.clear()
+        self.chunks.clear()
+
+    def _remove_reader(self) -> None:
+        if self.reading:
+            self.loop.remove_reader(self.fd)
+            self.reading = False
+
+    def pause(self) -> None:
+        if self.reading and not self.paused:
+            self._remove_reader()
+            self.paused = True
+            logger.debug("Terminal output paused | outstanding=%d", self.outstanding)
+
+    def maybe_resume(self) -> None:
+        if self.paused and not self.closed and self.outstanding < self.low_water:
+            self.paused = False
+            self.start()
+
+    def expect_ack(self, size: int) -> None:
+        """`size` sent bytes count until the client acknowledges them."""
+        self.unacked += size
+
+    def ack(self, size: int) -> None:
+        self.unacked = max(0, self.unacked - size)
+        self.maybe_resume()
+
+    def reset_acks(self) -> None:
+        """Forget unacknowledged bytes (the client went away)."""
+        self.unacked = 0
+        self.maybe_resume()
+
+    def on_readable(self) -> None:
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except OSError:
+            # The fd is closed once the child exits (EIO on Linux)
+            data = b""
+        if not data:
+            self.finish()
+            return
+
+        self.buffer += data
+        self.pending += len(data)
+        if len(self.buffer) >= self.flush_bytes:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(self.flush_delay, self.flush)
+        if self.outstanding >= self.high_water:
+            self.pause()
+
+    def flush(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.buffer or self.closed:
+            return
+        self.chunks.append(bytes(self.buffer))
+        self.buffer.clear()
+        if self.writer is None:
+            self.writer = self.loop.create_task(self.write())
+
+    async def write(self) -> None:
+        try:
+            while self.chunks:
+                chunk = self.chunks.popleft()
+                try:
+                    await self.send(chunk)
+                finally:
+                    self.pending -= len(chunk)
+                self.maybe_resume()
+        except Exception as e:
+            logger.error("Terminal output send failed: %s", e)
+        finally:
+            self.writer = None
+
+    def finish(self) -> None:
+        """EOF: send what is left, then let the owner close."""
+        self._remove_reader()
+        self.flush()
+        self.loop.create_task(self._finish())
+
+    async def _finish(self) -> None:
+        while self.writer is not None:
+            await asyncio.shield(self.writer)
+        await self.on_eof()
@@ -0,0 +1,101 @@
+"""
+Binary WebSocket protocol of the web terminal.
+
+A client opts in by offering the `terminal.binary` subprotocol (next to the
+token/server/username/auth ones).  The server then sends a hello control
+frame right after accepting; from then on both sides may send binary frames
+made of a one-byte opcode and a payload:
+
+    0x00  DATA     raw pty bytes (input from the client, output to it)
+    0x01  RESIZE   rows, cols, height, width as four big-endian uint16
+    0x02  CONTROL  UTF-8 JSON, e.g. {"type": "hello", "version": 1}
+    0x03  ACK      big-endian uint32: DATA bytes the client has rendered
+
+The owner's client may send the CONTROL `{"type": "share", "enabled": true}`
+to publish its session to read-only viewers (`tunnels/terminal_broadcast.py`).
+
+Binary clients acknowledge the output they have written to the terminal;
+the server stops reading the pty while too much is unacknowledged (see
+`tunnels/terminal_output.py`).
+
+Keystrokes and output therefore never go through JSON, and output is not
+decoded and re-encoded as text.  Clients that do not offer the subprotocol
+(or send before the hello) keep the JSON protocol: `pty_input` /
+`pty_resize` text frames in, text output frames (decoded with an incremental
+UTF-8 decoder, so characters split across reads stay intact) out.
+"""
+import json
+import struct
+import codecs
+from typing import Optional, Tuple
+
+BINARY_SUBPROTOCOL = "terminal.binary"
+PROTOCOL_VERSION = 1
+
+OP_DATA = 0x00
+OP_RESIZE = 0x01
+OP_CONTROL = 0x02
+OP_ACK = 0x03
+
+DATA_HEADER = bytes([OP_DATA])
+RESIZE_FORMAT = "!HHHH"
+ACK_FORMAT = "!I"
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_data(data: bytes) -> bytes:
+    return DATA_HEADER + data
+
+
+def encode_control(message: dict) -> bytes:
+    return bytes([OP_CONTROL]) + json.dumps(message).encode()
+
+
+def hello(**details) -> bytes:
+    return encode_control({"type": "hello", "version": PROTOCOL_VERSION, **details})
+
+
+def decode_frame(frame: bytes) -> Tuple[int, object]:
+    """
+    Split a client frame into its opcode and decoded payload.
+
+    Returns:
+    - (OP_DATA, bytes), (OP_RESIZE, (rows, cols, height, width)), (OP_CONTROL, dict)
+      or (OP_ACK, int)
+    """
+    if not frame:
+        raise ProtocolError("empty frame")
+    opcode, payload = frame[0], memoryview(frame)[1:]
+    if opcode == OP_DATA:
+        return opcode, payload.tobytes()
+    if opcode == OP_RESIZE:
+        if len(payload) != struct.calcsize(RESIZE_FORMAT):
+            raise ProtocolError("bad resize frame")
+        return opcode, struct.unpack(RESIZE_FORMAT, payload)
+    if opcode == OP_ACK:
+        if len(payload) != struct.calcsize(ACK_FORMAT):
+            raise ProtocolError("bad ack frame")
+        return opcode, struct.unpack(ACK_FORMAT, payload)[0]
+    if opcode == OP_CONTROL:
+        try:
+            return opcode, json.loads(payload.tobytes())
+        except ValueError as e:
+            raise ProtocolError(f"bad control frame ({e})")
+    raise ProtocolError(f"unknown opcode {opcode}")
+
+
+class TextOutput:
+    """Decode pty output for JSON-protocol clients without splitting characters."""
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def decode(self, data: bytes, final: bool = False) -> str:
+        return self.decoder.decode(data, final)
+
+
+def offered(subprotocols: Optional[list]) -> bool:
+    return BINARY_SUBPROTOCOL in (subprotocols or [])
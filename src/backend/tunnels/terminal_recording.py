@@ -0,0 +1,415 @@
+"""
+Recordings of web terminal sessions, for audit.
+
+Every terminal session opened on a tunnel with `record_sessions` set is
+recorded: its output ("o"), input ("i") and resizes ("r") are written with
+their time as asciicast v2 (https://docs.asciinema.org/manual/asciicast/v2/),
+compressed with gzip:
+
+    <TERMINAL_RECORDING_DIR>/<tunnel id>/<session id>.<part>.cast.gz
+
+Input is recorded as typed, including anything typed at a password prompt.
+
+A session only appends its events to a bounded in-memory queue, so recording
+neither blocks the event loop nor waits for the disk.  One writer thread per
+process drains the queue and writes the events of each recording in a batch
+with a single write, flushing the files at most every
+TERMINAL_RECORDING_FLUSH_INTERVAL seconds.  When more than
+TERMINAL_RECORDING_QUEUE_SIZE events are waiting, further events are dropped
+and the recording gets a marker event ("m") saying how many were lost.
+
+- rotation: a part is closed once its compressed size reaches
+  TERMINAL_RECORDING_MAX_BYTES, and the next part starts with a header of its
+  own, so every part plays on its own.
+- retention: parts older than TERMINAL_RECORDING_RETENTION_DAYS (0 keeps
+  them forever) are deleted hourly by the writer and by the port monitor
+  (`authorized_keys/port_monitor.py`), so retention holds even when no
+  session is being recorded.  Parts being written are kept: the writer skips
+  its open parts and their flushes keep their mtime recent.
+
+`iter_recording` streams a part back decompressed, a chunk at a time
+(see `TerminalRecordingView`).
+"""
+import os
+import re
+import gzip
+import json
+import shutil
+import time
+import zlib
+import atexit
+import codecs
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".cast.gz"
+FILE_PATTERN = re.compile(r"^(?P<session>[A-Za-z0-9_-]{16,64})\.(?P<part>\d+)\.cast\.gz$")
+# Seconds between two retention sweeps
+RETENTION_INTERVAL = 3600
+READ_CHUNK_BYTES = 65536
+# Headers are a single short line
+MAX_HEADER_BYTES = 4096
+
+_writer_lock = threading.Lock()
+_writer: Optional["RecordingWriter"] = None
+
+
+def get_recording_dir() -> str:
+    return str(getattr(settings, "TERMINAL_RECORDING_DIR", settings.DATA_DIR / "recordings"))
+
+
+def get_max_bytes() -> int:
+    return getattr(settings, "TERMINAL_RECORDING_MAX_BYTES", 16 * 1024 * 1024)
+
+
+def get_retention_days() -> float:
+    return getattr(settings, "TERMINAL_RECORDING_RETENTION_DAYS", 90)
+
+
+def get_queue_size() -> int:
+    return getattr(settings, "TERMINAL_RECORDING_QUEUE_SIZE", 4096)
+
+
+def get_flush_interval() -> float:
+    return getattr(settings, "TERMINAL_RECORDING_FLUSH_INTERVAL", 1.0)
+
+
+def tunnel_dir(server_id: int) -> str:
+    return os.path.join(get_recording_dir(), str(server_id))
+
+
+def recording_path(server_id: int, session_id: str, part: int) -> str:
+    return os.path.join(tunnel_dir(server_id), f"{session_id}.{part}{SUFFIX}")
+
+
+def delete_recordings(server_id: int) -> None:
+    """Delete the recordings of a deleted tunnel."""
+    shutil.rmtree(tunnel_dir(server_id), ignore_errors=True)
+
+
+class Recorder:
+    """
+    The recording of one terminal session.
+
+    Its public methods are called on the event loop and only enqueue; the rest
+    of its state belongs to the writer thread.
+    """
+
+    def __init__(self, session_id: str, server_id: int, user_id: int, username: str):
+        self.session_id = session_id
+        self.server_id = server_id
+        self.user_id = user_id
+        self.username = username
+        self.writer = get_writer()
+        self.dropped = 0
+        self.closed = False
+
+        # Writer thread only
+        self.size: Tuple[int, int] = (80, 24)
+        self.part = -1
+        self.path: Optional[str] = None
+        self.raw = None
+        self.file: Optional[gzip.GzipFile] = None
+        self.started = 0.0
+        self.decoders = {}
+        self.lost = 0
+
+    def output(self, data: bytes) -> None:
+        self.put("o", data)
+
+    def input(self, data: bytes) -> None:
+        self.put("i", data)
+
+    def resize(self, cols: int, rows: int) -> None:
+        self.put("r", (cols, rows))
+
+    def put(self, kind: str, data) -> None:
+        if self.closed:
+            return
+        if not self.writer.put((self, time.monotonic(), kind, data)):
+            self.dropped += 1
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.put((self, time.monotonic(), "close", None), force=True)
+
+    # -------- Writer thread --------
+
+    def open_part(self, at: float) -> None:
+        os.makedirs(tunnel_dir(self.server_id), mode=0o700, exist_ok=True)
+        # A client may reuse the id of an ended session: continue its numbering
+        self.part += 1
+        while os.path.exists(recording_path(self.server_id, self.session_id, self.part)):
+            self.part += 1
+        self.path = path = recording_path(self.server_id, self.session_id, self.part)
+        self.raw = open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb")
+        self.file = gzip.GzipFile(fileobj=self.raw, mode="wb")
+        self.started = at
+        cols, rows = self.size
+        header = {
+            "version": 2,
+            "width": cols,
+            "height": rows,
+            "timestamp": int(time.time() - (time.monotonic() - at)),
+            "title": f"{self.username}@{self.server_id}",
+            "env": {"TERM": "xterm-256color"},
+            "telepy": {
+                "session": self.session_id,
+                "part": self.part,
+                "server_id": self.server_id,
+                "user_id": self.user_id,
+                "username": self.username,
+            },
+        }
+        self.file.write((json.dumps(header) + "\n").encode())
+        logger.info(f"Recording terminal session {self.session_id} to {path}")
+
+    def close_part(self) -> None:
+        if self.file is None:
+            return
+        try:
+            self.file.close()
+        finally:
+            self.raw.close()
+            self.file = self.raw = None
+
+    def encode(self, kind: str, data, at: float) -> Optional[str]:
+        if kind == "r":
+            self.size = data
+            text = f"{data[0]}x{data[1]}"
+        else:
+            # Chunks may end in the middle of a UTF-8 character
+            decoder = self.decoders.get(kind)
+            if decoder is None:
+                decoder = self.decoders[kind] = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            text = decoder.decode(data)
+            if not text:
+                return None
+        return json.dumps([round(max(at - self.started, 0.0), 6), kind, text]) + "\n"
+
+    def write_batch(self, events: List[Tuple[float, str, object]]) -> None:
+        lines = []
+        for at, kind, data in events:
+            if self.file is None:
+                if kind == "r":
+                    # Before the first output: only the header's size
+                    self.size = data
+                    continue
+                self.open_part(at)
+            if self.lost != self.dropped:
+                lost, self.lost = self.dropped - self.lost, self.dropped
+                lines.append(json.dumps([round(max(at - self.started, 0.0), 6), "m", f"{lost} events dropped"]) + "\n")
+            line = self.encode(kind, data, at)
+            if line is not None:
+                lines.append(line)
+        if lines:
+            self.file.write("".join(lines).encode())
+            if self.raw.tell() >= get_max_bytes():
+                self.close_part()
+
+
+class RecordingWriter:
+    """The writer thread of this process and its bounded queue of events."""
+
+    def __init__(self):
+        self.events: Deque[tuple] = deque()
+        self.ready = threading.Condition()
+        self.open: Dict[int, Recorder] = {}
+        self.stopping = False
+        self.last_sweep = 0.0
+        self.thread = threading.Thread(target=self.run, name="terminal-recording-writer", daemon=True)
+
+    def put(self, event: tuple, force: bool = False) -> bool:
+        with self.ready:
+            if not force and len(self.events) >= get_queue_size():
+                return False
+            self.events.append(event)
+            if len(self.events) == 1:
+                self.ready.notify()
+        return True
+
+    def take(self) -> List[tuple]:
+        with self.ready:
+            if not self.events and not self.stopping:
+                self.ready.wait(get_flush_interval())
+            batch = list(self.events)
+            self.events.clear()
+        return batch
+
+    def run(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            batch = self.take()
+            try:
+                self.write(batch)
+                now = time.monotonic()
+                if now - last_flush >= get_flush_interval():
+                    last_flush = now
+                    self.flush()
+                if now - self.last_sweep >= RETENTION_INTERVAL:
+                    self.last_sweep = now
+                    self.sweep()
+            except Exception as e:
+                logger.error(f"Terminal recording writer failed: {e}")
+            if self.stopping and not batch:
+                return
+
+    def write(self, batch: List[tuple]) -> None:
+        # Events of each recording, in order
+        grouped: Dict[int, Tuple[Recorder, list]] = {}
+        for recorder, at, kind, data in batch:
+            grouped.setdefault(id(recorder), (recorder, []))[1].append((at, kind, data))
+        for recorder, events in grouped.values():
+            closing = events[-1][1] == "close"
+            if closing:
+                events.pop()
+            try:
+                recorder.write_batch(events)
+            except OSError as e:
+                logger.error(f"Failed to record terminal session {recorder.session_id}: {e}")
+                recorder.close_part()
+            if closing:
+                recorder.close_part()
+                self.open.pop(id(recorder), None)
+            elif recorder.file is not None:
+                self.open[id(recorder)] = recorder
+            else:
+                # Rotated: the next part opens with the next event
+                self.open.pop(id(recorder), None)
+
+    def flush(self) -> None:
+        for recorder in self.open.values():
+            try:
+                recorder.file.flush()
+            except OSError as e:
+                logger.error(f"Failed to flush the recording of terminal session {recorder.session_id}: {e}")
+
+    def sweep(self) -> None:
+        delete_expired({recorder.path for recorder in self.open.values()})
+
+    def stop(self) -> None:
+        with self.ready:
+            self.stopping = True
+            self.ready.notify()
+        self.thread.join(timeout=5)
+        for recorder in list(self.open.values()):
+            recorder.close_part()
+
+
+def get_writer() -> RecordingWriter:
+    """This process's writer (started once)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.thread.is_alive():
+            _writer = RecordingWriter()
+            _writer.thread.start()
+            atexit.register(_writer.stop)
+        return _writer
+
+
+def iter_recording_files(server_id: Optional[int] = None) -> Iterator[Tuple[int, str, str]]:
+    """(tunnel id, file name, path) of the recorded parts, of one tunnel or all."""
+    root = get_recording_dir()
+    try:
+        tunnels = [str(server_id)] if server_id is not None else os.listdir(root)
+    except FileNotFoundError:
+        return
+    for tunnel in tunnels:
+        if not tunnel.isdigit():
+            continue
+        try:
+            names = os.listdir(os.path.join(root, tunnel))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for name in names:
+            if FILE_PATTERN.match(name):
+                yield int(tunnel), name, os.path.join(root, tunnel, name)
+
+
+def delete_expired(in_use: Set[str] = frozenset()) -> int:
+    """Delete the parts older than the retention period. Returns how many were deleted."""
+    days = get_retention_days()
+    if days <= 0:
+        return 0
+    deadline = time.time() - days * 86400
+    deleted = 0
+    for server_id, name, path in iter_recording_files():
+        try:
+            if path not in in_use and os.path.getmtime(path) < deadline:
+                os.unlink(path)
+                deleted += 1
+                logger.info(f"Deleted expired terminal recording {path}")
+        except OSError:
+            pass
+    return deleted
+
+
+def read_header(path: str) -> Optional[dict]:
+    header = b""
+    try:
+        for chunk in iter_recording(path):
+            header += chunk
+            if b"\n" in header or len(header) >= MAX_HEADER_BYTES:
+                break
+        return json.loads(header.split(b"\n", 1)[0])
+    except (OSError, zlib.error, ValueError):
+        return None
+
+
+def list_recordings(server_id: int) -> List[dict]:
+    """The recorded parts of a tunnel, newest first."""
+    recordings = []
+    for _, name, path in iter_recording_files(server_id):
+        match = FILE_PATTERN.match(name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        header = read_header(path) or {}
+        info = header.get("telepy", {})
+        recordings.append({
+            "session": match["session"],
+            "part": int(match["part"]),
+            "size": stat.st_size,
+            "started_at": header.get("timestamp"),
+            "updated_at": int(stat.st_mtime),
+            "user_id": info.get("user_id"),
+            "username": info.get("username"),
+        })
+    recordings.sort(key=lambda recording: (recording["updated_at"], recording["part"]), reverse=True)
+    return recordings
+
+
+def find_recording(server_id: int, session_id: str, part: int) -> Optional[str]:
+    """Path of a recorded part, or None (also for ids that are not session ids)."""
+    path = recording_path(server_id, session_id, part)
+    if not FILE_PATTERN.match(os.path.basename(path)) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def iter_recording(path: str) -> Iterator[bytes]:
+    """
+    The asciicast of a part, decompressed a chunk at a time.
+
+    A part still being written ends with what was flushed so far.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    with open(path, "rb") as f:
+        while not decompressor.eof:
+            compressed = f.read(READ_CHUNK_BYTES)
+            if not compressed:
+                return
+            # At most READ_CHUNK_BYTES at a time, however well the output compressed
+            data = decompressor.decompress(compressed, READ_CHUNK_BYTES)
+            while data:
+                yield data
+                data = decompressor.decompress(decompressor.unconsumed_tail, READ_CHUNK_BYTES)
@@ -0,0 +1,258 @@
+"""
+Detachable web terminal sessions.
+
+A terminal session owns the pty and the ssh child of a web terminal, a
+channel of the shared SSH connection to the target (`services.ssh_pool`,
+held until the session closes).  When
+its WebSocket drops, the session is detached instead of killed: the pty
+stays open for TERMINAL_SESSION_GRACE seconds and its output keeps going to
+a ring buffer of the last TERMINAL_SCROLLBACK_BYTES bytes.  A client that
+reconnects within the grace period with the same session id (the
+`session.<id>` subprotocol, kept by the browser per tunnel and username)
+reattaches to the same pty: it receives the buffered tail at once and no new
+SSH connection is made through the reverse tunnel.
+
+A session is only resumed by the user, tunnel and username that opened it.
+Reattaching from a second socket takes the session over; the first one is
+closed with code 4007.  The owner may also share the session with read-only
+viewers (`tunnels/terminal_broadcast.py`).  Sessions on tunnels with
+`record_sessions` set are recorded (`tunnels/terminal_recording.py`).  Sessions live in a terminal broker worker
+(`tunnels/terminal_broker.py`), or in the ASGI process without a broker.
+"""
+import os
+import re
+import uuid
+import fcntl
+import struct
+import termios
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from django.conf import settings
+
+from services import ssh_pool
+from services.ssh_pool import SSHConnection, SSHTarget
+from tunnels.pty_process import PtyProcess
+from tunnels.terminal_broadcast import Broadcast
+from tunnels.terminal_output import OutputPump
+from tunnels.terminal_recording import Recorder
+
+logger = logging.getLogger(__name__)
+
+SESSION_SUBPROTOCOL_PREFIX = "session."
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+# Close code of a socket whose session was attached to another socket
+CLOSE_TAKEN_OVER = 4007
+
+_sessions: Dict[str, "TerminalSession"] = {}
+
+
+def get_grace() -> float:
+    return getattr(settings, "TERMINAL_SESSION_GRACE", 300)
+
+
+def get_scrollback_bytes() -> int:
+    return getattr(settings, "TERMINAL_SCROLLBACK_BYTES", 262144)
+
+
+class Scrollback:
+    """Ring buffer keeping the last `limit` bytes of output."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.chunks: Deque[bytes] = deque()
+        self.size = 0
+
+    def append(self, data: bytes) -> None:
+        if self.limit <= 0:
+            return
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size > self.limit:
+            excess = self.size - self.limit
+            head = self.chunks[0]
+            if len(head) <= excess:
+                self.chunks.popleft()
+                self.size -= len(head)
+            else:
+                self.chunks[0] = head[excess:]
+                self.size -= excess
+
+    def tail(self) -> bytes:
+        data = b"".join(self.chunks)
+        # Do not start in the middle of a UTF-8 character
+        start = 0
+        while start < min(len(data), 3) and 0x80 <= data[start] < 0xC0:
+            start += 1
+        return data[start:]
+
+
+class TerminalSession:
+    def __init__(self, session_id: str, user_id: int, target: SSHTarget, detachable: bool, record: bool = False):
+        self.id = session_id
+        self.user_id = user_id
+        self.target = target
+        self.server_id = target.server_id
+        self.username = target.username
+        # False when the client cannot know the id (nothing could reattach)
+        self.detachable = detachable
+        self.connection: Optional[SSHConnection] = None
+        self.process: Optional[PtyProcess] = None
+        self.fd: Optional[int] = None
+        self.pump: Optional[OutputPump] = None
+        self.consumer = None
+        # Set while the session is shared with viewers
+        self.broadcast: Optional[Broadcast] = None
+        self.recorder: Optional[Recorder] = None
+        if record:
+            self.recorder = Recorder(session_id, self.server_id, user_id, self.username)
+        self.scrollback = Scrollback(get_scrollback_bytes())
+        self.lock = asyncio.Lock()
+        self.expiry: Optional[asyncio.TimerHandle] = None
+        self.closed = False
+
+    def owned_by(self, user_id: int, server_id: int, username: str) -> bool:
+        return (self.user_id, self.server_id, self.username) == (user_id, server_id, username)
+
+    async def spawn(self) -> None:
+        # Execute the SSH command on a new pty, over the shared connection
+        self.connection = await ssh_pool.aconnect(self.target)
+        self.process = PtyProcess(self.connection.ssh_argv())
+        self.fd = self.process.spawn()
+        self.pump = OutputPump(self.fd, self.deliver, self.on_eof)
+        self.pump.start()
+
+    def write(self, data: bytes) -> None:
+        os.write(self.fd, data)
+        if self.recorder is not None:
+            self.recorder.input(data)
+
+    def resize(self, rows: int, cols: int, height: int, width: int) -> None:
+        # Convert to struct with keys: rows, cols, x, y
+        pty_size_bytes = struct.pack('HHHH', rows, cols, height, width)
+        fcntl.ioctl(self.fd, termios.TIOCSWINSZ, pty_size_bytes)
+        if self.recorder is not None:
+            self.recorder.resize(cols, rows)
+
+    async def deliver(self, chunk: bytes) -> None:
+        if self.recorder is not None:
+            self.recorder.output(chunk)
+        async with self.lock:
+            self.scrollback.append(chunk)
+            consumer = self.consumer
+            if consumer is not None:
+                await consumer.send_output(chunk)
+                if consumer.binary:
+                    self.pump.expect_ack(len(chunk))
+            if self.broadcast is not None:
+                try:
+                    await self.broadcast.publish(chunk)
+                except Exception as e:
+                    logger.warning(f"Terminal session {self.id} broadcast failed: {e}")
+
+    async def attach(self, consumer) -> None:
+        """Make `consumer` the session's socket and send it the buffered tail."""
+        async with self.lock:
+            if self.expiry is not None:
+                self.expiry.cancel()
+                self.expiry = None
+            previous, self.consumer = self.consumer, consumer
+            self.pump.reset_acks()
+            tail = self.scrollback.tail()
+            if tail:
+                await consumer.send_output(tail)
+                if consumer.binary:
+                    self.pump.expect_ack(len(tail))
+        if previous is not None and previous is not consumer:
+            logger.info(f"Terminal session {self.id} taken over by another connection")
+            await previous.close(code=CLOSE_TAKEN_OVER)
+
+    async def share(self, enabled: bool) -> None:
+        """Start or stop publishing the output to read-only viewers."""
+        if enabled and self.broadcast is None and not self.closed:
+            self.broadcast = Broadcast(self)
+            await self.broadcast.start()
+        elif not enabled and self.broadcast is not None:
+            broadcast, self.broadcast = self.broadcast, None
+            await broadcast.stop()
+
+    def detach(self, consumer) -> None:
+        """The socket went away: keep the pty for the grace period."""
+        if self.consumer is not consumer or self.closed:
+            return
+        self.consumer = None
+        self.pump.reset_acks()
+        grace = get_grace()
+        self.expiry = asyncio.get_event_loop().call_later(grace, lambda: asyncio.ensure_future(self.close()))
+        logger.info(f"Terminal session {self.id} detached, kept for {grace}s")
+
+    async def release(self, consumer) -> None:
+        """`consumer` disconnected: detach if the session can be resumed, else close it."""
+        if self.detachable and get_grace() > 0:
+            self.detach(consumer)
+        elif self.consumer is consumer:
+            await self.close()
+
+    async def on_eof(self) -> None:
+        # The shell has exited: close the socket first, then reap the child
+        consumer, self.consumer = self.consumer, None
+        if consumer is not None:
+            await consumer.close()
+        await self.close()
+
+    async def close(self) -> None:
+        """Terminate the child process (SIGTERM, then SIGKILL) and release the pty."""
+        if self.closed:
+            return
+        self.closed = True
+        _sessions.pop(self.id, None)
+        if self.expiry is not None:
+            self.expiry.cancel()
+            self.expiry = None
+        await self.share(False)
+        # Ensure removal of reader happens before closing the fd
+        if self.pump is not None:
+            self.pump.stop()
+        exit_code = None
+        if self.process is not None:
+            # Without blocking the loop (see `tunnels/pty_process.py`)
+            exit_code = await self.process.terminate()
+            self.process.close_fd()
+        self.fd = None
+        if self.connection is not None:
+            await self.connection.aclose()
+        if self.recorder is not None:
+            self.recorder.close()
+        logger.info(f"Terminal session {self.id} closed (exit code {exit_code})")
+
+
+def parse_session_id(protocol: str) -> Optional[str]:
+    session_id = protocol[len(SESSION_SUBPROTOCOL_PREFIX):]
+    return session_id if SESSION_ID_PATTERN.match(session_id) else None
+
+
+async def open_session(session_id: Optional[str], user_id: int, target: SSHTarget,
+                       detachable: bool, record: bool = False) -> Tuple[TerminalSession, bool]:
+    """
+    Resume the detached session `session_id` or start a new one.
+
+    Returns:
+    - (session, resumed)
+    """
+    session = _sessions.get(session_id) if session_id else None
+    if session is not None and not session.closed and session.owned_by(user_id, target.server_id, target.username):
+        return session, True
+
+    if session_id is None or session is not None:
+        # Unknown to the client, or someone else's id
+        session_id = uuid.uuid4().hex
+    session = TerminalSession(session_id, user_id, target, detachable, record)
+    try:
+        await session.spawn()
+    except Exception:
+        await session.close()
+        raise
+    _sessions[session.id] = session
+    return session, False
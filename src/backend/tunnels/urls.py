@@ -20,6 +20,8 @@ from tunnels.views import ListSharedUsersView
 from tunnels.views import ListAvailableUsersView
 from tunnels.views import UpdateSharingPermissionView
 from tunnels.views import UpdateAllowedUsernamesView
+from tunnels.views import TerminalRecordingsView
+from tunnels.views import TerminalRecordingView
 urlpatterns = [
 
     path('index', TunnelsIndex.as_view(), name='tunnels-index'),
@@ -47,4 +49,8 @@ urlpatterns = [
     path('shared-users/<int:tunnel_id>', ListSharedUsersView.as_view(), name='list-shared-users'),
     path('available-users/<int:tunnel_id>', ListAvailableUsersView.as_view(), name='list-available-users'),
     path('share/<int:tunnel_id>/<int:user_id>/allowed-usernames', UpdateAllowedUsernamesView.as_view(), name='update-allowed-usernames'),
+
+    # Terminal session recordings
+    path('recordings/<int:server_id>', TerminalRecordingsView.as_view(), name='terminal-recordings'),
+    path('recordings/<int:server_id>/<str:session_id>/<int:part>', TerminalRecordingView.as_view(), name='terminal-recording'),
 ]
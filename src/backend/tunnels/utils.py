@@ -1,5 +1,6 @@
 from uuid import uuid4
-from django.core.cache import cache
+
+from services.redis_client import get_redis, dumps, loads
 
 SCRIPT_TOKEN_PREFIX = "script_token:"
 
@@ -7,14 +8,10 @@ SCRIPT_TOKEN_PREFIX = "script_token:"
 def issue_script_token(payload: dict, timeout_seconds: int = 600) -> str:
     """Issue a one-time script token stored in Redis with a 10-minute TTL."""
     token = uuid4().hex
-    cache.set(f"{SCRIPT_TOKEN_PREFIX}{token}", payload, timeout=timeout_seconds)
+    get_redis().set(f"{SCRIPT_TOKEN_PREFIX}{token}", dumps(payload), ex=timeout_seconds)
     return token
 
 
 def pop_script_payload(token: str) -> dict | None:
     """Read and delete a one-time script token payload (atomic one-time use)."""
-    key = f"{SCRIPT_TOKEN_PREFIX}{token}"
-    payload = cache.get(key)
-    if payload is not None:
-        cache.delete(key)
-    return payload
+    return loads(get_redis().getdel(f"{SCRIPT_TOKEN_PREFIX}{token}"))
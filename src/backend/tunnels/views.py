@@ -8,7 +8,7 @@ from django.contrib.auth.models import User
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 
 from drf_yasg.utils import swagger_auto_schema
@@ -18,6 +18,8 @@ from authorized_keys.models import ReverseServerAuthorizedKeys
 from authorized_keys.models import ReverseServerUsernames
 from tunnels.models import TunnelSharing, TunnelSharingAllowedUsername, TunnelPermissionManager, TunnelPermission
 from services.tunnel_permissions import TunnelPermissionService
+from services.gateways import get_gateway
+from tunnels.terminal_recording import find_recording, iter_recording, list_recordings
 
 
 def validate_permission_type(permission_type_str):
@@ -208,6 +210,10 @@ class ReverseServerScriptBase(APIView):
         server_auth_key = self.check_tunnel_access(server_id)
         if not server_auth_key:
             return Response({'error': 'Reverse server keys not found'}, status=404)
+        # The client connects to the gateway node the tunnel is assigned to
+        self.server_domain, self.reverse_server_ssh_port = get_gateway(server_auth_key.gateway).public_address(
+            self.server_domain, self.reverse_server_ssh_port,
+        )
         if self.script_type == ScriptType.SCRIPT:
             ssh_port = kwargs.get('ssh_port')
             if not ssh_port:
@@ -642,7 +648,9 @@ class OneTimeScriptView(APIView):
             elif match_hostname:
                 server_domain = match_hostname.group('host')
 
-        reverse_server_ssh_port = settings.REVERSE_SERVER_SSH_PORT
+        server_domain, reverse_server_ssh_port = get_gateway(tunnel.gateway).public_address(
+            server_domain, settings.REVERSE_SERVER_SSH_PORT,
+        )
 
         # Handle autossh-service username resolution
         if script_type == 'autossh-service':
@@ -1030,3 +1038,63 @@ class UpdateAllowedUsernamesView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
+
+
+# ========================================
+# Terminal recordings
+# ========================================
+
+class TerminalRecordingsView(APIView):
+    """
+    List the recorded terminal sessions of a tunnel
+    """
+    permission_classes = (IsAuthenticated,)
+
+    @swagger_auto_schema(
+        operation_summary="List Terminal Recordings",
+        operation_description="Recorded web terminal sessions of a tunnel, newest first (owner and admins only)",
+        tags=['Terminal Recordings']
+    )
+    def get(self, request, server_id):
+        try:
+            tunnel = ReverseServerAuthorizedKeys.objects.get(id=server_id)
+        except ReverseServerAuthorizedKeys.DoesNotExist:
+            return Response({'error': 'Tunnel not found'}, status=404)
+
+        if not TunnelPermissionManager.check_access(request.user, tunnel, TunnelPermission.ADMIN):
+            return Response({'error': 'You do not have permission to view recordings of this tunnel'}, status=403)
+
+        return Response({
+            'record_sessions': tunnel.record_sessions,
+            'recordings': list_recordings(tunnel.id),
+        })
+
+
+class TerminalRecordingView(APIView):
+    """
+    Stream a recorded terminal session (asciicast v2) for playback
+    """
+    permission_classes = (IsAuthenticated,)
+
+    @swagger_auto_schema(
+        operation_summary="Play Terminal Recording",
+        operation_description="Stream one part of a recorded terminal session as asciicast v2 (owner and admins only)",
+        tags=['Terminal Recordings']
+    )
+    def get(self, request, server_id, session_id, part):
+        try:
+            tunnel = ReverseServerAuthorizedKeys.objects.get(id=server_id)
+        except ReverseServerAuthorizedKeys.DoesNotExist:
+            return Response({'error': 'Tunnel not found'}, status=404)
+
+        if not TunnelPermissionManager.check_access(request.user, tunnel, TunnelPermission.ADMIN):
+            return Response({'error': 'You do not have permission to view recordings of this tunnel'}, status=403)
+
+        path = find_recording(tunnel.id, session_id, part)
+        if path is None:
+            return Response({'error': 'Recording not found'}, status=404)
+
+        # Decompressed while it is sent: the recording is never loaded in memory
+        response = StreamingHttpResponse(iter_recording(path), content_type='application/x-asciicast')
+        response['Content-Disposition'] = f'attachment; filename="{session_id}.{part}.cast"'
+        return response
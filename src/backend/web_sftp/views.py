@@ -1,6 +1,7 @@
 from typing import List, Tuple, Dict, Any, Union
 import json
 from pathlib import Path
+import shlex
 import datetime
 import tempfile
 import subprocess
@@ -19,6 +20,8 @@ from authorized_keys.models import ReverseServerAuthorizedKeys
 from authorized_keys.models import ReverseServerUsernames
 from tunnels.models import TunnelPermissionManager, TunnelPermission
 from services.tunnel_permissions import TunnelPermissionService
+from services import ssh_pool
+from services.ssh_pool import SSHConnection, SSHTarget
 
 def parse_permissions(permission_string:str) -> Dict[str, Any]:
     permissions = {
@@ -45,11 +48,12 @@ def parse_permissions(permission_string:str) -> Dict[str, Any]:
     }
     return permissions
 
-def execute_ssh_command(server:str, port:int, command:str) -> Tuple[str, str, int]:
+def execute_ssh_command(target:SSHTarget, command:str) -> Tuple[str, str, int]:
     """Executes a given command via SSH on the server and returns the output."""
-    ssh_command = f'ssh {server} -p {port} {command}'
-    process = Popen(ssh_command, shell=True, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = process.communicate()
+    with ssh_pool.connect(target) as connection:
+        ssh_command = f'{shlex.join(connection.ssh_argv())} {command}'
+        process = Popen(ssh_command, shell=True, stdout=PIPE, stderr=PIPE)
+        stdout, stderr = process.communicate()
     return stdout.decode('utf-8', errors='replace'), stderr.decode(), process.returncode
 
 def powershell_to_unix_format(ps_output) -> List[str]:
@@ -74,16 +78,16 @@ def powershell_to_unix_format(ps_output) -> List[str]:
 
     return unix_style_output
 
-def is_powershell(server:str, port:int) -> bool:
+def is_powershell(target:SSHTarget) -> bool:
     """Detects if the remote server is using PowerShell."""
     command = "'$PSVersionTable | Out-String -Width 4096'"
-    stdout, stderr, returncode = execute_ssh_command(server, port, command)
+    stdout, stderr, returncode = execute_ssh_command(target, command)
     return "PSVersion" in stdout
 
-def is_unix(server:str, port:int) -> bool:
+def is_unix(target:SSHTarget) -> bool:
     """Detects if the remote server is using a Unix-like shell."""
     command = "'uname -a'"
-    stdout, stderr, returncode = execute_ssh_command(server, port, command)
+    stdout, stderr, returncode = execute_ssh_command(target, command)
     return "Linux" in stdout
 
 
@@ -101,6 +105,11 @@ def get_tunnel_with_access(request, server_id):
     return None
 
 
+def get_ssh_target(connection:SSHConnection) -> Tuple[str, str]:
+    """Return `(ssh options, user@host)` reaching the tunnel over its shared SSH connection."""
+    return shlex.join(connection.proxy_options()), connection.destination
+
+
 def check_username_allowed(user, reverse_server, username):
     """Return True if the user is allowed to use this username on this tunnel."""
     allowed = TunnelPermissionService.get_allowed_usernames(user, reverse_server)
@@ -122,12 +131,11 @@ class ShellDetect(APIView):
         if not check_username_allowed(user, reverse_server, username):
             return Response({"error": "Username not found"}, status=400)
 
-        port = reverse_server.reverse_port
-        server = f"{username}@reverse"
+        target = SSHTarget.for_tunnel(reverse_server, username)
         try:
-            if is_powershell(server, port):
+            if is_powershell(target):
                 return Response({"shell": "powershell"})
-            if is_unix(server, port):
+            if is_unix(target):
                 return Response({"shell": "unix"})
             return Response({"shell": "unknown"})
         except Exception as e:
@@ -158,16 +166,15 @@ class ListPath(APIView):
         if not check_username_allowed(user, reverse_server, username):
             return Response({"error": "Username not found"}, status=400)
 
-        port = reverse_server.reverse_port
-        server = f"{username}@reverse"
+        target = SSHTarget.for_tunnel(reverse_server, username)
         
         path = request.query_params.get('path', '~/')
         command = f"'ls -la {path}'"
 
-        if is_powershell(server, port):
+        if is_powershell(target):
             path = request.query_params.get('path', 'C:\\')
             command = f"""'Get-ChildItem -Path "{path}" | Select-Object Mode, LastWriteTime, Length, Name | ConvertTo-Json'"""
-        stdout, stderr, returncode = execute_ssh_command(server, port, command)
+        stdout, stderr, returncode = execute_ssh_command(target, command)
       
         if returncode == 0:
 
@@ -255,47 +262,49 @@ class Download(APIView):
         if not check_username_allowed(user, reverse_server, username):
             return Response({"error": "Username not found"}, status=400)
 
-        reverse_port = reverse_server.reverse_port    
-        server = f"{username}@reverse"
-        path = request.query_params.get('path')
-
-        # Set up the base SSH command with options
-        base_ssh_cmd = f'ssh {server} -p {reverse_port}'
-
-        # Determine if path is a file or directory
-        is_dir_command = base_ssh_cmd + f" '[ -d {path} ] && echo true || echo false'"
-        process = subprocess.Popen(is_dir_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, _ = process.communicate()
-        is_directory = stdout.decode().strip() == 'true'
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            local_path = Path(tmpdir)
-            name = path.split("/")[-1]
-            if is_directory:
-                # Handle directory by creating a zip archive
-                # Copy the directory to the local machine and zip it
-                command = f'scp -P {reverse_port} -r {server}:\"{path}\" {local_path} && cd {local_path} && zip -r - ./{name} > ./{name}.zip'
-                # Add the zip extension to the local path
-                local_path = local_path / f"{name}.zip"
-            else:
-                # Handle file by directly copying
-                local_path = local_path / name
-                command = f"scp -P {reverse_port} {server}:\"{path}\" {local_path}"
-
-            result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-            if result.returncode != 0:
-                return Response({"error": "Failed to download file or directory"}, status=400)
-
-            with open(local_path, 'rb') as f:
-                file_data = f.read()
-                response = HttpResponse(file_data, content_type='application/octet-stream')
-                filename = path.split("/")[-1]
+        reverse_port = reverse_server.reverse_port
+        target = SSHTarget.for_tunnel(reverse_server, username)
+        with ssh_pool.connect(target) as connection:
+            proxy_option, server = get_ssh_target(connection)
+            path = request.query_params.get('path')
+
+            # Set up the base SSH command with options
+            base_ssh_cmd = f'ssh {proxy_option} {server} -p {reverse_port}'
+
+            # Determine if path is a file or directory
+            is_dir_command = base_ssh_cmd + f" '[ -d {path} ] && echo true || echo false'"
+            process = subprocess.Popen(is_dir_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, _ = process.communicate()
+            is_directory = stdout.decode().strip() == 'true'
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                local_path = Path(tmpdir)
+                name = path.split("/")[-1]
                 if is_directory:
-                    response['Content-Type'] = 'application/zip'
-                    filename += ".zip"
-                response['Content-Disposition'] = f'attachment; filename="{filename}"'
-                return response
+                    # Handle directory by creating a zip archive
+                    # Copy the directory to the local machine and zip it
+                    command = f'scp {proxy_option} -P {reverse_port} -r {server}:\"{path}\" {local_path} && cd {local_path} && zip -r - ./{name} > ./{name}.zip'
+                    # Add the zip extension to the local path
+                    local_path = local_path / f"{name}.zip"
+                else:
+                    # Handle file by directly copying
+                    local_path = local_path / name
+                    command = f"scp {proxy_option} -P {reverse_port} {server}:\"{path}\" {local_path}"
+
+                result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+                if result.returncode != 0:
+                    return Response({"error": "Failed to download file or directory"}, status=400)
+
+                with open(local_path, 'rb') as f:
+                    file_data = f.read()
+                    response = HttpResponse(file_data, content_type='application/octet-stream')
+                    filename = path.split("/")[-1]
+                    if is_directory:
+                        response['Content-Type'] = 'application/zip'
+                        filename += ".zip"
+                    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+                    return response
 
 class UploadFiles(APIView):
     permission_classes = (IsAuthenticated,)
@@ -331,7 +340,7 @@ class UploadFiles(APIView):
             return Response({"error": "Username not found"}, status=400)
 
         reverse_port = reverse_server.reverse_port
-        server = f"{username}@reverse"
+        target = SSHTarget.for_tunnel(reverse_server, username)
         destination_path = request.query_params.get('destination_path')
         file_obj = request.FILES.get('file')
 
@@ -345,10 +354,12 @@ class UploadFiles(APIView):
                 for chunk in file_obj.chunks():
                     temp_file.write(chunk)
 
-            # Use SCP to upload the file
-            scp_cmd = f"scp -P {reverse_port} '{temp_file_path}' {server}:\"{destination_path}\""
-            process = subprocess.Popen(scp_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            stdout, stderr = process.communicate()
+            # Use SCP to upload the file, over the shared SSH connection
+            with ssh_pool.connect(target) as connection:
+                proxy_option, server = get_ssh_target(connection)
+                scp_cmd = f"scp {proxy_option} -P {reverse_port} '{temp_file_path}' {server}:\"{destination_path}\""
+                process = subprocess.Popen(scp_cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                stdout, stderr = process.communicate()
 
             if process.returncode == 0:
                 return Response({"success": "File uploaded successfully"})
@@ -28,6 +28,7 @@ export default function TunnelsPage() {
     const {
         tunnels,
         portsMap,
+        probesMap,
         loading,
         fetchData,
         handleDelete,
@@ -47,10 +48,14 @@ export default function TunnelsPage() {
 
     const getStatus = (port: number) => {
         const isActive = portsMap[String(port)] === true;
+        const probe = isActive ? probesMap[String(port)] : undefined;
+        const degraded = probe?.degraded === true;
+        const title = probe ? (probe.ok ? `Handshake RTT ${probe.rtt_ms} ms` : `Probe failed: ${probe.error}`) : undefined;
         return (
-            <Badge variant={isActive ? "default" : "secondary"} className={`${isActive ? 'bg-success hover:bg-success/90 text-success-foreground' : ''}`}>
+            <Badge variant={isActive ? "default" : "secondary"} title={title} className={`${isActive ? (degraded ? 'bg-warning hover:bg-warning/90 text-warning-foreground' : 'bg-success hover:bg-success/90 text-success-foreground') : ''}`}>
                 <span className={`w-2.5 h-2.5 rounded-full mr-1.5 ${isActive ? "bg-white animate-pulse" : "bg-muted-foreground"}`}></span>
-                {isActive ? "Online" : "Offline"}
+                {isActive ? (degraded ? "Degraded" : "Online") : "Offline"}
+                {probe?.ok && probe.rtt_ms !== null && <span className="ml-1.5 opacity-80">{Math.round(probe.rtt_ms)} ms</span>}
             </Badge>
         );
     };
@@ -38,8 +38,9 @@ export default function TerminalPage() {
         loadingServiceKeys,
         username, setUsername,
         availableUsernames,
+        sessionId, shared,
     } = state;
-    const { fetchServiceKeys, reconnect } = actions;
+    const { fetchServiceKeys, toggleShare, reconnect } = actions;
 
     // Set initial tab from URL param (mount only)
     useEffect(() => {
@@ -110,6 +111,9 @@ export default function TerminalPage() {
                     showFiles={showFiles}
                     setShowFiles={setShowFiles}
                     isBrowserActive={isBrowserActive}
+                    canShare={connected && sessionId !== null}
+                    shared={shared}
+                    onToggleShare={toggleShare}
                     onLoadServiceKeys={fetchServiceKeys}
                 />
 
@@ -0,0 +1,86 @@
+"use client";
+
+/**
+ * 唯讀觀看共享的終端機工作階段。
+ * Read-only view of a shared terminal session.
+ */
+import React from "react";
+import { useRouter, useSearchParams } from "next/navigation";
+import { useAuth } from "@/lib/auth";
+import { Eye, X } from "lucide-react";
+import { Badge } from "@/components/ui/badge";
+import { Button } from "@/components/ui/button";
+import { Card } from "@/components/ui/card";
+import { StatusCard } from "@/components/ui/StatusCard";
+import "xterm/css/xterm.css";
+
+import { useTerminalWatch } from "@/hooks/useTerminalWatch";
+
+export default function TerminalWatchPage() {
+    const searchParams = useSearchParams();
+    const serverId = searchParams.get("serverId");
+    const sessionId = searchParams.get("session");
+    const router = useRouter();
+    const { accessToken } = useAuth();
+
+    const { terminalRef, connected, connecting, error } = useTerminalWatch(sessionId, accessToken);
+
+    if (!sessionId || !accessToken) {
+        return (
+            <StatusCard
+                title="No Session Selected"
+                message="Open the watch link shared by the owner of the terminal session."
+                icon={<Eye className="text-muted-foreground" size={20} />}
+                variant="default"
+                actionLabel="Return to Tunnels List"
+                onAction={() => router.push("/tunnels")}
+            />
+        );
+    }
+    if (error) {
+        return (
+            <StatusCard
+                title="Cannot Watch Session"
+                message={error}
+                icon={<X size={20} />}
+                variant="destructive"
+                actionLabel="Return to Tunnels List"
+                onAction={() => router.push("/tunnels")}
+            />
+        );
+    }
+
+    return (
+        <div className="flex flex-col h-[calc(100dvh-4rem)] md:h-[calc(100dvh-5rem)] w-full overflow-hidden bg-background relative">
+            <div className="flex flex-col flex-1 min-h-0 p-1 sm:p-2 md:p-4">
+                <Card className="shrink-0 mb-2 md:mb-4 rounded-lg overflow-hidden border-border/50 p-2 md:p-4">
+                    <div className="flex items-center justify-between">
+                        <div className="flex items-center gap-3">
+                            <div className="p-2 bg-primary/10 rounded-md">
+                                <Eye className="text-primary" size={18} />
+                            </div>
+                            <h1 className="text-sm md:text-base font-bold text-foreground flex items-center">
+                                Shared Terminal <Badge variant="secondary" className="ml-2 font-mono text-[10px] md:text-xs">{(serverId || "").slice(0, 8)}</Badge>
+                            </h1>
+                            <Badge variant="outline" className="text-xs">Read-only</Badge>
+                            <span className="flex h-2 w-2" title={connecting ? 'Connecting...' : connected ? 'Connected' : 'Disconnected'}>
+                                <span className={`relative inline-flex rounded-full h-2 w-2 ${connecting ? 'bg-warning animate-pulse' : connected ? 'bg-success' : 'bg-destructive'}`}></span>
+                            </span>
+                        </div>
+                        <Button
+                            variant="secondary"
+                            size="sm"
+                            onClick={() => router.push("/tunnels")}
+                            className="h-8 text-xs gap-1.5"
+                        >
+                            <X size={14} /> Close
+                        </Button>
+                    </div>
+                </Card>
+                <div className="flex-1 min-h-0 rounded-lg overflow-hidden bg-black p-2">
+                    <div ref={terminalRef} className="h-full w-full" />
+                </div>
+            </div>
+        </div>
+    );
+}
@@ -12,6 +12,7 @@ import { RemoteBrowserPanel } from "@/components/tunnels/RemoteBrowserPanel";
 import { ResizablePanelGroup, ResizablePanel, ResizableHandle } from "@/components/ui/resizable";
 import { Copy, Terminal as TerminalIcon, MonitorPlay, FolderSync, RefreshCw } from "lucide-react";
 import { TerminalMainView } from "@/lib/tunnelUrls";
+import { sendTerminalInput } from "@/lib/terminalProtocol";
 
 export interface TerminalContentProps {
     mainView: TerminalMainView;
@@ -82,8 +83,8 @@ export function TerminalContent({
     }, [showFiles, setShowFiles]);
 
     const sendInput = (input: string) => {
-        if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
-            wsRef.current.send(JSON.stringify({ action: "pty_input", payload: { input } }));
+        if (wsRef.current) {
+            sendTerminalInput(wsRef.current, input);
         }
         if (input === "\r" || input === "\n") {
             setTimeout(() => {
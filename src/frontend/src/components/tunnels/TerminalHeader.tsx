@@ -1,12 +1,12 @@
 /**
  * 終端機頁面標題列：連線狀態、使用者切換、路徑、Terminal/Browser tabs、Files toggle、Service Keys。
- * Terminal page header: connection status, username switcher, path, Terminal/Browser tabs, Files toggle, service keys.
+ * Terminal page header: connection status, username switcher, path, Terminal/Browser tabs, Files toggle, share, service keys.
  */
 import React from "react";
 import { Badge } from "@/components/ui/badge";
 import { Button } from "@/components/ui/button";
 import { Card } from "@/components/ui/card";
-import { Terminal as TerminalIcon, X, Server, KeyRound, FolderOpen, FolderSync, ChevronDown, ChevronUp, User as UserIcon, MonitorPlay } from "lucide-react";
+import { Terminal as TerminalIcon, X, Server, KeyRound, FolderOpen, FolderSync, ChevronDown, ChevronUp, User as UserIcon, MonitorPlay, Share2 } from "lucide-react";
 import { TerminalUsername } from "@/hooks/useTerminalPage";
 import { TerminalMainView } from "@/lib/tunnelUrls";
 import { useRouter } from "next/navigation";
@@ -27,6 +27,9 @@ interface TerminalHeaderProps {
     showFiles: boolean;
     setShowFiles: (show: boolean) => void;
     isBrowserActive: boolean;
+    canShare: boolean;
+    shared: boolean;
+    onToggleShare: () => void | Promise<void>;
     onLoadServiceKeys: () => void | Promise<void>;
 }
 
@@ -46,6 +49,9 @@ export function TerminalHeader({
     showFiles,
     setShowFiles,
     isBrowserActive,
+    canShare,
+    shared,
+    onToggleShare,
     onLoadServiceKeys,
 }: TerminalHeaderProps) {
     const router = useRouter();
@@ -161,6 +167,16 @@ export function TerminalHeader({
                         >
                             <FolderSync size={14} />
                         </Button>
+                        <Button
+                            variant="outline"
+                            size="sm"
+                            onClick={() => onToggleShare()}
+                            disabled={!canShare}
+                            title={shared ? "Stop sharing (viewers are disconnected)" : "Share read-only (copies the watch link)"}
+                            className={`h-8 text-xs gap-1.5 ${shared ? "bg-primary text-primary-foreground hover:bg-primary/90" : ""}`}
+                        >
+                            <Share2 size={14} /> {shared ? "Sharing" : "Share"}
+                        </Button>
                         <Button
                             variant="outline"
                             size="sm"
@@ -15,7 +15,7 @@ interface TunnelDetailsModalProps extends TunnelModalProps {
 
 export function TunnelDetailsModal({ isOpen, onClose, tunnelId, onUpdate }: TunnelDetailsModalProps) {
     const {
-        state: { details, loading, description, setDescription, isSaving, copiedKey },
+        state: { details, loading, description, setDescription, recordSessions, setRecordSessions, isSaving, copiedKey },
         actions: { handleSaveDescription, copyKey }
     } = useTunnelDetailsModal(tunnelId, isOpen, onUpdate, onClose);
 
@@ -88,6 +88,21 @@ export function TunnelDetailsModal({ isOpen, onClose, tunnelId, onUpdate }: Tunn
                             />
                         </div>
 
+                        <div className="flex items-start gap-3">
+                            <input
+                                id="record-sessions"
+                                type="checkbox"
+                                checked={recordSessions}
+                                onChange={(e) => setRecordSessions(e.target.checked)}
+                                disabled={details.user_permission !== 'owner' && details.user_permission !== 'admin'}
+                                className="mt-1 h-4 w-4 accent-primary disabled:cursor-not-allowed disabled:opacity-50"
+                            />
+                            <div>
+                                <Label htmlFor="record-sessions" className="text-sm font-medium text-foreground">Record terminal sessions</Label>
+                                <p className="text-xs text-muted-foreground">Web terminal output and input on this tunnel are recorded for audit.</p>
+                            </div>
+                        </div>
+
                         <div>
                             <div className="flex items-center justify-between mb-1">
                                 <Label className="text-sm font-medium text-foreground">Public Key</Label>
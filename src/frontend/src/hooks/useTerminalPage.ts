@@ -3,15 +3,30 @@
  * Terminal page logic: usernames list, xterm init, WebSocket PTY, service keys loading.
  * - xterm 初始化：動態 import xterm + FitAddon，註冊 OSC 7 同步當前路徑。
  *   xterm init: dynamic import, register OSC 7 for path sync.
- * - WebSocket 與 PTY：連線建立後送 pty_resize；onmessage 寫入 term；onData 送 pty_input。
- *   WebSocket & PTY: send pty_resize on open; onmessage writes to term; onData sends pty_input.
+ * - WebSocket 與 PTY：連線建立後送 resize；onmessage 寫入 term 並回送 ACK；onData 送輸入（二進位協定，JSON 備援）。
+ *   WebSocket & PTY: send resize on open; onmessage writes to term and acks; onData sends input (binary protocol, JSON fallback).
+ * - 終端機工作階段：以 session.<id> 子協定重新連線時接回同一個 PTY 與最近輸出。
+ *   Terminal session: reconnecting with the session.<id> subprotocol reattaches to the same PTY and recent output.
+ * - 分享：擁有者可將工作階段分享給唯讀觀看者，並複製觀看連結。
+ *   Sharing: the owner can share the session with read-only viewers and copy the watch link.
  * - Service Keys：fetchServiceKeys 呼叫 /api/reverse/service/keys，供標題列與彈窗使用。
  *   Service keys: fetchServiceKeys calls /api/reverse/service/keys for header and modal.
  */
 import { useEffect, useRef, useState } from "react";
 import { apiFetch } from "@/lib/api";
 import { getWsOrigin } from "@/lib/websocket";
-import { TerminalMainView } from "@/lib/tunnelUrls";
+import {
+    TERMINAL_BINARY_SUBPROTOCOL,
+    TERMINAL_SESSION_TAKEN_OVER,
+    decodeTerminalMessage,
+    getTerminalSessionProtocol,
+    rememberTerminalSession,
+    sendTerminalAck,
+    sendTerminalInput,
+    sendTerminalResize,
+    sendTerminalShare,
+} from "@/lib/terminalProtocol";
+import { TerminalMainView, getTerminalWatchUrl } from "@/lib/tunnelUrls";
 
 export interface TerminalUsername {
     id: number;
@@ -39,6 +54,8 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
     const [mainView, setMainView] = useState<TerminalMainView>("terminal");
     const [syncedPath, setSyncedPath] = useState<string | undefined>();
     const [reconnectTrigger, setReconnectTrigger] = useState(0);
+    const [sessionId, setSessionId] = useState<string | null>(null);
+    const [shared, setShared] = useState(false);
 
     const [serviceKeyModalOpen, setServiceKeyModalOpen] = useState(false);
     // eslint-disable-next-line @typescript-eslint/no-explicit-any
@@ -157,17 +174,12 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
                 try {
                     term.scrollToBottom();
                 } catch { } // empty catch
-                ws.send(JSON.stringify({
-                    action: "pty_resize",
-                    payload: {
-                        size: {
-                            rows: term.rows,
-                            cols: term.cols,
-                            height: term.rows * 20,
-                            width: term.cols * 9,
-                        },
-                    },
-                }));
+                sendTerminalResize(ws, {
+                    rows: term.rows,
+                    cols: term.cols,
+                    height: term.rows * 20,
+                    width: term.cols * 9,
+                });
             };
 
             const base = getWsOrigin();
@@ -182,9 +194,12 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
                 `server.${serverId}`,
                 `username.${username}`,
                 ticket,
+                TERMINAL_BINARY_SUBPROTOCOL,
+                getTerminalSessionProtocol(serverId, username),
             ];
 
             const ws = new WebSocket(wsUrl, protocols);
+            ws.binaryType = "arraybuffer";
             wsRef.current = ws;
 
             const handleWindowResize = () => sendResize(ws);
@@ -216,7 +231,16 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
             };
 
             ws.onmessage = (event) => {
-                term.write(event.data);
+                const message = decodeTerminalMessage(ws, event.data);
+                if (message?.kind === "data") {
+                    // Acknowledge once rendered (server-side flow control)
+                    term.write(message.data, () => sendTerminalAck(ws, message.ackSize));
+                } else if (message?.kind === "control" && message.message.type === "hello"
+                    && typeof message.message.session === "string") {
+                    rememberTerminalSession(serverId, username, message.message.session);
+                    setSessionId(message.message.session);
+                    setShared(message.message.shared === true);
+                }
             };
 
             ws.onerror = () => {
@@ -226,6 +250,8 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
             ws.onclose = (event) => {
                 setConnected(false);
                 setConnecting(false);
+                setSessionId(null);
+                setShared(false);
                 const code = event.code;
                 if (code === 4004) {
                     setPermissionDenied("You do not have permission to access this tunnel.");
@@ -239,6 +265,8 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
                 } else if (code === 4002) {
                     setPermissionDenied("Tunnel not found or server ID is invalid.");
                     term.write("\r\n\x1b[31m[Not Found] This tunnel does not exist.\x1b[0m\r\n");
+                } else if (code === TERMINAL_SESSION_TAKEN_OVER) {
+                    term.write("\r\n\x1b[33m[Session Moved] This terminal session was opened in another window.\x1b[0m\r\n");
                 } else if (code === 4006) {
                     setNoUsers(true);
                     term.write("\r\n\x1b[31m[No Users] No target server users configured for this tunnel.\x1b[0m\r\n");
@@ -248,9 +276,7 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
             };
 
             term.onData((data) => {
-                if (ws.readyState === WebSocket.OPEN) {
-                    ws.send(JSON.stringify({ action: "pty_input", payload: { input: data } }));
-                }
+                sendTerminalInput(ws, data);
             });
 
             cleanupFn = () => {
@@ -273,17 +299,14 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
             const timer = setTimeout(() => {
                 try {
                     fitAddonRef.current.fit();
-                    wsRef.current?.send(JSON.stringify({
-                        action: "pty_resize",
-                        payload: {
-                            size: {
-                                rows: xtermRef.current.rows,
-                                cols: xtermRef.current.cols,
-                                height: xtermRef.current.rows * 20,
-                                width: xtermRef.current.cols * 9,
-                            },
-                        },
-                    }));
+                    if (wsRef.current) {
+                        sendTerminalResize(wsRef.current, {
+                            rows: xtermRef.current.rows,
+                            cols: xtermRef.current.cols,
+                            height: xtermRef.current.rows * 20,
+                            width: xtermRef.current.cols * 9,
+                        });
+                    }
                 } catch (err) {
                     console.error("Resize error", err);
                 }
@@ -369,6 +392,21 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
         }
     };
 
+    // 分享：切換唯讀觀看，開啟時複製觀看連結。
+    // Sharing: toggle read-only viewers; copy the watch link when enabled.
+    const toggleShare = async () => {
+        const ws = wsRef.current;
+        if (!ws || !serverId || !sessionId) return;
+        const enabled = !shared;
+        sendTerminalShare(ws, enabled);
+        setShared(enabled);
+        if (enabled) {
+            try {
+                await navigator.clipboard.writeText(`${window.location.origin}${getTerminalWatchUrl(serverId, sessionId)}`);
+            } catch { } // empty catch
+        }
+    };
+
     return {
         refs: { terminalRef, xtermRef, wsRef },
         state: {
@@ -386,10 +424,13 @@ export function useTerminalPage(serverId: string | null, accessToken: string | n
             serviceKeys, setServiceKeys,
             loadingServiceKeys, setLoadingServiceKeys,
             username, setUsername,
-            availableUsernames, setAvailableUsernames
+            availableUsernames, setAvailableUsernames,
+            sessionId,
+            shared,
         },
         actions: {
             fetchServiceKeys,
+            toggleShare,
             reconnect: () => setReconnectTrigger(t => t + 1),
         }
     };
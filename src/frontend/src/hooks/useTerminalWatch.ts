@@ -0,0 +1,107 @@
+/**
+ * 唯讀觀看共享的終端機工作階段：xterm（停用輸入）與 /ws/terminal/watch/ 連線。
+ * Read-only view of a shared terminal session: xterm (input disabled) and the /ws/terminal/watch/ socket.
+ * - 連線後先收到工作階段最近的輸出，之後與擁有者看到相同的輸出。
+ *   After connecting, the session's recent output arrives first, then the same output the owner sees.
+ * - 觀看者不會送出輸入；擁有者停止分享或工作階段結束時連線關閉。
+ *   Viewers never send input; the socket closes when the owner stops sharing or the session ends.
+ */
+import { useEffect, useRef, useState } from "react";
+import { getWsOrigin } from "@/lib/websocket";
+import {
+    TERMINAL_BINARY_SUBPROTOCOL,
+    TERMINAL_SESSION_NOT_SHARED,
+    decodeTerminalMessage,
+} from "@/lib/terminalProtocol";
+
+export function useTerminalWatch(sessionId: string | null, accessToken: string | null) {
+    const terminalRef = useRef<HTMLDivElement>(null);
+
+    const [connected, setConnected] = useState(false);
+    const [connecting, setConnecting] = useState(true);
+    const [error, setError] = useState<string | null>(null);
+
+    useEffect(() => {
+        if (!sessionId || !accessToken) return;
+
+        let cleanupFn: (() => void) | undefined;
+
+        const initTerminal = async () => {
+            const { Terminal } = await import("xterm");
+            const { FitAddon } = await import("xterm-addon-fit");
+
+            await document.fonts.ready;
+            if (!terminalRef.current) return;
+
+            const term = new Terminal({
+                disableStdin: true,
+                cursorBlink: false,
+                theme: { background: "#000000", foreground: "#f0f0f0" },
+                fontFamily: "'Menlo', 'Consolas', 'Courier New', monospace",
+                fontSize: 14,
+                lineHeight: 1.2,
+            });
+            const fitAddon = new FitAddon();
+            term.loadAddon(fitAddon);
+            term.open(terminalRef.current);
+            fitAddon.fit();
+
+            const handleWindowResize = () => fitAddon.fit();
+            window.addEventListener("resize", handleWindowResize);
+
+            const jsSha256 = (await import("js-sha256")).sha256;
+            const protocols = [
+                `token.${btoa(accessToken)}`,
+                `session.${sessionId}`,
+                `auth.${jsSha256(`terminal_watch_${sessionId}.${Date.now()}`)}`,
+                TERMINAL_BINARY_SUBPROTOCOL,
+            ];
+            const ws = new WebSocket(`${getWsOrigin()}/ws/terminal/watch/`, protocols);
+            ws.binaryType = "arraybuffer";
+
+            ws.onopen = () => {
+                setConnected(true);
+                setConnecting(false);
+            };
+
+            ws.onmessage = (event) => {
+                const message = decodeTerminalMessage(ws, event.data);
+                if (message?.kind === "data") {
+                    term.write(message.data);
+                }
+            };
+
+            ws.onerror = () => {
+                setConnecting(false);
+            };
+
+            ws.onclose = (event) => {
+                setConnected(false);
+                setConnecting(false);
+                if (event.code === TERMINAL_SESSION_NOT_SHARED) {
+                    setError("This terminal session is not shared.");
+                } else if (event.code === 4004) {
+                    setError("You do not have permission to access this tunnel.");
+                } else if (event.code === 4001) {
+                    setError("Authentication failed. Please log in again.");
+                } else {
+                    term.write("\r\n\x1b[33m[Sharing ended]\x1b[0m\r\n");
+                }
+            };
+
+            cleanupFn = () => {
+                window.removeEventListener("resize", handleWindowResize);
+                ws.close();
+                term.dispose();
+            };
+        };
+
+        initTerminal();
+
+        return () => {
+            cleanupFn?.();
+        };
+    }, [sessionId, accessToken]);
+
+    return { terminalRef, connected, connecting, error };
+}
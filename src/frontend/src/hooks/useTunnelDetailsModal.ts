@@ -6,6 +6,7 @@ export function useTunnelDetailsModal(tunnelId: number | null, isOpen: boolean,
     const [details, setDetails] = useState<any>(null);
     const [loading, setLoading] = useState(false);
     const [description, setDescription] = useState("");
+    const [recordSessions, setRecordSessions] = useState(false);
     const [isSaving, setIsSaving] = useState(false);
     const [copiedKey, setCopiedKey] = useState(false);
     const { showSuccess, showError } = useToast();
@@ -20,6 +21,7 @@ export function useTunnelDetailsModal(tunnelId: number | null, isOpen: boolean,
                         const data = await res.json();
                         setDetails(data);
                         setDescription(data.description || "");
+                        setRecordSessions(Boolean(data.record_sessions));
                     } else {
                         showError("Failed to fetch tunnel details");
                     }
@@ -37,9 +39,11 @@ export function useTunnelDetailsModal(tunnelId: number | null, isOpen: boolean,
         if (!tunnelId) return;
         setIsSaving(true);
         try {
+            // Session recording is an audit setting: only owners and admins may change it
+            const canAdmin = details?.user_permission === 'owner' || details?.user_permission === 'admin';
             const res = await apiFetch(`/api/reverse/server/keys/${tunnelId}`, {
                 method: "PATCH",
-                body: JSON.stringify({ description }),
+                body: JSON.stringify(canAdmin ? { description, record_sessions: recordSessions } : { description }),
             });
             if (res.ok) {
                 showSuccess("Description updated");
@@ -68,6 +72,7 @@ export function useTunnelDetailsModal(tunnelId: number | null, isOpen: boolean,
             details,
             loading,
             description, setDescription,
+            recordSessions, setRecordSessions,
             isSaving,
             copiedKey
         },
@@ -1,14 +1,17 @@
-import { useState, useCallback, useEffect } from "react";
+import { useState, useCallback, useEffect, useRef } from "react";
 import { apiFetch } from "@/lib/api";
 import { useToast } from "@/components/ui/Toast";
 import { useAuth } from "@/lib/auth";
 import { useNotificationHandlers } from "@/lib/websocket";
 import { NOTIFICATION_ACTIONS } from "@/types/notification";
-import { Tunnel } from "@/types/tunnel";
+import { PortProbe, Tunnel } from "@/types/tunnel";
 
 export function useTunnelsPage() {
     const [tunnels, setTunnels] = useState<Tunnel[]>([]);
     const [portsMap, setPortsMap] = useState<Record<string, boolean>>({});
+    const [probesMap, setProbesMap] = useState<Record<string, PortProbe>>({});
+    // Tunnel status version of portsMap (null until the first snapshot)
+    const statusVersionRef = useRef<number | null>(null);
     const [loading, setLoading] = useState(true);
 
     const [configModal, setConfigModal] = useState<{ isOpen: boolean, tunnelId: number | null }>({ isOpen: false, tunnelId: null });
@@ -25,9 +28,10 @@ export function useTunnelsPage() {
     const fetchData = useCallback(async () => {
         try {
             setLoading(true);
-            const [keysRes, portsRes] = await Promise.all([
+            const [keysRes, portsRes, probesRes] = await Promise.all([
                 apiFetch("/api/reverse/server/keys"),
-                apiFetch("/api/reverse/server/status/ports")
+                apiFetch("/api/reverse/server/status/ports"),
+                apiFetch("/api/reverse/server/status/probes")
             ]);
 
             if (keysRes.ok && portsRes.ok) {
@@ -36,6 +40,11 @@ export function useTunnelsPage() {
 
                 setTunnels(Array.isArray(keys) ? keys : []);
                 setPortsMap(typeof ports === 'object' && ports !== null ? ports : {});
+                // Probes are optional: keep the list usable without them
+                if (probesRes.ok) {
+                    const probes = await probesRes.json();
+                    setProbesMap(typeof probes === 'object' && probes !== null ? probes : {});
+                }
             } else {
                 showError("Failed to fetch tunnel data");
             }
@@ -51,20 +60,25 @@ export function useTunnelsPage() {
         // eslint-disable-next-line react-hooks/exhaustive-deps
     }, []);
 
-    useNotificationHandlers({
-        [NOTIFICATION_ACTIONS.UPDATE_TUNNEL_STATUS_DATA]: (msg) => {
-            if (Array.isArray(msg.data)) {
-                const map: Record<string, boolean> = {};
-                for (const p of msg.data) {
-                    map[String(p)] = true;
-                }
-                setPortsMap(map);
+    const { isConnected, sendMessage } = useNotificationHandlers({
+        [NOTIFICATION_ACTIONS.TUNNEL_STATUS_SNAPSHOT]: (msg) => {
+            if (msg.ports && typeof msg.version === "number") {
+                statusVersionRef.current = msg.version;
+                setPortsMap(msg.ports);
             }
         },
-        [NOTIFICATION_ACTIONS.UPDATE_TUNNEL_STATUS]: (msg) => {
-            if (msg.port !== undefined) {
-                setPortsMap(prev => ({ ...prev, [String(msg.port)]: msg.status === "connected" }));
+        [NOTIFICATION_ACTIONS.TUNNEL_STATUS_DELTA]: (msg) => {
+            if (!msg.changes || typeof msg.version !== "number") return;
+            const version = statusVersionRef.current;
+            if (version !== null && msg.version <= version) return; // already applied
+            if (version === null || (typeof msg.prev === "number" && msg.prev > version)) {
+                // Missed a delta: ask for what changed since our version
+                sendMessage({ action: NOTIFICATION_ACTIONS.SYNC_TUNNEL_STATUS, version });
+                return;
             }
+            statusVersionRef.current = msg.version;
+            const changes = msg.changes;
+            setPortsMap(prev => ({ ...prev, ...changes }));
         },
         [NOTIFICATION_ACTIONS.TUNNEL_SHARED]: (msg) => {
             if (msg.details) showSuccess(msg.details);
@@ -87,6 +101,13 @@ export function useTunnelsPage() {
         }
     });
 
+    // Catch up on status changes after every (re)connect
+    useEffect(() => {
+        if (isConnected) {
+            sendMessage({ action: NOTIFICATION_ACTIONS.SYNC_TUNNEL_STATUS, version: statusVersionRef.current });
+        }
+    }, [isConnected, sendMessage]);
+
     const handleDelete = async () => {
         if (!deleteConfirm.tunnelId) return;
         try {
@@ -124,6 +145,7 @@ export function useTunnelsPage() {
     return {
         tunnels,
         portsMap,
+        probesMap,
         loading,
         fetchData,
         handleDelete,
@@ -0,0 +1,128 @@
+/**
+ * Web terminal WebSocket protocol (backend: tunnels/terminal_protocol.py).
+ * - Offer TERMINAL_BINARY_SUBPROTOCOL; once the server's hello control frame
+ *   arrives, input and resizes go out as binary frames (1-byte opcode + payload).
+ * - Until then (or with an older backend) the JSON pty_input / pty_resize
+ *   messages are used; output may arrive as text or binary frames.
+ * - Binary output is acknowledged (ACK) once xterm has rendered it; the server
+ *   pauses the pty while too much output is unacknowledged.
+ * - The session.<id> subprotocol reattaches to a detached terminal session
+ *   (backend: tunnels/terminal_sessions.py); the id is kept per tab in sessionStorage.
+ * - The owner can share the session with read-only viewers, who connect to
+ *   /ws/terminal/watch/ with the same session.<id> (backend: tunnels/terminal_broadcast.py).
+ */
+
+export const TERMINAL_BINARY_SUBPROTOCOL = "terminal.binary";
+/** Close code of a socket whose session was reattached from elsewhere. */
+export const TERMINAL_SESSION_TAKEN_OVER = 4007;
+/** Close code of a viewer whose session is not shared. */
+export const TERMINAL_SESSION_NOT_SHARED = 4008;
+
+const OP_DATA = 0x00;
+const OP_RESIZE = 0x01;
+const OP_CONTROL = 0x02;
+const OP_ACK = 0x03;
+
+export interface TerminalSize {
+    rows: number;
+    cols: number;
+    height: number;
+    width: number;
+}
+
+export type TerminalMessage =
+    | { kind: "data"; data: Uint8Array | string; ackSize: number }
+    | { kind: "control"; message: Record<string, unknown> };
+
+// Sockets whose server confirmed the binary protocol
+const binarySockets = new WeakSet<WebSocket>();
+const encoder = new TextEncoder();
+const decoder = new TextDecoder();
+
+/** Decode an incoming frame; a hello switches the socket to binary input. */
+export function decodeTerminalMessage(ws: WebSocket, data: ArrayBuffer | string): TerminalMessage | null {
+    if (typeof data === "string") {
+        return { kind: "data", data, ackSize: 0 };
+    }
+    const frame = new Uint8Array(data);
+    if (frame.length === 0) return null;
+    if (frame[0] === OP_DATA) {
+        return { kind: "data", data: frame.subarray(1), ackSize: frame.length - 1 };
+    }
+    if (frame[0] === OP_CONTROL) {
+        const message = JSON.parse(decoder.decode(frame.subarray(1)));
+        if (message.type === "hello") binarySockets.add(ws);
+        return { kind: "control", message };
+    }
+    return null;
+}
+
+export function sendTerminalInput(ws: WebSocket, input: string) {
+    if (ws.readyState !== WebSocket.OPEN) return;
+    if (!binarySockets.has(ws)) {
+        ws.send(JSON.stringify({ action: "pty_input", payload: { input } }));
+        return;
+    }
+    const payload = encoder.encode(input);
+    const frame = new Uint8Array(payload.length + 1);
+    frame[0] = OP_DATA;
+    frame.set(payload, 1);
+    ws.send(frame);
+}
+
+export function sendTerminalResize(ws: WebSocket, size: TerminalSize) {
+    if (ws.readyState !== WebSocket.OPEN) return;
+    if (!binarySockets.has(ws)) {
+        ws.send(JSON.stringify({ action: "pty_resize", payload: { size } }));
+        return;
+    }
+    const frame = new DataView(new ArrayBuffer(9));
+    frame.setUint8(0, OP_RESIZE);
+    [size.rows, size.cols, size.height, size.width].forEach((value, i) => {
+        frame.setUint16(1 + i * 2, Math.min(value, 0xffff));
+    });
+    ws.send(frame.buffer);
+}
+
+export function sendTerminalAck(ws: WebSocket, size: number) {
+    if (ws.readyState !== WebSocket.OPEN || size <= 0) return;
+    const frame = new DataView(new ArrayBuffer(5));
+    frame.setUint8(0, OP_ACK);
+    frame.setUint32(1, size);
+    ws.send(frame.buffer);
+}
+
+/** Start or stop publishing the session to read-only viewers. */
+export function sendTerminalShare(ws: WebSocket, enabled: boolean) {
+    if (ws.readyState !== WebSocket.OPEN) return;
+    if (!binarySockets.has(ws)) {
+        ws.send(JSON.stringify({ action: "share", payload: { enabled } }));
+        return;
+    }
+    const payload = encoder.encode(JSON.stringify({ type: "share", enabled }));
+    const frame = new Uint8Array(payload.length + 1);
+    frame[0] = OP_CONTROL;
+    frame.set(payload, 1);
+    ws.send(frame);
+}
+
+function sessionStorageKey(serverId: string, username: string) {
+    return `terminal-session:${serverId}:${username}`;
+}
+
+/** Subprotocol naming this tab's terminal session (created on first use). */
+export function getTerminalSessionProtocol(serverId: string, username: string): string {
+    const key = sessionStorageKey(serverId, username);
+    let id = sessionStorage.getItem(key);
+    if (!id) {
+        // getRandomValues also works on plain-HTTP deployments (randomUUID does not)
+        id = Array.from(crypto.getRandomValues(new Uint8Array(16)), (b) => b.toString(16).padStart(2, "0")).join("");
+        sessionStorage.setItem(key, id);
+    }
+    return `session.${id}`;
+}
+
+/** Keep the id the server actually gave the session (from its hello). */
+export function rememberTerminalSession(serverId: string, username: string, id: string) {
+    sessionStorage.setItem(sessionStorageKey(serverId, username), id);
+}
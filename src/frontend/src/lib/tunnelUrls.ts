@@ -21,3 +21,12 @@ export function getTerminalPageUrl(
     }
     return base;
 }
+
+/**
+ * Build the URL of the read-only view of a shared terminal session.
+ * @param serverId - Tunnel id.
+ * @param sessionId - Terminal session id (from the server's hello).
+ */
+export function getTerminalWatchUrl(serverId: string, sessionId: string): string {
+    return `/tunnels/terminal/watch?serverId=${serverId}&session=${sessionId}`;
+}
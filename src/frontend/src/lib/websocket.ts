@@ -9,7 +9,7 @@
  * - 訊息路由：useNotificationHandlers 依 action 分發給對應 handler。
  *   Message routing: useNotificationHandlers dispatches by action to handlers.
  */
-import { useEffect, useRef, useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
 import { useAuth } from "./auth";
 import { NotificationPayload } from "./notificationActions";
 
@@ -123,7 +123,14 @@ export function useNotificationWebSocket() {
         };
     }, [accessToken]);
 
-    return { isConnected, lastMessage };
+    // Send a JSON message to the backend; dropped while disconnected
+    const sendMessage = useCallback((message: object) => {
+        if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
+            wsRef.current.send(JSON.stringify(message));
+        }
+    }, []);
+
+    return { isConnected, lastMessage, sendMessage };
 }
 
 /**
@@ -133,7 +140,7 @@ export function useNotificationWebSocket() {
 export function useNotificationHandlers(
     handlers: Partial<Record<string, (msg: NotificationPayload) => void>>
 ) {
-    const { isConnected, lastMessage } = useNotificationWebSocket();
+    const { isConnected, lastMessage, sendMessage } = useNotificationWebSocket();
 
     // Store handlers in a ref so we don't trigger the effect on every re-render
     const handlersRef = useRef(handlers);
@@ -151,7 +158,7 @@ export function useNotificationHandlers(
         }
     }, [lastMessage]);
 
-    return { isConnected };
+    return { isConnected, sendMessage };
 }
 
 /**
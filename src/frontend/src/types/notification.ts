@@ -4,8 +4,9 @@
  */
 
 export const NOTIFICATION_ACTIONS = {
-    UPDATE_TUNNEL_STATUS_DATA: "UPDATE-TUNNEL-STATUS-DATA",
-    UPDATE_TUNNEL_STATUS: "UPDATE-TUNNEL-STATUS",
+    TUNNEL_STATUS_DELTA: "TUNNEL-STATUS-DELTA",
+    TUNNEL_STATUS_SNAPSHOT: "TUNNEL-STATUS-SNAPSHOT",
+    SYNC_TUNNEL_STATUS: "SYNC-TUNNEL-STATUS",
     TUNNEL_SHARED: "TUNNEL-SHARED",
     TUNNEL_UNSHARED: "TUNNEL-UNSHARED",
     TUNNEL_PERMISSION_UPDATED: "TUNNEL-PERMISSION-UPDATED",
@@ -22,6 +23,14 @@ export interface NotificationPayload {
     port?: number;
     status?: string;
     data?: unknown;
+    /** Tunnel status version (TUNNEL-STATUS-DELTA / TUNNEL-STATUS-SNAPSHOT) */
+    version?: number;
+    /** Last status version sent before this delta, null if unknown */
+    prev?: number | null;
+    /** Changed ports of a delta: port -> connected */
+    changes?: Record<string, boolean>;
+    /** All ports of a snapshot: port -> connected */
+    ports?: Record<string, boolean>;
     // eslint-disable-next-line @typescript-eslint/no-explicit-any
     [key: string]: any;
 }
@@ -14,6 +14,17 @@ export interface Tunnel {
     can_share: boolean;
     can_delete: boolean;
     shared_with_count?: number;
+    record_sessions?: boolean;
+}
+
+/** Last latency probe of a connected tunnel (GET /api/reverse/server/status/probes) */
+export interface PortProbe {
+    ok: boolean;
+    rtt_ms: number | null;
+    degraded: boolean;
+    error: string | null;
+    banner: string | null;
+    ts: number;
 }
 
 export interface ReverseServerUsername {
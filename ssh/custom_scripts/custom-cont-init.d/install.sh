@@ -6,4 +6,6 @@ apk add --no-cache net-tools || true
 echo "-------- Install redis --------"
 apk add --no-cache redis
 echo "-------- Install curl --------"
-apk add --no-cache curl
\ No newline at end of file
+apk add --no-cache curl
+echo "-------- Install python3 (authorized-keys resolver) --------"
+apk add --no-cache python3
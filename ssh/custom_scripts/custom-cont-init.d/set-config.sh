@@ -58,6 +58,12 @@ awk '
   !skipping { print }
 ' "$CONFIG_FILE" > "$tmp" && cat "$tmp" > "$CONFIG_FILE" && rm -f "$tmp"
 
+if [ "$(echo "${AUTHORIZED_KEYS_PUSH_MODE:-false}" | tr '[:upper:]' '[:lower:]')" = "true" ]; then
+    # Push mode: the backend renders the accepted keys to a shared volume
+    # (authorized_keys/key_files.py), sshd reads them without any HTTP call
+    sed -i 's|^[[:space:]]*AuthorizedKeysFile.*|AuthorizedKeysFile /config/telepy-authorized-keys/authorized_keys|' "$CONFIG_FILE"
+    echo "--- Push mode: AuthorizedKeysFile /config/telepy-authorized-keys/authorized_keys"
+else
 # Append global AuthorizedKeysCommand (before any Match block)
 # %u = username, %t = key type, %k = base64-encoded public key blob
 cat >> "$CONFIG_FILE" << SSHD_GLOBAL
@@ -65,6 +71,7 @@ cat >> "$CONFIG_FILE" << SSHD_GLOBAL
 AuthorizedKeysCommand /usr/local/bin/telepy-authorized-keys.sh %u %t %k
 AuthorizedKeysCommandUser ${USER_NAME:-telepy}
 SSHD_GLOBAL
+fi
 
 # Add custom configuration for user 'telepy'
 cat >> "$CONFIG_FILE" << EOF
@@ -0,0 +1,5 @@
+#!/usr/bin/with-contenv bash
+
+# Long-lived authorized-keys resolver used by telepy-authorized-keys.sh
+# (see /opt/telepy/telepy-keys-resolver.py). s6 restarts it if it exits.
+exec python3 /opt/telepy/telepy-keys-resolver.py
@@ -0,0 +1,5 @@
+#!/usr/bin/with-contenv bash
+
+# Publishes tunnel connect/disconnect events to Redis as listening sockets
+# change (see /opt/telepy/telepy-port-events.py). s6 restarts it if it exits.
+exec python3 /opt/telepy/telepy-port-events.py
@@ -12,6 +12,11 @@
 # "type base64_key" format on stdout — sshd then accepts it.
 # An empty stdout means "not authorized."
 #
+# The lookup goes through the long-lived resolver daemon
+# (telepy-keys-resolver.py) over a Unix socket; if it is not running we call
+# the backend directly.  Both use `mode=minimal`, so the backend makes the
+# authorization decision and returns at most the single matching key line.
+#
 # NOTE: sshd runs this with a sanitized environment (minimal or empty PATH).
 # We use absolute paths for curl and explicit PATH so the script works when
 # invoked by sshd, not only when run manually.
@@ -24,6 +29,7 @@
 #        cat /tmp/telepy-authkeys-debug.log
 #      No new lines after SSH attempt → AuthorizedKeysCommand not run (wrong config or not loaded).
 #   2. "AuthorizedKeysCommand invoked" but "curl FAILED" → PATH/curl or network; check /config/logs/auth_keys_debug.log for curl stderr.
+#      Resolver state:  curl --unix-socket /run/telepy/keys.sock http://resolver/health
 #   3. Manual test (same args sshd would pass):
 #        /usr/local/bin/telepy-authorized-keys.sh telepy ssh-ed25519 <base64_key_blob>
 
@@ -33,15 +39,41 @@ CURL_CMD="/usr/bin/curl"
 LOG_FILE="/config/logs/auth_keys_debug.log"
 FALLBACK_LOG="/tmp/telepy-authkeys-debug.log"
 
+# Unix socket of the resolver daemon (custom-services.d/keys_resolver.sh)
+RESOLVER_SOCKET="/run/telepy/keys.sock"
+
 KEY_USER="$1"
 KEY_TYPE="$2"
 KEY_BLOB="$3"
 
-# --- Immediate entry log: primary and fallback (to confirm sshd actually invokes us) ---
+# --- Entry log (to confirm sshd actually invokes us) ---
 _entry_msg="[$(date '+%Y-%m-%d %H:%M:%S')] AuthorizedKeysCommand invoked | argc=$# | user=$KEY_USER | type=$KEY_TYPE | key_prefix=${KEY_BLOB:0:20}..."
-echo "$_entry_msg" >> "$LOG_FILE" 2>/dev/null || true
 echo "$_entry_msg" >> "$FALLBACK_LOG" 2>/dev/null || true
 
+# Prefer /usr/bin/curl; fallback to PATH if not present (e.g. some images use /usr/local/bin/curl)
+if [ ! -x "$CURL_CMD" ]; then
+    CURL_CMD="curl"
+fi
+
+# --- Fast path: ask the local resolver daemon over its Unix socket ---
+# It holds keep-alive connections to the backend and caches answers, so this
+# avoids a new TCP connection (and token read) per offered key.
+if [ -S "$RESOLVER_SOCKET" ]; then
+    curl_output=$("$CURL_CMD" -s -f --max-time 5 -G \
+        --unix-socket "$RESOLVER_SOCKET" \
+        --data-urlencode "key_type=${KEY_TYPE}" \
+        --data-urlencode "key=${KEY_BLOB}" \
+        "http://resolver/keys" 2>>"$LOG_FILE")
+    if [ $? -eq 0 ]; then
+        if [ -n "$curl_output" ]; then
+            echo "$curl_output"
+        fi
+        exit 0
+    fi
+    echo "[$(date '+%Y-%m-%d %H:%M:%S')] resolver FAILED | falling back to backend API" >> "$LOG_FILE" 2>/dev/null || true
+fi
+
+# --- Fallback: call the backend API directly ---
 API_URL="http://backend:8000/api/reverse/internal/keys"
 
 # Read the internal API token from the persisted file
@@ -51,29 +83,22 @@ INTERNAL_API_TOKEN=""
 if [ -r "$TOKEN_FILE" ]; then
     INTERNAL_API_TOKEN=$(cat "$TOKEN_FILE")
 fi
-_token_len=${#INTERNAL_API_TOKEN}
-echo "[$(date '+%Y-%m-%d %H:%M:%S')] token_read=$([ -n "$INTERNAL_API_TOKEN" ] && echo "yes" || echo "no") token_len=$_token_len curl=$CURL_CMD" >> "$FALLBACK_LOG" 2>/dev/null || true
-
-# Prefer /usr/bin/curl; fallback to PATH if not present (e.g. some images use /usr/local/bin/curl)
-if [ ! -x "$CURL_CMD" ]; then
-    CURL_CMD="curl"
-fi
 
 # Fetch key verification from backend API (authenticated via shared token)
 curl_output=$("$CURL_CMD" -s -f --max-time 5 -G \
     -H "Authorization: Bearer ${INTERNAL_API_TOKEN}" \
     --data-urlencode "key_type=${KEY_TYPE}" \
     --data-urlencode "key=${KEY_BLOB}" \
+    --data-urlencode "mode=minimal" \
     "${API_URL}" 2>>"$LOG_FILE")
 
 exit_code=$?
 
-# Log curl result (both logs for debugging when auth command doesn't call API)
+# Log curl result
 if [ $exit_code -eq 0 ]; then
     resp_len=${#curl_output}
     _ok_msg="[$(date '+%Y-%m-%d %H:%M:%S')] curl OK | exit=$exit_code | response_len=$resp_len | non_empty=$([ -n "$curl_output" ] && echo yes || echo no)"
     echo "$_ok_msg" >> "$LOG_FILE" 2>/dev/null || true
-    echo "$_ok_msg" >> "$FALLBACK_LOG" 2>/dev/null || true
 else
     _fail_msg="[$(date '+%Y-%m-%d %H:%M:%S')] curl FAILED | exit=$exit_code"
     echo "$_fail_msg" >> "$LOG_FILE" 2>/dev/null || true
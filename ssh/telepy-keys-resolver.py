@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Long-lived authorized-keys resolver for the SSH container.
+
+`telepy-authorized-keys.sh` (sshd's AuthorizedKeysCommand) talks to this
+daemon over a Unix socket instead of calling the backend directly:
+
+    GET /keys?key_type=<type>&key=<base64 blob>   -> matching key line or empty
+    GET /health                                   -> JSON counters
+
+The resolver:
+  * keeps a small pool of keep-alive HTTP connections to the backend,
+  * caches positive and negative answers with a short TTL,
+  * persists positive answers to an on-disk snapshot (write temp + rename)
+    and serves from it when the backend is unreachable.
+
+Only the standard library is used, so it runs on the stock image with
+`python3` installed (see custom-cont-init.d/install.sh).
+"""
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+import http.client
+import socketserver
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+SOCKET_PATH = os.environ.get("TELEPY_RESOLVER_SOCKET", "/run/telepy/keys.sock")
+SOCKET_OWNER = os.environ.get("USER_NAME", "telepy")
+
+BACKEND_HOST = os.environ.get("TELEPY_BACKEND_HOST", "backend")
+BACKEND_PORT = int(os.environ.get("TELEPY_BACKEND_PORT", "8000"))
+BACKEND_PATH = "/api/reverse/internal/keys"
+BACKEND_TIMEOUT = float(os.environ.get("TELEPY_RESOLVER_BACKEND_TIMEOUT", "3"))
+BACKEND_POOL_SIZE = int(os.environ.get("TELEPY_RESOLVER_POOL_SIZE", "8"))
+
+TOKEN_FILE = "/config/.internal_api_token"
+
+# Cache TTLs (seconds). Positive answers are kept a little longer than
+# negative ones so a freshly registered key starts working quickly.
+POSITIVE_TTL = float(os.environ.get("TELEPY_RESOLVER_POSITIVE_TTL", "30"))
+NEGATIVE_TTL = float(os.environ.get("TELEPY_RESOLVER_NEGATIVE_TTL", "5"))
+CACHE_MAX_ENTRIES = int(os.environ.get("TELEPY_RESOLVER_CACHE_MAX_ENTRIES", "50000"))
+
+SNAPSHOT_FILE = os.environ.get("TELEPY_RESOLVER_SNAPSHOT", "/config/.telepy-keys-snapshot.json")
+SNAPSHOT_MAX_AGE = float(os.environ.get("TELEPY_RESOLVER_SNAPSHOT_MAX_AGE", str(24 * 3600)))
+SNAPSHOT_FLUSH_INTERVAL = 5
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] [telepy-keys-resolver] [%(levelname)s] - %(message)s",
+    stream=sys.stdout,
+)
+logger = logging.getLogger("telepy-keys-resolver")
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+def key_fingerprint(key_type: str, key_blob: str) -> str:
+    """Same normalization as the backend's `compute_key_fingerprint`."""
+    return hashlib.sha256(f"{key_type} {key_blob}".encode()).hexdigest()
+
+
+def read_token() -> str:
+    try:
+        with open(TOKEN_FILE, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+class BackendClient:
+    """Pool of keep-alive connections to the backend internal keys API."""
+
+    def __init__(self):
+        self.pool = queue.LifoQueue(maxsize=BACKEND_POOL_SIZE)
+        self.token = read_token()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return http.client.HTTPConnection(BACKEND_HOST, BACKEND_PORT, timeout=BACKEND_TIMEOUT)
+
+    def _release(self, conn: http.client.HTTPConnection) -> None:
+        try:
+            self.pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def fetch(self, key_type: str, key_blob: str) -> str:
+        if not self.token:
+            # The token file may be written after we started
+            self.token = read_token()
+
+        query = urllib.parse.urlencode({"key_type": key_type, "key": key_blob, "mode": "minimal"})
+        headers = {"Authorization": f"Bearer {self.token}", "Connection": "keep-alive"}
+
+        # A pooled connection may have been closed by the server; retry once on a fresh one
+        for attempt in range(2):
+            conn = self._connection() if attempt == 0 else http.client.HTTPConnection(
+                BACKEND_HOST, BACKEND_PORT, timeout=BACKEND_TIMEOUT,
+            )
+            try:
+                conn.request("GET", f"{BACKEND_PATH}?{query}", headers=headers)
+                response = conn.getresponse()
+                body = response.read().decode()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if attempt == 1:
+                    raise BackendUnavailable(str(e))
+                continue
+
+            if response.status != 200:
+                conn.close()
+                raise BackendUnavailable(f"HTTP {response.status}")
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            return body.strip()
+
+        raise BackendUnavailable("unreachable")
+
+
+class AnswerCache:
+    """Fingerprint -> answer cache with per-entry expiry."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, fingerprint: str):
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                return None
+            expires_at, answer = entry
+            if expires_at < time.monotonic():
+                del self.entries[fingerprint]
+                return None
+            return answer
+
+    def put(self, fingerprint: str, answer: str) -> None:
+        ttl = POSITIVE_TTL if answer else NEGATIVE_TTL
+        with self.lock:
+            if len(self.entries) >= CACHE_MAX_ENTRIES:
+                now = time.monotonic()
+                self.entries = {k: v for k, v in self.entries.items() if v[0] >= now}
+                if len(self.entries) >= CACHE_MAX_ENTRIES:
+                    self.entries.clear()
+            self.entries[fingerprint] = (time.monotonic() + ttl, answer)
+
+
+class Snapshot:
+    """Last-known-good positive answers, persisted to disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}  # fingerprint -> {"key": line, "seen": unix time}
+        self.dirty = False
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+            logger.info("Loaded %d key(s) from snapshot %s", len(self.entries), self.path)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get(self, fingerprint: str) -> str:
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+        if entry and time.time() - entry["seen"] <= SNAPSHOT_MAX_AGE:
+            return entry["key"]
+        return ""
+
+    def update(self, fingerprint: str, answer: str) -> None:
+        with self.lock:
+            if answer:
+                self.entries[fingerprint] = {"key": answer, "seen": time.time()}
+                self.dirty = True
+            elif self.entries.pop(fingerprint, None) is not None:
+                # Revoked keys must not survive in the fallback snapshot
+                self.dirty = True
+
+    def flush(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.entries)
+            self.dirty = False
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error("Failed to write snapshot %s: %s", self.path, e)
+            with self.lock:
+                self.dirty = True
+
+    def flush_forever(self) -> None:
+        while True:
+            time.sleep(SNAPSHOT_FLUSH_INTERVAL)
+            self.flush()
+
+
+class Resolver:
+    def __init__(self):
+        self.backend = BackendClient()
+        self.cache = AnswerCache()
+        self.snapshot = Snapshot(SNAPSHOT_FILE)
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "cache_hits": 0,
+            "backend_ok": 0,
+            "backend_errors": 0,
+            "snapshot_hits": 0,
+        }
+
+    def count(self, name: str) -> None:
+        with self.stats_lock:
+            self.stats[name] += 1
+
+    def resolve(self, key_type: str, key_blob: str) -> str:
+        self.count("requests")
+        fingerprint = key_fingerprint(key_type, key_blob)
+
+        answer = self.cache.get(fingerprint)
+        if answer is not None:
+            self.count("cache_hits")
+            return answer
+
+        try:
+            answer = self.backend.fetch(key_type, key_blob)
+        except BackendUnavailable as e:
+            self.count("backend_errors")
+            answer = self.snapshot.get(fingerprint)
+            if answer:
+                self.count("snapshot_hits")
+            logger.warning(
+                "Backend unavailable (%s) | key_prefix=%s... | snapshot=%s",
+                e, key_blob[:20], "hit" if answer else "miss",
+            )
+            return answer
+
+        self.count("backend_ok")
+        self.cache.put(fingerprint, answer)
+        self.snapshot.update(fingerprint, answer)
+        return answer
+
+
+class ResolverRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    resolver: Resolver = None
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return "unix"
+
+    def log_message(self, format, *args):
+        # One line per request would dominate the cost during reconnect storms
+        pass
+
+    def _reply(self, status: int, body: str, content_type: str = "text/plain") -> None:
+        payload = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if payload:
+            self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/health":
+            with self.resolver.stats_lock:
+                stats = dict(self.resolver.stats)
+            self._reply(200, json.dumps(stats), "application/json")
+            return
+
+        if url.path != "/keys":
+            self._reply(404, "")
+            return
+
+        params = urllib.parse.parse_qs(url.query)
+        key_type = params.get("key_type", [""])[0]
+        key_blob = params.get("key", [""])[0]
+        if not key_type or not key_blob:
+            self._reply(200, "")
+            return
+
+        answer = self.resolver.resolve(key_type, key_blob)
+        self._reply(200, answer + "\n" if answer else "")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve() -> None:
+    os.makedirs(os.path.dirname(SOCKET_PATH), exist_ok=True)
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+
+    ResolverRequestHandler.resolver = Resolver()
+    server = ThreadingUnixHTTPServer(SOCKET_PATH, ResolverRequestHandler)
+
+    # sshd runs the AuthorizedKeysCommand as AuthorizedKeysCommandUser
+    try:
+        import pwd
+        owner = pwd.getpwnam(SOCKET_OWNER)
+        os.chown(SOCKET_PATH, owner.pw_uid, owner.pw_gid)
+        os.chmod(SOCKET_PATH, 0o600)
+    except (KeyError, OSError) as e:
+        logger.warning("Could not restrict socket to %s (%s), allowing all local users", SOCKET_OWNER, e)
+        os.chmod(SOCKET_PATH, 0o666)
+
+    threading.Thread(target=ResolverRequestHandler.resolver.snapshot.flush_forever, daemon=True).start()
+
+    logger.info(
+        "Listening on %s | backend=%s:%d | ttl=+%ss/-%ss",
+        SOCKET_PATH, BACKEND_HOST, BACKEND_PORT, POSITIVE_TTL, NEGATIVE_TTL,
+    )
+    try:
+        server.serve_forever()
+    finally:
+        ResolverRequestHandler.resolver.snapshot.flush()
+        server.server_close()
+        if os.path.exists(SOCKET_PATH):
+            os.unlink(SOCKET_PATH)
+
+
+if __name__ == "__main__":
+    serve()
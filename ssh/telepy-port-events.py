@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Structured tunnel port-state publisher for the SSH container.
+
+Reverse tunnels show up as listening sockets opened by sshd.  This watcher
+reads the kernel's listening-socket tables (/proc/net/tcp, /proc/net/tcp6)
+every PORT_WATCH_INTERVAL seconds — no process is spawned, so a short
+interval is cheap — and publishes every change atomically (one Lua script):
+
+    tunnel_ports:listening:<gateway>  hash    port -> listening since (unix time)
+    tunnel_ports:version              counter incremented on every change (all gateways)
+    tunnel_ports:events               stream  gateway, port, status (connected|disconnected), ts, version
+
+`<gateway>` is this node's TELEPY_GATEWAY_NAME (see `services/gateways.py`
+in the backend); every node also refreshes a heartbeat key,
+tunnel_ports:gateway:<gateway>, which expires when the node is gone.
+
+The backend port monitor (`authorized_keys/port_monitor.py`) reads the hashes
+once and then only the stream entries after the version it has applied.
+Every TELEPY_PORT_RESYNC_INTERVAL seconds the published hash is compared
+with the local state and repaired (e.g. after a Redis restart).
+
+Only the standard library is used (Redis is spoken over RESP directly).
+"""
+import os
+import sys
+import time
+import socket
+import logging
+
+REDIS_HOST = os.environ.get("TELEPY_REDIS_HOST", "redis")
+REDIS_PORT = int(os.environ.get("TELEPY_REDIS_PORT", "6379"))
+
+GATEWAY_NAME = os.environ.get("TELEPY_GATEWAY_NAME", "default")
+LISTENING_KEY = f"tunnel_ports:listening:{GATEWAY_NAME}"
+HEARTBEAT_KEY = f"tunnel_ports:gateway:{GATEWAY_NAME}"
+VERSION_KEY = "tunnel_ports:version"
+EVENTS_STREAM = "tunnel_ports:events"
+EVENTS_MAXLEN = int(os.environ.get("TELEPY_PORT_EVENTS_MAXLEN", "10000"))
+WATCH_INTERVAL = float(os.environ.get("PORT_WATCH_INTERVAL", "0.25"))
+RESYNC_INTERVAL = float(os.environ.get("TELEPY_PORT_RESYNC_INTERVAL", "30"))
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TTL = 15
+
+# KEYS: listening hash, version, events stream
+# ARGV: stream maxlen, ts, gateway, then port/status pairs
+PUBLISH_SCRIPT = """
+local version = redis.call('INCR', KEYS[2])
+for i = 4, #ARGV, 2 do
+    local port, status = ARGV[i], ARGV[i + 1]
+    if status == 'connected' then
+        redis.call('HSET', KEYS[1], port, ARGV[2])
+    else
+        redis.call('HDEL', KEYS[1], port)
+    end
+    redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[1], '*',
+               'gateway', ARGV[3], 'port', port, 'status', status, 'ts', ARGV[2], 'version', version)
+    if i + 2 <= #ARGV then
+        version = redis.call('INCR', KEYS[2])
+    end
+end
+return version
+"""
+
+PROC_TABLES = ("/proc/net/tcp", "/proc/net/tcp6")
+TCP_LISTEN = "0A"
+# Addresses sshd binds remote forwards to (GatewayPorts no → loopback)
+LOOPBACK_OR_ANY = {
+    "0100007F",                              # 127.0.0.1
+    "00000000",                              # 0.0.0.0
+    "00000000000000000000000001000000",      # ::1
+    "00000000000000000000000000000000",      # ::
+}
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] [telepy-port-events] [%(levelname)s] - %(message)s",
+    stream=sys.stdout,
+)
+logger = logging.getLogger("telepy-port-events")
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisClient:
+    """Minimal blocking RESP client (one connection, reconnects on failure)."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.reader = None
+
+    def connect(self) -> None:
+        self.sock = socket.create_connection((self.host, self.port), timeout=5)
+        self.reader = self.sock.makefile("rb")
+
+    def close(self) -> None:
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+
+    @staticmethod
+    def encode(*args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        return b"".join(parts)
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            return None if count < 0 else [self.read_reply() for _ in range(count)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def pipeline(self, commands):
+        """Send several commands in one write and return their replies."""
+        if self.sock is None:
+            self.connect()
+        try:
+            self.sock.sendall(b"".join(self.encode(*command) for command in commands))
+            return [self.read_reply() for _ in commands]
+        except (OSError, ConnectionError):
+            self.close()
+            raise
+
+
+def read_listening_ports() -> set:
+    ports = set()
+    for table in PROC_TABLES:
+        try:
+            with open(table, "r") as f:
+                next(f, None)  # header
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 4 or fields[3] != TCP_LISTEN:
+                        continue
+                    address, _, port_hex = fields[1].partition(":")
+                    if address in LOOPBACK_OR_ANY:
+                        ports.add(int(port_hex, 16))
+        except OSError:
+            continue
+    return ports
+
+
+def publish(client: RedisClient, connected: set, disconnected: set) -> int:
+    """Apply the changes to the published state; returns the new version."""
+    changes = [(port, "connected") for port in sorted(connected)] + \
+              [(port, "disconnected") for port in sorted(disconnected)]
+    args = [EVENTS_MAXLEN, f"{time.time():.6f}", GATEWAY_NAME]
+    for port, status in changes:
+        args += [port, status]
+    (version,) = client.pipeline([
+        ("EVAL", PUBLISH_SCRIPT, 3, LISTENING_KEY, VERSION_KEY, EVENTS_STREAM, *args),
+    ])
+    return version
+
+
+def published_ports(client: RedisClient) -> set:
+    (ports,) = client.pipeline([("HKEYS", LISTENING_KEY)])
+    return {int(port) for port in ports or []}
+
+
+def heartbeat(client: RedisClient) -> None:
+    client.pipeline([("SET", HEARTBEAT_KEY, f"{time.time():.0f}", "EX", HEARTBEAT_TTL)])
+
+
+def watch() -> None:
+    client = RedisClient(REDIS_HOST, REDIS_PORT)
+    current = read_listening_ports()
+    # Last state known to be published; None forces a comparison with Redis
+    published = None
+    last_resync = 0.0
+    last_heartbeat = 0.0
+    logger.info(
+        "Watching listening sockets | gateway=%s | interval=%ss | ports=%d",
+        GATEWAY_NAME, WATCH_INTERVAL, len(current),
+    )
+
+    while True:
+        try:
+            if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                heartbeat(client)
+                last_heartbeat = time.monotonic()
+            if published is None or time.monotonic() - last_resync >= RESYNC_INTERVAL:
+                published = published_ports(client)
+                last_resync = time.monotonic()
+
+            connected, disconnected = current - published, published - current
+            if connected or disconnected:
+                version = publish(client, connected, disconnected)
+                logger.info(
+                    "Published version %d | connected=%s | disconnected=%s",
+                    version, sorted(connected), sorted(disconnected),
+                )
+            published = current
+        except (OSError, ConnectionError, RedisError) as e:
+            logger.warning("Failed to publish port state (%s), will retry", e)
+            published = None
+            time.sleep(1)
+
+        time.sleep(WATCH_INTERVAL)
+        current = read_listening_ports()
+
+
+if __name__ == "__main__":
+    watch()